@@ -0,0 +1,112 @@
+"""
+Compares compiled schemas with FormEncode's own ``Schema.to_python()``.
+
+Usage::
+
+    python benchmarks/bench_compiler.py [--fields N] [--rows N] [--runs N]
+
+Two schemas are validated: a flat one with ``--fields`` fields of assorted
+types (String, Int, Number, OneOf and Email), like the large form of the
+load test application, and one with ``--rows`` rows of a ``ForEach``. Each
+is timed with a valid payload and with one where a tenth of the fields are
+invalid, and the best time per call of ``--runs`` runs is reported along
+with the speedup. The results of both are checked to be the same.
+"""
+import argparse
+import sys
+import timeit
+
+import formencode
+from formencode import Schema, validators
+
+from pyramid_simpleform import State
+from pyramid_simpleform.compiler import compile_schema
+
+COLORS = ('red', 'green', 'blue')
+
+
+def flat_schema(fields):
+    kinds = (validators.String(max=100), validators.Int(min=0),
+             validators.Number(), validators.OneOf(COLORS),
+             validators.Email())
+    return type('FlatSchema', (Schema,), dict(
+        [('f%d' % i, kinds[i % 5]) for i in range(fields)],
+        allow_extra_fields=True, filter_extra_fields=True))
+
+
+def flat_payload(fields, valid):
+    values = ('Some text', '42', '4.5', 'green', 'jane@example.com')
+    payload = {}
+    for i in range(fields):
+        value = values[i % 5]
+        if not valid and i % 10 == 1:
+            value = 'x'
+        payload['f%d' % i] = value
+    return payload
+
+
+class RowSchema(Schema):
+    email = validators.Email(not_empty=True)
+    name = validators.String(max=50)
+    quantity = validators.Int(min=1, not_empty=True)
+
+
+class NestedSchema(Schema):
+    title = validators.String(not_empty=True, max=100)
+    rows = formencode.ForEach(RowSchema())
+
+
+def nested_payload(rows, valid):
+    return {'title': 'Order', 'rows': [
+        {'email': 'user%d@example.com' % i, 'name': 'Name %d' % i,
+         'quantity': str(i + 1) if valid or i % 10 else '0'}
+        for i in range(rows)]}
+
+
+def outcome(validate, payload):
+    try:
+        return validate(payload, State())
+    except formencode.Invalid as e:
+        return e.unpack_errors()
+
+
+def best(validate, payload, runs, number):
+    return min(timeit.repeat(lambda: outcome(validate, payload),
+                             number=number, repeat=runs)) / number
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--fields', type=int, default=200)
+    parser.add_argument('--rows', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--number', type=int, default=100)
+    args = parser.parse_args(argv[1:])
+
+    cases = []
+    for valid in (True, False):
+        cases.append(('%d fields' % args.fields, flat_schema(args.fields),
+                      flat_payload(args.fields, valid), valid))
+    for valid in (True, False):
+        cases.append(('%d rows' % args.rows, NestedSchema,
+                      nested_payload(args.rows, valid), valid))
+
+    print('%-12s %-8s %12s %12s %8s' % (
+        'schema', 'payload', 'to_python', 'compiled', 'speedup'))
+    for name, schema, payload, valid in cases:
+        original = schema().to_python
+        compiled = compile_schema(schema)
+        if repr(outcome(original, payload)) != \
+                repr(outcome(compiled, payload)):
+            print('%s: results differ' % name)
+            return 1
+        before = best(original, payload, args.runs, args.number)
+        after = best(compiled, payload, args.runs, args.number)
+        print('%-12s %-8s %9.1f us %9.1f us %7.1fx' % (
+            name, 'valid' if valid else 'invalid', before * 1e6,
+            after * 1e6, before / after))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Measures what skipping htmlfill saves when there is nothing to fill in.
+
+Usage::
+
+    python benchmarks/bench_htmlfill.py [--sizes N,N,...] [--runs N]
+
+For each size, a page with that many fields of assorted kinds (text
+inputs, selects, checkboxes and textareas) is filled by ``Form.htmlfill()``
+of a form with no data and no errors, as on a first GET, and the best time
+per call of ``--runs`` runs is compared with that of ``htmlfill.render()``.
+A second page has a value already in its last field, so that htmlfill has
+to run: its time shows the cost of scanning the markup before running it.
+"""
+import argparse
+import sys
+import timeit
+
+from formencode import htmlfill
+from pyramid import testing
+
+from pyramid_simpleform import Form
+
+
+def page(fields, prefilled):
+    parts = ['<html><body><h1>Form</h1>\n<form method="post" action=".">']
+    for i in range(fields):
+        name = 'f%d' % i
+        parts.append('<div><label for="%s">Field %d</label>' % (name, i))
+        kind = i % 4
+        if kind == 0:
+            parts.append('<input type="text" id="%s" name="%s" size="20">'
+                         % (name, name))
+        elif kind == 1:
+            parts.append('<select id="%s" name="%s"><option value="red">'
+                         'Red</option><option value="blue">Blue</option>'
+                         '</select>' % (name, name))
+        elif kind == 2:
+            parts.append('<input type="checkbox" id="%s" name="%s" '
+                         'value="1">' % (name, name))
+        else:
+            parts.append('<textarea id="%s" name="%s"></textarea>'
+                         % (name, name))
+        parts.append('</div>')
+    if prefilled:
+        parts.append('<input type="hidden" name="token" value="abc">')
+    parts.append('<input type="submit" value="Save"></form></body></html>')
+    return '\n'.join(parts)
+
+
+def best(function, runs, number):
+    return min(timeit.repeat(function, number=number, repeat=runs)) / number
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args(argv[1:])
+
+    form = Form(testing.DummyRequest())
+
+    print('%-7s %-10s %12s %12s %8s' % (
+        'fields', 'page', 'htmlfill', 'Form', 'speedup'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for prefilled in (False, True):
+            html = page(size, prefilled)
+            skipped = form.htmlfill(html) is html
+            if skipped == prefilled:
+                print('%d fields: htmlfill %s' % (
+                    size, 'skipped' if skipped else 'not skipped'))
+                return 1
+            before = best(lambda: htmlfill.render(html, encoding='utf-8'),
+                          args.runs, args.number)
+            after = best(lambda: form.htmlfill(html), args.runs, args.number)
+            print('%-7d %-10s %9.1f us %9.1f us %7.1fx' % (
+                size, 'prefilled' if prefilled else 'empty', before * 1e6,
+                after * 1e6, before / after))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Measures the import time of pyramid_simpleform with ``python -X importtime``.
+
+Usage::
+
+    python benchmarks/bench_import.py [--runs N] [--max-ms MS] [module ...]
+
+Each module (``pyramid_simpleform`` by default) is imported in a fresh
+interpreter ``--runs`` times. The best cumulative import time is reported
+along with the slowest modules it pulled in. With ``--max-ms`` the script
+exits with status 1 if the best time is over the limit, so it can be used
+to catch import time regressions.
+"""
+import argparse
+import subprocess
+import sys
+
+
+def import_times(module):
+    """
+    Returns a list of ``(cumulative microseconds, module name)`` for every
+    module imported by a fresh interpreter importing `module`.
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('modules', nargs='*', default=['pyramid_simpleform'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args(argv[1:])
+
+    failed = False
+    for module in args.modules:
+        runs = [import_times(module) for i in range(args.runs)]
+        best = min(runs, key=lambda times: dict(
+            (name, us) for us, name in times)[module])
+        total = dict((name, us) for us, name in best)[module] / 1000.0
+
+        print('%s: %.1f ms (best of %d)' % (module, total, args.runs))
+        for us, name in sorted(best, reverse=True)[1:args.top + 1]:
+            print('    %8.1f ms  %s' % (us / 1000.0, name))
+
+        if args.max_ms is not None and total > args.max_ms:
+            print('%s: over the limit of %.1f ms' % (module, args.max_ms))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+WSGI application used to load test pyramid_simpleform.
+
+It serves a few typical forms, each handling GET (render the empty form)
+and POST (validate, then answer ``ok`` or render the form with errors):
+
+``/small``
+    three fields, rendered with a FormRenderer
+
+``/large``
+    200 fields of assorted types, rendered with htmlfill
+
+``/large/direct``
+    the large form rendered with FormRenderer widgets in direct-fill
+    mode, without htmlfill
+
+``/nested``
+    a title and a variable number of rows (``rows-0.email`` ...)
+
+``/upload``
+    a multipart form with a file checked by FileUpload
+
+``/api/nested``
+    the nested form as a JSON API
+
+Usage::
+
+    python app.py [--host HOST] [--port PORT]
+
+Run ``loadgen.py`` against it to measure throughput and latency.
+"""
+import argparse
+import os
+import socketserver
+import sys
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import formencode
+from formencode import Schema, validators
+from pyramid.config import Configurator
+from pyramid.response import Response
+from pyramid.session import SignedCookieSessionFactory
+
+from pyramid_simpleform import Form
+from pyramid_simpleform.renderers import FormRenderer
+from pyramid_simpleform.validators import FileUpload
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+COLORS = ('red', 'green', 'blue')
+
+LARGE_FIELDS = 200
+
+
+class SmallSchema(Schema):
+    allow_extra_fields = True
+    filter_extra_fields = True
+
+    name = validators.String(not_empty=True, max=50)
+    email = validators.Email(not_empty=True)
+    age = validators.Int(min=0, max=150)
+
+
+def large_field(i):
+    """
+    Returns the type and validator of field ``f<i>`` of the large form.
+    """
+    kind = ('text', 'int', 'number', 'color', 'email')[i % 5]
+    if kind == 'text':
+        validator = validators.String(max=100)
+    elif kind == 'int':
+        validator = validators.Int(min=0)
+    elif kind == 'number':
+        validator = validators.Number()
+    elif kind == 'color':
+        validator = validators.OneOf(COLORS)
+    else:
+        validator = validators.Email()
+    return kind, validator
+
+
+LARGE_FIELD_TYPES = [('f%d' % i, large_field(i)[0])
+                     for i in range(LARGE_FIELDS)]
+
+LargeSchema = type('LargeSchema', (Schema,), dict(
+    [('f%d' % i, large_field(i)[1]) for i in range(LARGE_FIELDS)],
+    allow_extra_fields=True,
+    filter_extra_fields=True))
+
+
+class RowSchema(Schema):
+    email = validators.Email(not_empty=True)
+    name = validators.String(max=50)
+    quantity = validators.Int(min=1, not_empty=True)
+
+
+class NestedSchema(Schema):
+    allow_extra_fields = True
+    filter_extra_fields = True
+
+    title = validators.String(not_empty=True, max=100)
+    rows = formencode.ForEach(RowSchema())
+
+
+class UploadSchema(Schema):
+    allow_extra_fields = True
+    filter_extra_fields = True
+
+    title = validators.String(not_empty=True, max=100)
+    upload = FileUpload(max_size=1024 * 1024,
+                        allowed_types=['image/png', 'image/jpeg',
+                                       'application/pdf'])
+
+
+def small(request):
+    form = Form(request, 'small')
+    if form.validate():
+        return Response('ok')
+    return {'form': FormRenderer(form)}
+
+
+def large(request):
+    form = Form(request, 'large')
+    if form.validate():
+        return Response('ok')
+    return Response(form.render('large.mako', {'fields': LARGE_FIELD_TYPES}))
+
+
+def large_direct(request):
+    form = Form(request, 'large')
+    if form.validate():
+        return Response('ok')
+    return Response(form.render('large_direct.mako', {
+        'fields': LARGE_FIELD_TYPES, 'colors': COLORS}, direct_fill=True))
+
+
+def nested(request):
+    form = Form(request, 'nested', variable_decode=True)
+    if form.validate():
+        return Response('ok')
+    rows = form.data.get('rows') or [{}]
+    return {'form': FormRenderer(form), 'rows': rows}
+
+
+def upload(request):
+    form = Form(request, 'upload', multipart=True)
+    if form.validate():
+        uploaded = form.data['upload']
+        uploaded.file.close()
+        return Response('ok %s' % uploaded.digest)
+    return {'form': FormRenderer(form)}
+
+
+def api_nested(request):
+    form = Form(request, 'nested', variable_decode=True)
+    form.validate(force_validate=True)
+    return form.json_response()
+
+
+def make_app(settings=None):
+    """
+    Returns the WSGI application.
+    """
+    settings = dict(settings or {})
+    settings.setdefault('mako.directories', os.path.join(here, 'templates'))
+
+    config = Configurator(settings=settings)
+    config.set_session_factory(SignedCookieSessionFactory(
+        settings.get('session.secret', 'loadtest')))
+    config.include('pyramid_mako')
+    config.include('pyramid_simpleform')
+
+    config.add_form_schema('small', SmallSchema, templates='small.mako')
+    config.add_form_schema('large', LargeSchema, templates='large.mako')
+    config.add_form_schema('nested', NestedSchema, templates='nested.mako')
+    config.add_form_schema('upload', UploadSchema, templates='upload.mako')
+
+    for name, view, renderer in (
+            ('small', small, 'small.mako'),
+            ('large', large, None),
+            ('large_direct', large_direct, None),
+            ('nested', nested, 'nested.mako'),
+            ('upload', upload, 'upload.mako'),
+            ('api_nested', api_nested, None)):
+        config.add_route(name, '/' + name.replace('_', '/'))
+        config.add_view(view, route_name=name, renderer=renderer)
+
+    return config.make_wsgi_app()
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_app_server(host='127.0.0.1', port=6543, settings=None):
+    """
+    Returns a threaded ``wsgiref`` server for the application; use port 0
+    for a free port.
+    """
+    return make_server(host, port, make_app(settings),
+                       server_class=ThreadingWSGIServer,
+                       handler_class=QuietHandler)
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6543)
+    args = parser.parse_args(argv[1:])
+
+    server = make_app_server(args.host, args.port)
+    print('Serving on http://%s:%d' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
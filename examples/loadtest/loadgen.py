@@ -0,0 +1,298 @@
+"""
+Concurrent load generator for the load test application.
+
+Usage::
+
+    python loadgen.py [--url URL] [--duration SECONDS] [--concurrency N]
+                      [--invalid RATIO] [--json] [endpoint ...]
+
+Requests are sent to each endpoint in turn (all of ``small``, ``large``,
+``large_direct``, ``nested``, ``upload`` and ``api`` by default) from
+``--concurrency`` threads for ``--duration`` seconds. POSTs alternate with GETs, and
+``--invalid`` of the POSTs have errors so both the success and the error
+path are exercised. The number of requests, errors, throughput and latency
+percentiles are then reported per endpoint.
+
+Without ``--url`` the application is started in this process on a free
+port, which is convenient on a laptop but means the client and the server
+share the CPU; for more realistic numbers run ``app.py`` separately.
+"""
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode, urlsplit
+except ImportError:
+    sys.exit('loadgen.py needs Python 3')
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * (64 * 1024)
+
+
+def multipart(fields, files):
+    """
+    Returns the content type and body of a multipart form with `fields`
+    (a list of ``(name, value)``) and `files` (a list of ``(name,
+    filename, content)``).
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(
+            '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n'
+            '%s\r\n' % (boundary, name, value))
+    body = ''.join(parts).encode('utf-8')
+    for name, filename, content in files:
+        body += (
+            '--%s\r\nContent-Disposition: form-data; name="%s"; '
+            'filename="%s"\r\nContent-Type: application/octet-stream'
+            '\r\n\r\n' % (boundary, name, filename)).encode('utf-8')
+        body += content + b'\r\n'
+    body += ('--%s--\r\n' % boundary).encode('utf-8')
+    return 'multipart/form-data; boundary=%s' % boundary, body
+
+
+def form(fields):
+    return ('application/x-www-form-urlencoded',
+            urlencode(fields).encode('utf-8'))
+
+
+def small_post(valid):
+    return form([('name', 'Jane Doe'),
+                 ('email', 'jane@example.com' if valid else 'jane'),
+                 ('age', '42')])
+
+
+def large_post(valid):
+    fields = []
+    for i in range(200):
+        kind = i % 5
+        if kind == 0:
+            value = 'Some text %d' % i
+        elif kind == 1:
+            value = str(i) if valid or i % 10 != 1 else 'x'
+        elif kind == 2:
+            value = '%d.5' % i
+        elif kind == 3:
+            value = 'green'
+        else:
+            value = 'user%d@example.com' % i
+        fields.append(('f%d' % i, value))
+    return form(fields)
+
+
+def nested_fields(valid, rows=50):
+    fields = [('title', 'Order')]
+    for i in range(rows):
+        fields.append(('rows-%d.email' % i, 'user%d@example.com' % i))
+        fields.append(('rows-%d.name' % i, 'Name %d' % i))
+        fields.append(('rows-%d.quantity' % i,
+                       str(i + 1) if valid or i % 10 else '0'))
+    return fields
+
+
+def nested_post(valid):
+    return form(nested_fields(valid))
+
+
+def upload_post(valid):
+    return multipart([('title', 'Picture')],
+                     [('upload', 'picture.png',
+                       PNG if valid else b'not an image' * 100)])
+
+
+def api_post(valid):
+    rows = []
+    for name, value in nested_fields(valid):
+        if name == 'title':
+            continue
+        index, field = name[len('rows-'):].split('.')
+        if field == 'email':
+            rows.append({})
+        rows[-1][field] = value
+    body = {'title': 'Order', 'rows': rows}
+    return 'application/json', json.dumps(body).encode('utf-8')
+
+
+#: name: (path, function returning the content type and body of a POST,
+#: whether to send GETs as well)
+ENDPOINTS = {
+    'small': ('/small', small_post, True),
+    'large': ('/large', large_post, True),
+    'large_direct': ('/large/direct', large_post, True),
+    'nested': ('/nested', nested_post, True),
+    'upload': ('/upload', upload_post, True),
+    'api': ('/api/nested', api_post, False),
+}
+
+
+def requests_for(name, invalid):
+    """
+    Returns a list of ``(label, method, path, headers, body)`` for endpoint
+    `name`, repeated in turn by the workers.
+    """
+    path, make_post, get = ENDPOINTS[name]
+    posts = max(int(round(1 / invalid)) if invalid else 1, 1)
+    requests = []
+    for i in range(posts):
+        valid = not invalid or i != 0
+        content_type, body = make_post(valid)
+        requests.append(('%s POST' % name, 'POST', path,
+                         {'Content-Type': content_type}, body))
+        if get:
+            requests.append(('%s GET' % name, 'GET', path, {}, None))
+    return requests
+
+
+def percentile(values, p):
+    """
+    Returns the `p` percentile of sorted `values` (nearest rank).
+    """
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, host, port, requests, deadline, offset):
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.requests = requests
+        self.deadline = deadline
+        self.offset = offset
+        self.latencies = {}
+        self.errors = {}
+
+    def run(self):
+        conn = HTTPConnection(self.host, self.port, timeout=30)
+        cycle = itertools.islice(itertools.cycle(self.requests),
+                                 self.offset, None)
+        for label, method, path, headers, body in cycle:
+            if time.time() >= self.deadline:
+                break
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                failed = response.status >= 500
+            except (OSError, IOError):
+                conn.close()
+                conn = HTTPConnection(self.host, self.port, timeout=30)
+                failed = True
+            elapsed = time.perf_counter() - start
+            if failed:
+                self.errors[label] = self.errors.get(label, 0) + 1
+            else:
+                self.latencies.setdefault(label, []).append(elapsed)
+        conn.close()
+
+
+def run(host, port, endpoints, duration, concurrency, invalid):
+    """
+    Runs the load test and returns a list of result dicts, one per
+    endpoint and method.
+    """
+    requests = []
+    for name in endpoints:
+        requests.extend(requests_for(name, invalid))
+
+    deadline = time.time() + duration
+    workers = [Worker(host, port, requests, deadline,
+                      i * len(requests) // concurrency)
+               for i in range(concurrency)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    labels = []
+    for label, method, path, headers, body in requests:
+        if label not in labels:
+            labels.append(label)
+
+    results = []
+    for label in labels:
+        latencies = sorted(itertools.chain.from_iterable(
+            worker.latencies.get(label, []) for worker in workers))
+        errors = sum(worker.errors.get(label, 0) for worker in workers)
+        results.append({
+            'endpoint': label,
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 50) * 1000,
+            'p90': percentile(latencies, 90) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+        })
+    return results
+
+
+def print_results(results, out=sys.stdout):
+    header = ('endpoint', 'requests', 'errors', 'req/s',
+              'p50 ms', 'p90 ms', 'p99 ms', 'max ms')
+    out.write('%-18s %9s %7s %9s %9s %9s %9s %9s\n' % header)
+    for r in results:
+        out.write('%-18s %9d %7d %9.1f %9.2f %9.2f %9.2f %9.2f\n' % (
+            r['endpoint'], r['requests'], r['errors'], r['rps'],
+            r['p50'], r['p90'], r['p99'], r['max']))
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('endpoints', nargs='*', metavar='endpoint',
+                        help='one of %s' % ', '.join(sorted(ENDPOINTS)))
+    parser.add_argument('--url', help='URL of a running app.py')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--invalid', type=float, default=0.25,
+                        help='ratio of POSTs with errors')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv[1:])
+    for name in args.endpoints:
+        if name not in ENDPOINTS:
+            parser.error('unknown endpoint %r' % name)
+    endpoints = args.endpoints or sorted(ENDPOINTS)
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        from app import make_app_server
+        server = make_app_server(port=0)
+        host, port = server.server_address
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        results = run(host, port, endpoints, args.duration,
+                      args.concurrency, args.invalid)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_results(results)
+    if any(r['errors'] for r in results):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,11 @@
+<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <title>${self.title()}</title>
+</head>
+<body>
+  <h1>${self.title()}</h1>
+  ${next.body()}
+</body>
+</html>
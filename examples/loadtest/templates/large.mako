@@ -0,0 +1,20 @@
+<%inherit file="base.mako"/>
+<%def name="title()">Large form</%def>
+<form action="${request.route_url('large')}" method="post">
+% for name, kind in fields:
+<div>
+  <label for="${name}">${name}</label>
+  % if kind == 'color':
+  <select id="${name}" name="${name}">
+    <option value="red">red</option>
+    <option value="green">green</option>
+    <option value="blue">blue</option>
+  </select>
+  % else:
+  <input type="text" id="${name}" name="${name}">
+  % endif
+  <form:error name="${name}">
+</div>
+% endfor
+<input type="submit" name="submit" value="Save">
+</form>
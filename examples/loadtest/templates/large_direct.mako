@@ -0,0 +1,15 @@
+<%inherit file="base.mako"/>
+<%def name="title()">Large form</%def>
+${renderer.begin(request.route_url('large_direct'))}
+% for name, kind in fields:
+<div>
+  ${renderer.label(name, name)}
+  % if kind == 'color':
+  ${renderer.select(name, colors)}
+  % else:
+  ${renderer.text(name)}
+  % endif
+</div>
+% endfor
+${renderer.submit('submit', 'Save')}
+${renderer.end()}
@@ -0,0 +1,24 @@
+<%inherit file="base.mako"/>
+<%def name="title()">Nested form</%def>
+${form.begin(request.route_url('nested'))}
+${form.csrf_token()}
+<div>
+  ${form.errorlist('title')}
+  ${form.label('title')}
+  ${form.text('title')}
+</div>
+<table>
+% for i, row in enumerate(rows):
+<tr>
+  % for field in ('email', 'name', 'quantity'):
+  <% name = 'rows-%d.%s' % (i, field) %>
+  <td>
+    ${form.errorlist(name)}
+    ${form.text(name, value=row.get(field) if isinstance(row, dict) else None)}
+  </td>
+  % endfor
+</tr>
+% endfor
+</table>
+${form.submit('submit', 'Save')}
+${form.end()}
@@ -0,0 +1,13 @@
+<%inherit file="base.mako"/>
+<%def name="title()">Small form</%def>
+${form.begin(request.route_url('small'))}
+${form.csrf_token()}
+% for name in ('name', 'email', 'age'):
+<div>
+  ${form.errorlist(name)}
+  ${form.label(name)}
+  ${form.text(name)}
+</div>
+% endfor
+${form.submit('submit', 'Save')}
+${form.end()}
@@ -0,0 +1,16 @@
+<%inherit file="base.mako"/>
+<%def name="title()">Upload form</%def>
+${form.begin(request.route_url('upload'), multipart=True)}
+${form.csrf_token()}
+<div>
+  ${form.errorlist('title')}
+  ${form.label('title')}
+  ${form.text('title')}
+</div>
+<div>
+  ${form.errorlist('upload')}
+  ${form.label('upload')}
+  ${form.file('upload')}
+</div>
+${form.submit('submit', 'Upload')}
+${form.end()}
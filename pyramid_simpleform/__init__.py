@@ -1,9 +1,23 @@
-from formencode import htmlfill
-from formencode import variabledecode
-from formencode import Invalid
+from collections import OrderedDict
 
-from pyramid.i18n import get_localizer, TranslationStringFactory, TranslationString
-from pyramid.renderers import render
+from formencode import Invalid
+from formencode.schema import format_compound_error
+
+from translationstring import TranslationStringFactory, TranslationString
+
+from pyramid_simpleform.batching import discard_pending, resolve_pending
+from pyramid_simpleform.cache import copy_data, payload_hash
+from pyramid_simpleform.errors import ErrorMessage, ErrorStore, as_error_store
+from pyramid_simpleform.errors import detach_state, iter_messages
+from pyramid_simpleform.errors import nest_errors, strip_tracebacks
+from pyramid_simpleform.filling import DEFAULT_NORMALIZE, needs_fill
+from pyramid_simpleform.instrumentation import NOOP_TRACER, measure
+from pyramid_simpleform.instrumentation import schema_name
+from pyramid_simpleform.jsonbody import get_json_body, resolve_json_encoder
+from pyramid_simpleform.limits import InputLimits, PayloadRejected, get_limits
+from pyramid_simpleform.plans import BudgetExhausted, ErrorBudget
+from pyramid_simpleform.plans import get_plan, is_cacheable, message_codes
+from pyramid_simpleform.plans import validation_cost
 
 try:
     _text = basestring
@@ -11,6 +25,26 @@ except NameError:
     _text = str
 
 
+class _NullContext(object):
+    # contextlib.nullcontext() is only in Python 3.7+
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_nullcontext = _NullContext()
+
+
+def _unbound(func):
+    # Python 2 turns functions read from a class into unbound methods
+    if getattr(func, '__self__', False) is None:
+        return func.__func__
+    return func
+
+
 class State(object):
     """
     Default "empty" state object.
@@ -41,17 +75,52 @@ class State(object):
     def get(self, k, default=None):
         return getattr(self, k, default)
 
+
+class UnknownField(ValueError):
+    """
+    Raised by :meth:`Form.validate_field` for names which aren't fields
+    of the form, e.g. when the name comes from a client.
+    """
+
 fe_tsf = TranslationStringFactory('FormEncode')
 
 
+def includeme(config):
+    """
+    Sets up pyramid_simpleform with ``config.include('pyramid_simpleform')``:
+    adds the ``config.add_form_schema()`` directive and the
+    ``request.simpleform()`` method, and warms up registered schemas when
+    the configuration is committed.
+    """
+    from pyramid_simpleform.config import includeme
+    includeme(config)
+
+
 def get_default_translate_fn(request):
-    pyramid_translate = get_localizer(request).translate
+    """
+    Returns a function translating FormEncode messages with the request
+    localizer. The localizer is only looked up once the first message is
+    translated, and each message is only translated once.
+
+    Translated messages are :class:`pyramid_simpleform.errors.ErrorMessage`
+    instances which remember their untranslated template.
+    """
+    translations = {}
+    localizer = []
 
     def translate(s):
-        if not isinstance(s, TranslationString):
-            s = fe_tsf(s)
+        try:
+            return translations[s]
+        except KeyError:
+            pass
 
-        return pyramid_translate(s)
+        if not localizer:
+            from pyramid.i18n import get_localizer
+            localizer.append(get_localizer(request))
+
+        ts = s if isinstance(s, TranslationString) else fe_tsf(s)
+        result = translations[s] = ErrorMessage(localizer[0].translate(ts), s)
+        return result
 
     return translate
 
@@ -63,7 +132,8 @@ class Form(object):
 
     `request` : Pyramid request instance
 
-    `schema`  : FormEncode Schema class or instance
+    `schema`  : FormEncode Schema class or instance, or the name of a
+    schema registered with ``config.add_form_schema()``
 
     `validators` : a dict of FormEncode validators i.e. { field : validator }
 
@@ -71,7 +141,8 @@ class Form(object):
 
     `obj`        : instance of an object (e.g. SQLAlchemy model)
 
-    `state`      : state passed to FormEncode validators.
+    `state`      : state passed to FormEncode validators. The request is
+    set as its **request** attribute unless it already has one.
 
     `method`        : HTTP method
 
@@ -81,55 +152,234 @@ class Form(object):
 
     `list_char`       : variabledecode list char
 
+    `max_errors`      : stop validating once this many errors are found.
+    Fields are then validated cheapest first (see
+    :func:`pyramid_simpleform.plans.validation_cost`) and
+    **errors_truncated** is set if validation was cut short.
+
+    `fail_fast`       : shortcut for ``max_errors=1``
+
+    `limits`          : :class:`pyramid_simpleform.limits.InputLimits` on
+    the size and shape of the params, checked before they are decoded. If
+    the params break a limit validation fails with a single form error
+    (under the empty key) and **payload_rejected** is set. By default
+    limits are read from the ``simpleform.max_*`` settings.
+
+    `cache`           : look up and store the result of validation in the
+    **result_cache**, if there is one. Pass **False** for forms whose
+    validators have side effects. **result_from_cache** is set if the
+    result was found in the cache.
+
     Also note that values of ``obj`` supercede those of ``defaults``. Only
     fields specified in your schema or validators will be taken from the 
-    object.
+    object. See :meth:`pyramid_simpleform.plans.SchemaPlan.loader_options`
+    for loading just those fields from the database in a single query.
+
+    On a first GET, with no data and no errors, **htmlfill()** skips
+    htmlfill unless it would change the markup in one of the ways listed
+    in **htmlfill_normalize**. Add ``'markup'`` to it to always run
+    htmlfill.
+
+    With **direct_fill** set, **render()** skips htmlfill and leaves
+    filling in the form to the widgets of **FormRenderer**. Set
+    **check_direct_fill** (or the ``simpleform.check_direct_fill``
+    setting) during development to be warned about fields the renderer
+    didn't emit.
+
+    Schemas are run through the function generated for them by
+    :func:`pyramid_simpleform.compiler.compile_schema`, which returns the
+    same data and errors faster. Set **compiled** to **False** on a
+    subclass to run them as they are.
     """
 
     default_state = State
+    limits = None
+    result_cache = None
+    instruments = ()
+    tracer = None
+    json_decoder = None
+    json_encoder = None
+    compiled = True
+    htmlfill_normalize = DEFAULT_NORMALIZE
+    direct_fill = False
+    check_direct_fill = None
+    _direct_fill_fields = None
 
     def __init__(self, request, schema=None, validators=None, defaults=None, 
                  obj=None, extra=None, include=None, exclude=None, state=None, 
                  method="POST", variable_decode=False,  dict_char=".", 
-                 list_char="-", multipart=False, from_python=False):
-
-        self.request = request
-        self.schema = schema
-        self.validators = validators or {}
-        self.method = method
-        self.variable_decode = variable_decode
-        self.dict_char = dict_char
-        self.list_char = list_char
-        self.multipart = multipart
-        self.state = state
-
-        self.is_validated = False
+                 list_char="-", multipart=False, from_python=False,
+                 max_errors=None, fail_fast=False, limits=None, cache=True):
+
+        self.tracer = self._get_tracer(request)
+        with self.tracer.start_span('form.init') as span:
+            if isinstance(schema, _text):
+                from pyramid_simpleform.config import get_form_schema
+                form_schema = get_form_schema(request.registry, schema)
+                schema = form_schema.schema
+                if validators is None:
+                    validators = form_schema.validators
+
+            self.request = request
+            self.schema = schema
+            self.validators = validators or {}
+            self.method = method
+            self.variable_decode = variable_decode
+            self.dict_char = dict_char
+            self.list_char = list_char
+            self.multipart = multipart
+            self.state = state
+            self.max_errors = 1 if fail_fast else max_errors
+            if limits is not None:
+                self.limits = limits
+            self.cache = cache
+
+            self.is_validated = False
+            self.errors_truncated = False
+            self.payload_rejected = False
+            self.result_from_cache = False
+
+            self._invalid = None
+            self._errors = self._error_store()
+            self._params = None
+            self.data = {}
+
+            if self.state is None:
+                self.state = self.default_state()
+
+            if not hasattr(self.state, '_'):
+                self.state._ = get_default_translate_fn(request)
+
+            if not hasattr(self.state, 'request'):
+                self.state.request = request
+
+            if defaults:
+                self.data.update(defaults)
+
+            if obj:
+                plan = get_plan(self.schema, self.validators)
+                self.data.update(plan.getter(type(obj))(obj))
+
+            if schema and from_python:
+                self.data.update(schema.from_python(self.data))
+
+            # what dump_state() writes the differences from
+            self._initial_data = dict(self.data) if self.data else None
+
+            if span.recording:
+                span.set_attribute('schema', schema_name(schema))
+
+    @property
+    def errors(self):
+        """
+        Errors as an :class:`pyramid_simpleform.errors.ErrorStore`, or
+        whatever was assigned.
+
+        Errors of the whole form, e.g. from a chained validator, are
+        stored under the empty key, so they are ``errors['']`` or
+        ``errors_for('')``. Before 0.7 **errors** was then the message
+        itself, a string.
+
+        Schema errors are only unpacked into the store when this is
+        first accessed, and merged with the errors of the `validators`;
+        :meth:`error_count` and :meth:`first_error` don't need to unpack
+        them at all.
+        """
+        if self._invalid is not None:
+            invalid, self._invalid = self._invalid, None
+            errors = self._error_store(
+                invalid.unpack_errors(self.variable_decode,
+                                      self.dict_char,
+                                      self.list_char))
+            errors.update(self._errors)
+            self._errors = errors
+        return self._errors
+
+    @errors.setter
+    def errors(self, errors):
+        self._invalid = None
+        self._errors = errors
+
+    def _error_store(self, errors=None):
+        return as_error_store(errors, self.dict_char, self.list_char,
+                              self.variable_decode)
+
+    def _has_errors(self):
+        return self._invalid is not None or bool(self._errors)
+
+    def error_count(self):
+        """
+        Returns the number of errors.
+        """
+        if self._invalid is not None:
+            return sum(1 for message in self._packed_messages())
+        return len(self.all_errors())
 
-        self.errors = {}
-        self.data = {}
+    def first_error(self):
+        """
+        Returns the first error message, or **None** if there are no
+        errors.
+        """
+        if self._invalid is not None:
+            for message in self._packed_messages():
+                return message
+        errors = self.all_errors()
+        return errors[0] if errors else None
 
-        if self.state is None:
-            self.state = self.default_state()
+    def _packed_messages(self):
+        """
+        Yields the messages of the schema errors which haven't been
+        unpacked, less those that errors of the `validators` replace, and
+        then the latter.
+        """
+        invalid = self._invalid
+        replaced = self._errors
+        if replaced and invalid.error_dict:
+            for key, error in invalid.error_dict.items():
+                if isinstance(error, _text):
+                    if key not in replaced:
+                        yield error
+                    continue
+                # with variable_decode nested errors get keys of their own
+                if key in replaced and not (self.variable_decode and (
+                        error.error_dict or error.error_list)):
+                    continue
+                for message in iter_messages(error):
+                    yield message
+        else:
+            for message in iter_messages(invalid):
+                yield message
+        for message in replaced.all_errors():
+            yield message
 
-        if not hasattr(self.state, '_'):
-            self.state._ = get_default_translate_fn(request)
+    def error_codes(self):
+        """
+        Returns a dict mapping the path of each error to a list of
+        machine-readable error codes, i.e. the FormEncode message keys such
+        as ``missingValue`` or ``tooLong``. Codes don't depend on the
+        locale. Where the code can't be worked out (for example if the
+        state has its own translation function) it is **None**.
+        """
+        if not isinstance(self.errors, ErrorStore):
+            return {}
 
-        if defaults:
-            self.data.update(defaults)
+        codes = dict(get_plan(self.schema, self.validators).message_codes)
+        codes.update(message_codes([InputLimits]))
+        if self.validators:
+            codes.update(message_codes(self.validators.values()))
 
-        if obj:
-            fields = list(self.schema.fields.keys()) + list(self.validators.keys())
-            for f in fields:
-                if hasattr(obj, f):
-                    self.data[f] = getattr(obj, f)
-                    
-        if schema and from_python:
-            self.data.update(schema.from_python(self.data))
+        result = {}
+        for path, message in self.errors.flat():
+            template = getattr(message, 'template', None)
+            result.setdefault(path, []).append(codes.get(template))
+        return result
 
     def is_error(self, field):
         """
         Checks if individual field has errors.
         """
+        if isinstance(self.errors, ErrorStore):
+            return self.errors.is_error(field)
         return field in self.errors
 
     def all_errors(self):
@@ -140,6 +390,8 @@ class Form(object):
             return [self.errors]
         if isinstance(self.errors, list):
             return self.errors
+        if isinstance(self.errors, ErrorStore):
+            return self.errors.all_errors()
         errors = []
         try:
             iter_keys = self.errors.iterkeys()
@@ -154,6 +406,8 @@ class Form(object):
         """
         Returns any errors for a given field as a list.
         """
+        if isinstance(self.errors, ErrorStore):
+            return self.errors.errors_for(field)
         errors = self.errors.get(field, [])
         if isinstance(errors, _text):
             errors = [errors]
@@ -176,49 +430,249 @@ class Form(object):
         `force_validate`  : will run validation regardless of request method.
 
         `params`          : dict or MultiDict of params. By default 
-        will use **request.json_body** (if JSON body), **request.POST** (if HTTP POST) or **request.params**.
-        """
+        will use the JSON body (if JSON body), **request.POST** (if HTTP POST) or **request.params**.
 
+        The JSON body is decoded with **json_decoder**, which may be a
+        callable or a dotted name, set as a class attribute or as the
+        ``simpleform.json_decoder`` setting. By default the fastest decoder
+        installed is used (see
+        :func:`pyramid_simpleform.jsonbody.default_json_decoder`).
+        """
+        with self._measure('validate'):
+            with self.tracer.start_span('form.validate') as span:
+                result = self._validate(force_validate, params)
+                if span.recording:
+                    span.set_attribute('schema', schema_name(self.schema))
+                    span.set_attribute('fields', len(
+                        get_plan(self.schema, self.validators).fields))
+                    span.set_attribute('errors', self.error_count())
+                    span.set_attribute('valid', result)
+                return result
+
+    def _validate(self, force_validate, params):
         assert self.schema or self.validators, \
                 "validators and/or schema required"
 
         if self.is_validated:
-            return not(self.errors)
+            return not self._has_errors()
 
         if not force_validate:
             if self.method and self.method != self.request.method:
                 return False
 
+        params, json_body = self._get_params(params)
+        self._params = params
+
+        result_cache = self._get_result_cache()
+        result_key = None
+        if result_cache is not None:
+            result_key = self._result_key(params)
+        if result_key is not None:
+            result = result_cache.get(result_key)
+            if result is not None:
+                self._restore_result(result)
+                self.result_from_cache = True
+                self.is_validated = True
+                return not self._has_errors()
+
+        if not self._check_limits(params, json_body):
+            self.is_validated = True
+            return False
+
+        decoded = self._decode(params, json_body)
+
+        budget = None
+        if self.max_errors:
+            budget = ErrorBudget(self.max_errors)
+
+        pending = self.state._pending = []
         try:
-            json_body = self.request.json_body
-        except (AttributeError, ValueError):
-            json_body = None
-        if params is None:
-            if json_body:
-                params = json_body
-            elif self.method == "POST":
-                params = self.request.POST
+            self._run_validators(decoded, budget)
+        finally:
+            del self.state._pending
+
+        if pending:
+            if self._has_errors():
+                discard_pending(self.data)
             else:
-                params = self.request.params
-            
-        if self.variable_decode and not json_body:
-            decoded = variabledecode.variable_decode(
-                        params, self.dict_char, self.list_char)
+                with self.tracer.start_span('form.lookups',
+                                            count=len(pending)):
+                    try:
+                        resolve_pending(self.data, pending, self.state)
+                    except Invalid as e:
+                        self._invalid = strip_tracebacks(e)
 
-        else:
-            decoded = params
-        if hasattr(decoded, "mixed"):
-            decoded = decoded.mixed()
+        self.is_validated = True
 
-        self.data.update(decoded)
+        if result_key is not None:
+            self._cache_result(result_cache, result_key)
 
-        if self.schema:
+        return not self._has_errors()
+
+    def validate_field(self, name, params=None):
+        """
+        Validates just field `name` and returns whether it is valid, for
+        checking a field as it is filled in without validating the rest
+        of the form. Render the result with
+        :meth:`pyramid_simpleform.renderers.FormRenderer.fragment`.
+
+        Chained validators of the schema naming the field (see
+        :func:`pyramid_simpleform.plans.chained_fields`) are run too,
+        along with the other fields they name, whose errors are also
+        set. With `variable_decode` `name` may be the path of a nested
+        field, e.g. ``rows-0.email``, in which case its whole top level
+        field is validated.
+
+        `params` are read as by :meth:`validate`. Unlike **validate()**
+        this doesn't set **is_validated**, and it can be called for
+        several fields. Raises :class:`UnknownField` if `name` isn't a
+        field of the form.
+        """
+        field = self._field_for(name)
+        with self._measure('validate'):
+            with self.tracer.start_span('form.validate_field', field=field):
+                params, json_body = self._get_params(params)
+                if not self._check_limits(params, json_body):
+                    return False
+                decoded = self._decode(params, json_body)
+
+                fields = set([field])
+                errors = {}
+                pending = self.state._pending = []
+                try:
+                    if self.schema and field in self.schema.fields:
+                        plan = get_plan(self.schema)
+                        schema = plan.field_schema(field)
+                        fields.update(schema.fields)
+                        validate = plan.field_validator(field) \
+                            if self.compiled else schema.to_python
+                        try:
+                            self.data.update(validate(decoded, self.state))
+                        except Invalid as e:
+                            errors.update(self._unpack(e))
+                    validator = self.validators.get(field)
+                    if validator is not None:
+                        try:
+                            self.data[field] = validator.to_python(
+                                decoded.get(field), self.state)
+                        except Invalid as e:
+                            errors[field] = self._message(e)
+                finally:
+                    del self.state._pending
+
+                if pending:
+                    if errors:
+                        discard_pending(self.data)
+                    else:
+                        try:
+                            resolve_pending(self.data, pending, self.state)
+                        except Invalid as e:
+                            errors.update(self._unpack(e))
+
+                # errors of the fields validated replace any earlier ones,
+                # including those of their nested fields
+                prefixes = ()
+                if self.variable_decode:
+                    prefixes = tuple(
+                        f + char for f in fields
+                        for char in (self.dict_char, self.list_char))
+                for key in list(self.errors):
+                    if key in fields or prefixes and key.startswith(prefixes):
+                        del self.errors[key]
+                self.errors.update(errors)
+                return not self.is_error(name)
+
+    def _message(self, e):
+        if isinstance(e.msg, _text):
+            return e.msg
+        try:
+            return unicode(e)
+        except NameError:
+            return str(e)
+
+    def _unpack(self, e):
+        errors = e.unpack_errors(self.variable_decode, self.dict_char,
+                                 self.list_char)
+        if not isinstance(errors, dict):
+            errors = {'': errors}
+        return errors
+
+    def _field_for(self, name):
+        """
+        Returns the field of the schema or validators validating `name`.
+        """
+        fields = get_plan(self.schema, self.validators).fields
+        if name in fields:
+            return name
+        if self.variable_decode and isinstance(name, _text):
+            for i, char in enumerate(name):
+                if char in (self.dict_char, self.list_char):
+                    if name[:i] in fields:
+                        return name[:i]
+                    break
+        raise UnknownField('the form has no field %r' % (name,))
+
+    def _get_params(self, params):
+        with self.tracer.start_span('form.params'):
+            json_body = get_json_body(self.request, self._get_json_decoder())
+            if params is None:
+                if json_body:
+                    params = json_body
+                elif self.method == "POST":
+                    params = self.request.POST
+                else:
+                    params = self.request.params
+        return params, json_body
+
+    def _check_limits(self, params, json_body):
+        """
+        Checks `params` against the form's limits and returns **False**,
+        with the form error set, if they break one.
+        """
+        limits = self.limits
+        if limits is None:
+            registry = getattr(self.request, 'registry', None)
+            if registry is not None:
+                limits = get_limits(registry)
+        if limits:
             try:
-                self.data = self.schema.to_python(decoded, self.state)
-            except Invalid as e:
-                self.errors = e.unpack_errors(self.variable_decode,
-                                              self.dict_char,
-                                              self.list_char)
+                limits.check(params, self.dict_char, self.list_char,
+                             structured=params is json_body,
+                             nested=self.variable_decode)
+            except PayloadRejected as e:
+                self.errors = self._error_store(
+                    {'': self.state._(e.message) % e.kw})
+                self.payload_rejected = True
+                return False
+        return True
+
+    def _decode(self, params, json_body):
+        with self.tracer.start_span('form.decode'):
+            if self.variable_decode and not json_body:
+                from formencode import variabledecode
+                decoded = variabledecode.variable_decode(
+                            params, self.dict_char, self.list_char)
+
+            else:
+                decoded = params
+            if hasattr(decoded, "mixed"):
+                decoded = decoded.mixed()
+
+            self.data.update(decoded)
+        return decoded
+
+    def _run_validators(self, decoded, budget):
+        if self.schema:
+            with self.tracer.start_span('form.schema'):
+                try:
+                    if budget is None:
+                        self.data = self._to_python(decoded)
+                    else:
+                        self.data = self._validate_with_budget(decoded,
+                                                               budget)
+                except Invalid as e:
+                    # unpacked when errors are first accessed
+                    self._invalid = strip_tracebacks(e)
 
         if self.validators:
             try:
@@ -226,21 +680,152 @@ class Form(object):
             except AttributeError:
                 iter_items = self.validators.items()
 
+            if budget is not None:
+                iter_items = sorted(iter_items,
+                                    key=lambda item: validation_cost(item[1]))
+
             for field, validator in iter_items:
+                if budget is not None and budget.exhausted:
+                    self.errors_truncated = True
+                    break
+                span = self.tracer.start_span('form.validator', field=field)
                 try:
                     self.data[field] = validator.to_python(decoded.get(field),
                                                            self.state)
 
                 except Invalid as e:
-                    try:
-                        self.errors[field] = unicode(e)
-                    except NameError:
-                        self.errors[field] = str(e)
+                    span.set_attribute('invalid', True)
+                    if budget is not None:
+                        budget.add(field, e)
+                    # merged with the schema errors when they are unpacked
+                    self._errors[field] = self._message(e)
+                finally:
+                    span.end()
+
+    def _get_tracer(self, request):
+        if self.tracer is not None:
+            return self.tracer
+        registry = getattr(request, 'registry', None)
+        return getattr(registry, 'simpleform_tracer', None) or NOOP_TRACER
+
+    def _measure(self, phase):
+        """
+        Returns a context manager measuring `phase` with the form's
+        **instruments** and those set up from the settings.
+        """
+        instruments = self.instruments
+        registry = getattr(self.request, 'registry', None)
+        configured = getattr(registry, 'simpleform_instruments', None)
+        if configured:
+            instruments = tuple(instruments) + tuple(configured)
+        if not instruments:
+            return _nullcontext
+        return measure(instruments, phase, self)
+
+    def _get_settings(self):
+        registry = getattr(self.request, 'registry', None)
+        return getattr(registry, 'settings', None) or {}
+
+    def _get_result_cache(self):
+        if not self.cache or self.multipart:
+            return None
+        if self.result_cache is not None:
+            return self.result_cache
+        registry = getattr(self.request, 'registry', None)
+        return getattr(registry, 'simpleform_result_cache', None)
+
+    def _result_key(self, params):
+        """
+        Returns the key of the result of validating `params` in the result
+        cache, or **None** if the result may not be cached. Called before
+        validation, when **data** holds just the defaults.
+        """
+        plan = get_plan(self.schema, self.validators)
+        if self.schema and not plan.cacheable:
+            return None
+        for validator in self.validators.values():
+            if not is_cacheable(validator):
+                return None
+
+        # messages are translated, so the result depends on the locale
+        locale_name = getattr(self.request, 'locale_name', None)
+        # the plan is shared by equal schema instances and keeps their
+        # validators alive; the form's validators are keyed by identity
+        # and kept alive by the cached result
+        validators = tuple(sorted(
+            (name, id(validator))
+            for name, validator in self.validators.items()))
+        return (type(self), plan, validators,
+                self.variable_decode, self.dict_char, self.list_char,
+                self.max_errors, locale_name,
+                getattr(self.state, 'cache_key', None),
+                payload_hash(self.data) if self.data else None,
+                payload_hash(params))
+
+    def _cache_result(self, result_cache, result_key):
+        try:
+            data = copy_data(self.data)
+            errors = copy_data(dict(self._errors))
+        except TypeError:
+            # other objects could be changed by the views getting them
+            return
+        result_cache[result_key] = (data, detach_state(self._invalid),
+                                    errors, self.errors_truncated,
+                                    dict(self.validators))
+
+    def _restore_result(self, result):
+        data, invalid, errors, errors_truncated, validators = result
+        self.data = copy_data(data)
+        self._invalid = detach_state(invalid, self.state)
+        self._errors = self._error_store(copy_data(errors))
+        self.errors_truncated = errors_truncated
+
+    def _get_json_decoder(self):
+        # read from the class so plain functions aren't bound to the form
+        decoder = _unbound(type(self).json_decoder)
+        if decoder is None:
+            decoder = self._get_settings().get('simpleform.json_decoder')
+        return decoder
+
+    def _get_json_encoder(self):
+        encoder = _unbound(type(self).json_encoder)
+        if encoder is None:
+            encoder = self._get_settings().get('simpleform.json_encoder')
+        return resolve_json_encoder(encoder)
+
+    def _to_python(self, decoded):
+        """
+        Runs the schema, compiled unless **compiled** is turned off.
+        """
+        if self.compiled:
+            validate = get_plan(self.schema).compiled
+            if validate is not None:
+                return validate(decoded, self.state)
+        return self.schema.to_python(decoded, self.state)
 
+    def _validate_with_budget(self, decoded, budget):
+        """
+        Runs the schema, cheapest fields first, until `budget` is spent.
+        """
+        plan = get_plan(self.schema, self.validators)
 
-        self.is_validated = True
+        # dicts only keep their order from Python 3.7
+        ordered = OrderedDict((name, decoded[name])
+                              for name in plan.validation_order
+                              if name in decoded)
+        for name, value in decoded.items():
+            ordered.setdefault(name, value)
 
-        return not(self.errors)
+        state = self.state
+        state._error_budget = budget
+        try:
+            return plan.budgeted_schema.to_python(ordered, state)
+        except BudgetExhausted:
+            self.errors_truncated = True
+            raise Invalid(format_compound_error(budget.errors),
+                          decoded, state, error_dict=budget.errors)
+        finally:
+            del state._error_budget
 
     def bind(self, obj, include=None, exclude=None):
         """
@@ -265,36 +850,54 @@ class Form(object):
         if not self.is_validated:
             raise RuntimeError("Form has not been validated. Call validate() first")
 
-        if self.errors:
+        if self._has_errors():
             raise RuntimeError("Cannot bind to object if form has errors")
 
-        items = [(k, v) for k, v in self.data.items() if not k.startswith("_")]
-        for k, v in items:
+        with self.tracer.start_span('form.bind'):
+            items = [(k, v) for k, v in self.data.items()
+                     if not k.startswith("_")]
+            for k, v in items:
 
-            if include and k not in include:
-                continue
+                if include and k not in include:
+                    continue
 
-            if exclude and k in exclude:
-                continue
+                if exclude and k in exclude:
+                    continue
 
-            setattr(obj, k, v)
+                setattr(obj, k, v)
 
         return obj
 
-    def htmlfill(self, content, **htmlfill_kwargs):
+    def htmlfill(self, content, normalize=None, **htmlfill_kwargs):
         """
         Runs FormEncode **htmlfill** on content.
+
+        When there are neither data nor errors to fill in, htmlfill is
+        only run if it would change `content` in one of the ways named in
+        `normalize` (defaults to **htmlfill_normalize**, see
+        :mod:`pyramid_simpleform.filling`); otherwise `content` is
+        returned as it is.
         """
 
         charset = getattr(self.request, 'charset', 'utf-8')
         htmlfill_kwargs.setdefault('encoding', charset)
-        return htmlfill.render(content, 
-                               defaults=self.data,
-                               errors=self.errors,
-                               **htmlfill_kwargs)
+        if normalize is None:
+            normalize = self.htmlfill_normalize
+        from formencode import htmlfill
+        with self._measure('htmlfill'), \
+                self.tracer.start_span('form.htmlfill') as span:
+            if not self.data and not self._has_errors() and \
+                    not needs_fill(content, normalize, **htmlfill_kwargs):
+                if span.recording:
+                    span.set_attribute('skipped', True)
+                return content
+            return htmlfill.render(content, 
+                                   defaults=self.data,
+                                   errors=self.errors,
+                                   **htmlfill_kwargs)
 
     def render(self, template, extra_info=None, htmlfill=True,
-              **htmlfill_kwargs):
+               direct_fill=None, **htmlfill_kwargs):
         """
         Renders the form directly to a template,
         using Pyramid's **render** function. 
@@ -303,9 +906,15 @@ class Form(object):
 
         `extra_info` : dict of extra data to pass to template
 
-        `htmlfill` : run htmlfill on the result.
+        `htmlfill` : run htmlfill on the result. It is skipped when there
+        is nothing to fill in (see :meth:`htmlfill`).
 
-        By default the form itself will be passed in as `form`.
+        `direct_fill` : render every field with a **FormRenderer** which
+        fills in values, error classes and messages itself, and skip
+        htmlfill. Defaults to **direct_fill**.
+
+        By default the form itself will be passed in as `form`, and in
+        direct-fill mode a **FormRenderer** for it as `renderer`.
 
         htmlfill is automatically run on the result of render if
         `htmlfill` is **True**.
@@ -326,7 +935,143 @@ class Form(object):
         extra_info = extra_info or {}
         extra_info.setdefault('form', self)
 
-        result = render(template, extra_info, self.request)
-        if htmlfill:
-            result = self.htmlfill(result, **htmlfill_kwargs)
+        if direct_fill is None:
+            direct_fill = self.direct_fill
+        if direct_fill:
+            from pyramid_simpleform.renderers import FormRenderer
+            # renderers made for this form record the fields they emit
+            self._direct_fill_fields = set()
+            extra_info.setdefault('renderer', FormRenderer(self))
+
+        from pyramid.renderers import render
+        try:
+            with self._measure('render'), \
+                    self.tracer.start_span('form.render', template=template):
+                with self.tracer.start_span('form.template'):
+                    result = render(template, extra_info, self.request)
+                if direct_fill:
+                    if self._check_direct_fill():
+                        from pyramid_simpleform.renderers import \
+                            check_direct_fill
+                        check_direct_fill(result, self._direct_fill_fields)
+                elif htmlfill:
+                    result = self.htmlfill(result, **htmlfill_kwargs)
+        finally:
+            self._direct_fill_fields = None
         return result
+
+    def _check_direct_fill(self):
+        check = self.check_direct_fill
+        if check is None:
+            from pyramid.settings import asbool
+            check = asbool(self._get_settings().get(
+                'simpleform.check_direct_fill', False))
+        return check
+
+    def dump_state(self, errors=True, compress=None):
+        """
+        Returns the data of the form, and its errors unless `errors` is
+        **False**, as compact bytes to keep in the session between the
+        steps of a multi-step form. Restore them with :meth:`load_state`
+        on a form with the same schema, validators and defaults.
+
+        Only values which differ from the defaults are written, and field
+        names are written as small ids (see
+        :mod:`pyramid_simpleform.formstate`).
+
+        `compress` : compress the state with zlib. By default it is
+        compressed if that makes it smaller.
+        """
+        from pyramid_simpleform.formstate import dump_state
+        plan = get_plan(self.schema, self.validators)
+        return dump_state(plan, self.data, self._initial_data,
+                          dict(self.errors) if errors else None,
+                          self.is_validated, compress)
+
+    def load_state(self, state):
+        """
+        Restores the data, errors and **is_validated** of the form from
+        `state` returned by :meth:`dump_state`. A validated state isn't
+        validated again by **validate()**.
+
+        Raises :class:`pyramid_simpleform.formstate.StateError` if `state`
+        is corrupt or was dumped for a form with other fields.
+        """
+        from pyramid_simpleform.formstate import load_state
+        plan = get_plan(self.schema, self.validators)
+        data, errors, validated = load_state(plan, state, self._initial_data)
+        self.data = data
+        self.errors = self._error_store(errors)
+        self.is_validated = validated
+
+    def nested_errors(self):
+        """
+        Returns the errors as nested dicts and lists, following the shape
+        of the data rather than the flattened paths used by **errors**.
+        Form errors are under the empty key. Lists keep the positions of
+        their items, with **None** for items without errors.
+        """
+        if self._invalid is not None:
+            # straight from the Invalid tree, without flattening it first
+            nested = self._invalid.unpack_errors()
+            if not isinstance(nested, dict):
+                nested = {'': nested}
+            errors = self._errors
+        else:
+            errors = self.errors
+            if isinstance(errors, _text) or isinstance(errors, list):
+                return {'': errors}
+            nested = {}
+        if not self.variable_decode:
+            nested.update(errors)
+            return nested
+        return nest_errors(errors, self.dict_char, self.list_char, nested)
+
+    def as_dict(self, codes=False):
+        """
+        Returns the state of the form for a JSON API: a dict of ``valid``,
+        ``data`` and the ``errors`` from :meth:`nested_errors`.
+
+        `codes` : also add the ``codes`` from :meth:`error_codes`
+        """
+        result = {
+            'valid': self.is_validated and not self._has_errors(),
+            'data': self.data,
+            'errors': self.nested_errors(),
+        }
+        if codes:
+            result['codes'] = self.error_codes()
+        return result
+
+    def json_response(self, codes=False, status=None, error_status=400):
+        """
+        Returns a response with :meth:`as_dict` as JSON, for views of a
+        JSON API. No template is rendered and htmlfill isn't run::
+
+            @view_config(route_name='api_signup', request_method='POST')
+            def signup(request):
+                form = Form(request, SignupSchema)
+                if form.validate():
+                    # do something
+                return form.json_response()
+
+        The JSON is encoded with **json_encoder**, which may be a callable
+        returning bytes or a dotted name, set as a class attribute or as
+        the ``simpleform.json_encoder`` setting. By default the fastest
+        encoder installed is used (see
+        :func:`pyramid_simpleform.jsonbody.default_json_encoder`).
+
+        `codes` : include the error codes
+
+        `status` : the response status; by default 200, or `error_status`
+        if the form has errors
+        """
+        from pyramid.response import Response
+
+        if status is None:
+            status = error_status if self._has_errors() else 200
+        body = self._get_json_encoder()(self.as_dict(codes))
+        return Response(body=body,
+                        status=status,
+                        content_type='application/json',
+                        charset='utf-8')
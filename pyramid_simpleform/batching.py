@@ -0,0 +1,174 @@
+"""
+Batched lookups for validators which check values against a database.
+"""
+from formencode import FancyValidator, Invalid
+from formencode.schema import format_compound_error
+
+
+class Pending(object):
+    """
+    Placeholder for the result of a :class:`Batched` validator, which is
+    replaced once the lookups of the whole form have been made.
+    """
+
+    def __init__(self, validator, value, key):
+        self.validator = validator
+        self.value = value
+        self.key = key
+
+    def __repr__(self):
+        return '<Pending %r>' % (self.value,)
+
+
+class Batched(FancyValidator):
+    """
+    Base class for validators which look values up, e.g. in a database.
+
+    Under :class:`pyramid_simpleform.Form` the lookups aren't made while
+    the schema is validated. Instead the keys of all the values validated
+    by the same validator instance, e.g. every row of a ``ForEach``, are
+    passed to a single :meth:`load` call once the rest of the form is
+    valid, and each value is then checked with :meth:`check`::
+
+        class UniqueEmail(Batched):
+
+            messages = dict(taken='This email is already registered')
+
+            def load(self, keys, state):
+                query = DBSession.query(User.email).filter(
+                    User.email.in_(keys))
+                return dict((email, True) for email, in query)
+
+            def check(self, value, loaded, state):
+                if loaded:
+                    raise Invalid(self.message('taken', state),
+                                  value, state)
+                return value
+
+    Used on its own, each value is looked up as it is validated. Note
+    that chained validators of the schema see :class:`Pending` values.
+    """
+
+    cacheable = False
+
+    def batch_key(self, value, state):
+        """
+        Returns the key `value` is looked up by, by default the value.
+        """
+        return value
+
+    def load(self, keys, state):
+        """
+        Looks up the list of `keys` and returns a dict of what was found
+        by key. Keys which are left out are passed to :meth:`check` as
+        **None**.
+        """
+        raise NotImplementedError
+
+    def check(self, value, loaded, state):
+        """
+        Returns the validated `value`, given what was `loaded` for its key,
+        or raises **Invalid**.
+        """
+        return value
+
+    def _convert_to_python(self, value, state):
+        key = self.batch_key(value, state)
+        pending = getattr(state, '_pending', None)
+        if pending is None:
+            return self.check(value, self.load([key], state).get(key), state)
+        result = Pending(self, value, key)
+        pending.append(result)
+        return result
+
+
+def _find_pending(value, found, path=()):
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return
+    for key, item in items:
+        if isinstance(item, Pending):
+            found.append((value, key, path + (key,)))
+        else:
+            _find_pending(item, found, path + (key,))
+
+
+def _error_tree(errors, value, state):
+    """
+    Turns a dict of path tuples to **Invalid** into nested **Invalid**
+    exceptions, as raised by a schema.
+    """
+    children = {}
+    for path, error in errors.items():
+        children.setdefault(path[0], {})[path[1:]] = error
+
+    error_dict = {}
+    for name, child in children.items():
+        if () in child:
+            error_dict[name] = child[()]
+        else:
+            error_dict[name] = _error_tree(child, value, state)
+
+    if all(isinstance(name, int) for name in error_dict):
+        error_list = [None] * (max(error_dict) + 1)
+        for i, error in error_dict.items():
+            error_list[i] = error
+        return Invalid(format_compound_error(error_list), value, state,
+                       error_list=error_list)
+    return Invalid(format_compound_error(error_dict), value, state,
+                   error_dict=error_dict)
+
+
+def resolve_pending(data, pending, state):
+    """
+    Makes the lookups of the `pending` :class:`Pending` results of `data`,
+    one :meth:`Batched.load` call per validator, and replaces them with
+    the checked values in place. Raises **Invalid** with the errors of all
+    checks that failed.
+    """
+    groups = {}
+    for p in pending:
+        groups.setdefault(id(p.validator), []).append(p)
+
+    loaded = {}
+    for group in groups.values():
+        validator = group[0].validator
+        keys = []
+        seen = set()
+        for p in group:
+            if p.key not in seen:
+                seen.add(p.key)
+                keys.append(p.key)
+        loaded[id(validator)] = validator.load(keys, state) or {}
+
+    found = []
+    _find_pending(data, found)
+
+    errors = {}
+    for container, key, path in found:
+        p = container[key]
+        try:
+            container[key] = p.validator.check(
+                p.value, loaded[id(p.validator)].get(p.key), state)
+        except Invalid as e:
+            container[key] = p.value
+            errors[path] = e
+
+    if errors:
+        raise _error_tree(errors, data, state)
+    return data
+
+
+def discard_pending(data):
+    """
+    Replaces the :class:`Pending` results of `data` with the values
+    they were made from, without looking them up.
+    """
+    found = []
+    _find_pending(data, found)
+    for container, key, path in found:
+        container[key] = container[key].value
+    return data
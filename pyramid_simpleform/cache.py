@@ -0,0 +1,141 @@
+"""
+Small in-process caches.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from operator import itemgetter
+
+try:
+    _scalars = (basestring, bytes, int, long, float, bool, type(None))
+except NameError:
+    _scalars = (str, bytes, int, float, bool, type(None))
+_scalars += (decimal.Decimal, datetime.date, datetime.time,
+             datetime.timedelta)
+
+_marker = object()
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping which keeps at most `maxsize` items, dropping the
+    least recently used item first. A `maxsize` of **None** means no limit.
+
+    If `ttl` is given, items also expire that many seconds after they were
+    set. `timer` is the clock used for this.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, timer=_monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        value = self._data.get(key, _marker)
+        if value is _marker:
+            return False
+        return self.ttl is None or value[1] > self.timer()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            if self.ttl is not None:
+                if value[1] <= self.timer():
+                    return default
+                self._data[key] = value
+                return value[0]
+            self._data[key] = value
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _marker)
+        if value is _marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            if self.ttl is not None:
+                value = (value, self.timer() + self.ttl)
+            self._data[key] = value
+            self._trim()
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self, maxsize):
+        """
+        Changes `maxsize`, dropping items if there are now too many.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._trim()
+
+    def expire(self):
+        """
+        Drops the items whose `ttl` has passed. Expired items are otherwise
+        only dropped when they are looked up or pushed out by new items.
+        """
+        if self.ttl is None:
+            return
+        with self._lock:
+            now = self.timer()
+            for key, value in list(self._data.items()):
+                if value[1] <= now:
+                    del self._data[key]
+
+    def _trim(self):
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def payload_hash(params):
+    """
+    Returns a hash of `params` (a dict, MultiDict or decoded JSON body)
+    which is the same for equal params. Keys may come in any order, but
+    the order of repeated keys and of list items is kept.
+    """
+    if hasattr(params, 'getall'):
+        params = sorted(params.items(), key=itemgetter(0))
+    body = json.dumps(params, sort_keys=True, separators=(',', ':'),
+                      default=repr)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def copy_data(value):
+    """
+    Returns a copy of `value` made of dicts, lists, tuples, sets and
+    immutable scalars such as text, numbers and dates, for data kept in a
+    cache that must not be changed by whoever gets it. Raises a
+    **TypeError** for other objects, which can't be copied safely.
+    """
+    if isinstance(value, _scalars):
+        return value
+    if isinstance(value, dict):
+        return dict((key, copy_data(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [copy_data(item) for item in value]
+    if isinstance(value, (tuple, set, frozenset)):
+        return type(value)(copy_data(item) for item in value)
+    raise TypeError('%s values are not cached' % type(value).__name__)
@@ -0,0 +1,204 @@
+"""
+Export of FormEncode schemas as rules for validation in the browser.
+"""
+import hashlib
+import json
+import re
+
+from formencode import All, Schema, validators
+
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+_FLAGS = ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'))
+
+# flags which don't change what a pattern means in JavaScript; UNICODE
+# does, see _unicode_classes_re
+_neutral_flags = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE | \
+    getattr(re, 'ASCII', 0)
+
+# Python syntax JavaScript doesn't have or reads differently: named
+# groups, inline flags and comments, atomic groups, conditionals, \A, \Z
+_python_syntax_re = re.compile(r'\(\?(?:P|[aiLmsux#>(-])|\\[AZ]')
+
+# classes which only match ASCII in JavaScript
+_unicode_classes_re = re.compile(r'\\[wWdDbB]')
+
+
+def _js_pattern(regex):
+    """
+    Returns the pattern and flags of compiled `regex` for JavaScript, or
+    **None** if it might reject values the server accepts there.
+    """
+    pattern = regex.pattern
+    if not isinstance(pattern, _text) or regex.flags & ~_neutral_flags:
+        return None
+    if _python_syntax_re.search(pattern):
+        return None
+    if regex.flags & re.UNICODE and not regex.flags & getattr(
+            re, 'ASCII', 0) and _unicode_classes_re.search(pattern):
+        return None
+    return pattern, ''.join(f for flag, f in _FLAGS if regex.flags & flag)
+
+
+def validator_rules(validator):
+    """
+    Returns a dict of the rules that can be checked in the browser for
+    `validator`:
+
+    ``required``
+        the value must not be empty (``NotEmpty`` or ``not_empty=True``)
+
+    ``min_length``, ``max_length``
+        length limits (``String``, ``MinLength``, ``MaxLength``)
+
+    ``type``
+        ``integer`` (``Int``), ``number`` (``Number``) or ``email``
+        (``Email``)
+
+    ``min``, ``max``
+        range of an ``Int`` or ``Number``
+
+    ``one_of``
+        list of allowed values (``OneOf``)
+
+    ``pattern``, ``flags``
+        regular expression (``Regex``) and its ``i``, ``m`` and ``s`` flags;
+        left out for patterns which could reject values in JavaScript that
+        Python accepts, such as verbose patterns, named groups or ``\\w``
+        matching Unicode letters
+
+    ``strip``
+        whitespace is stripped from the value before it is checked
+
+    Rules of the validators in an ``All`` are combined; other validators
+    don't add any rules, so anything the browser doesn't check is still
+    checked by the server.
+    """
+    rules = {}
+
+    if isinstance(validator, All):
+        for v in validator.validators:
+            rules.update(validator_rules(v))
+        return rules
+
+    if getattr(validator, 'not_empty', False) or \
+            isinstance(validator, validators.NotEmpty):
+        rules['required'] = True
+    if getattr(validator, 'strip', False):
+        rules['strip'] = True
+
+    if isinstance(validator, validators.ByteString):
+        if validator.min is not None:
+            rules['min_length'] = validator.min
+        if validator.max is not None:
+            rules['max_length'] = validator.max
+    elif isinstance(validator, validators.MinLength):
+        rules['min_length'] = validator.minLength
+    elif isinstance(validator, validators.MaxLength):
+        rules['max_length'] = validator.maxLength
+    elif isinstance(validator, (validators.Int, validators.Number)):
+        if isinstance(validator, validators.Int):
+            rules['type'] = 'integer'
+        else:
+            rules['type'] = 'number'
+        if validator.min is not None:
+            rules['min'] = validator.min
+        if validator.max is not None:
+            rules['max'] = validator.max
+    elif isinstance(validator, validators.Email):
+        rules['type'] = 'email'
+    elif isinstance(validator, validators.OneOf):
+        if not validator.testValueList:
+            rules['one_of'] = list(validator.list)
+    elif isinstance(validator, validators.Regex):
+        regex = validator.regex
+        if isinstance(regex, _text):
+            regex = re.compile(regex)
+        pattern = _js_pattern(regex)
+        if pattern is not None:
+            rules['pattern'], flags = pattern
+            if flags:
+                rules['flags'] = flags
+
+    return rules
+
+
+def schema_rules(schema):
+    """
+    Returns a dict of rules for each field of `schema` (see
+    :func:`validator_rules`), leaving out fields without rules. Nested
+    schemas are exported as a nested ``fields`` dict.
+    """
+    fields = {}
+    for name, validator in schema.fields.items():
+        if isinstance(validator, Schema) or (
+                isinstance(validator, type) and
+                issubclass(validator, Schema)):
+            rules = schema_rules(validator)
+        else:
+            rules = validator_rules(validator)
+        if rules:
+            fields[name] = rules
+    return {'fields': fields}
+
+
+class ClientRules(object):
+    """
+    The client-side rules of a schema, serialized.
+
+    `rules` : the rules, as returned by :func:`schema_rules`
+
+    `body` : the rules as JSON bytes
+
+    `etag` : a hash of `body`
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.body = json.dumps(rules, sort_keys=True,
+                               separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+def get_client_rules(schema):
+    """
+    Returns the :class:`ClientRules` of `schema`, which are worked out once
+    and kept with the schema's plan.
+    """
+    from pyramid_simpleform.plans import get_plan
+
+    plan = get_plan(schema)
+    if plan.client_rules is None:
+        plan.client_rules = ClientRules(schema_rules(schema))
+    return plan.client_rules
+
+
+def client_rules_response(request, schema, max_age=3600):
+    """
+    Returns a response with the JSON rules of `schema`, for example from a
+    view::
+
+        @view_config(route_name='signup_rules')
+        def signup_rules(request):
+            return client_rules_response(request, SignupSchema)
+
+    The response has an ``ETag`` and the rules are not sent again to
+    clients that already have them, which get a ``304 Not Modified``.
+    """
+    from pyramid.httpexceptions import HTTPNotModified
+    from pyramid.response import Response
+
+    rules = get_client_rules(schema)
+    if_none_match = getattr(request, 'if_none_match', None)
+    if if_none_match is not None and rules.etag in if_none_match:
+        response = HTTPNotModified()
+    else:
+        response = Response(body=rules.body,
+                            content_type='application/json',
+                            charset='utf-8')
+    response.etag = rules.etag
+    response.cache_control.max_age = max_age
+    return response
@@ -0,0 +1,248 @@
+"""
+Code of compiled schemas, compiled ahead of time and shared by worker
+processes.
+
+Compiling the module :func:`pyramid_simpleform.compiler.compile_schema`
+generates for a schema takes most of the time of warming it up, and every
+worker process does it again. Run ``simpleform-compile`` once at deploy
+time to write the code of your schemas to a cache file::
+
+    simpleform-compile --config production.ini -o var/simpleform.cache
+
+and point the ``simpleform.code_cache`` setting at it. The file is mapped
+into memory read-only, so its pages are shared by all the workers, and
+only the code of the schemas a worker uses is loaded from it.
+
+Entries are keyed by a hash of the generated source, so the code of a
+schema that has changed since the file was written is simply not found
+and compiled as usual. Files written by another version of this module or
+of Python are ignored.
+"""
+import argparse
+import marshal
+import mmap
+import os
+import struct
+import sys
+import warnings
+
+from formencode import Schema
+
+from pyramid_simpleform.compiler import compiled_code
+
+try:
+    from importlib.util import MAGIC_NUMBER as _python_magic
+except ImportError:
+    from imp import get_magic
+    _python_magic = get_magic()
+
+try:
+    _replace = os.replace
+except AttributeError:
+    _replace = os.rename
+
+MAGIC = b'SFCC'
+
+#: version of the file format, bumped whenever it changes
+FORMAT_VERSION = 1
+
+# magic, format version, Python bytecode magic, size of the index
+_header = struct.Struct('<4sH4sI')
+
+
+class StaleCache(ValueError):
+    """
+    Raised by :class:`CodeCache` for files written by another version of
+    this module or of Python, or which aren't code caches at all.
+    """
+
+
+class CodeCache(object):
+    """
+    Read-only view of a code cache file written by
+    :func:`write_code_cache`, for
+    :func:`pyramid_simpleform.compiler.set_code_cache`.
+
+    `path` : name of the file
+
+    **hits** and **misses** count the lookups.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise StaleCache('%s is empty' % path)
+        if len(self._map) < _header.size:
+            raise StaleCache('%s is not a code cache' % path)
+        magic, version, python, size = _header.unpack(
+            self._map[:_header.size])
+        if magic != MAGIC:
+            raise StaleCache('%s is not a code cache' % path)
+        if version != FORMAT_VERSION or python != _python_magic:
+            raise StaleCache('%s was written by another version' % path)
+        self._index = marshal.loads(
+            self._map[_header.size:_header.size + size])
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key):
+        """
+        Returns the code object stored under `key`, or **None**.
+        """
+        entry = self._index.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        offset, length = entry
+        return marshal.loads(self._map[offset:offset + length])
+
+    def close(self):
+        self._map.close()
+
+
+def write_code_cache(path, codes):
+    """
+    Writes `codes`, a dict of code objects by
+    :func:`pyramid_simpleform.compiler.code_key`, to the code cache file
+    `path`. The file is replaced atomically, so processes which have the
+    old one open keep reading it safely.
+    """
+    blobs = [(key, marshal.dumps(code))
+             for key, code in sorted(codes.items())]
+
+    # offsets depend on the size of the index, which depends on them
+    offset = 0
+    index = {}
+    while True:
+        position = _header.size + offset
+        for key, blob in blobs:
+            index[key] = (position, len(blob))
+            position += len(blob)
+        data = marshal.dumps(index)
+        if len(data) == offset:
+            break
+        offset = len(data)
+
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_header.pack(MAGIC, FORMAT_VERSION, _python_magic,
+                             len(data)))
+        f.write(data)
+        for key, blob in blobs:
+            f.write(blob)
+    _replace(tmp, path)
+    return len(blobs)
+
+
+def load_code_cache(path):
+    """
+    Returns the :class:`CodeCache` in `path`, or **None** with a warning
+    if it can't be read or is stale.
+    """
+    try:
+        return CodeCache(path)
+    except (IOError, OSError, StaleCache) as e:
+        warnings.warn('not using the simpleform code cache: %s' % e)
+        return None
+
+
+def schema_codes(schemas, fields=False):
+    """
+    Returns a dict of the code compiled for each of `schemas` by
+    :func:`pyramid_simpleform.compiler.compile_schema`, by key. Schemas
+    which can't be compiled are left out.
+
+    `fields` : also compile the schemas of each field used by
+    :meth:`pyramid_simpleform.Form.validate_field`
+    """
+    from pyramid_simpleform.plans import get_plan
+
+    codes = {}
+    for schema in schemas:
+        compiled = [compiled_code(schema)]
+        if fields:
+            plan = get_plan(schema)
+            compiled.extend(compiled_code(plan.field_schema(name))
+                            for name in plan.fields)
+        for entry in compiled:
+            if entry is not None:
+                codes[entry[0]] = entry[1]
+    return codes
+
+
+def find_schemas(name):
+    """
+    Returns the schemas named by dotted name `name`: a schema, or every
+    schema class defined in a module.
+    """
+    from pyramid.path import DottedNameResolver
+
+    obj = DottedNameResolver().resolve(name)
+    if isinstance(obj, type(sys)):
+        return [value for value in vars(obj).values()
+                if isinstance(value, type) and issubclass(value, Schema) and
+                _defined_in(value, obj)]
+    return [obj]
+
+
+def _defined_in(cls, module):
+    # classes made with type() claim the module of their metaclass
+    home = sys.modules.get(cls.__module__)
+    return home is module or getattr(home, cls.__name__, None) is not cls
+
+
+def main(argv=sys.argv):
+    """
+    Entry point of ``simpleform-compile``.
+    """
+    parser = argparse.ArgumentParser(
+        prog='simpleform-compile',
+        description='Compile form schemas into a code cache file.')
+    parser.add_argument('schemas', nargs='*', metavar='schema',
+                        help='dotted name of a schema or of a module of '
+                             'schemas')
+    parser.add_argument('-c', '--config', metavar='CONFIG_URI',
+                        help='compile the schemas registered by this '
+                             'application')
+    parser.add_argument('-o', '--output', required=True,
+                        help='cache file to write')
+    parser.add_argument('--fields', action='store_true',
+                        help='also compile the schema of each field, for '
+                             'Form.validate_field()')
+    args = parser.parse_args(argv[1:])
+    if not args.schemas and not args.config:
+        parser.error('give schemas or --config')
+
+    schemas = []
+    for name in args.schemas:
+        schemas.extend(find_schemas(name))
+    if args.config:
+        from pyramid.paster import bootstrap
+        from pyramid_simpleform.config import get_form_schemas
+
+        env = bootstrap(args.config)
+        try:
+            schemas.extend(form_schema.schema for form_schema in
+                           get_form_schemas(env['registry']).values())
+        finally:
+            env['closer']()
+
+    count = write_code_cache(args.output,
+                             schema_codes(schemas, fields=args.fields))
+    print('wrote %d modules for %d schemas to %s' % (
+        count, len(schemas), args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
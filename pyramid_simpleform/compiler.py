@@ -0,0 +1,618 @@
+"""
+Compiles FormEncode schemas to specialized Python functions.
+
+The function generated for a schema validates each field inline when its
+validator is one of the common ones (``String``, ``Int``, ``Number``,
+``Bool``, ``OneOf``, ``Email``, ``Regex``, ``NotEmpty``, ``ForEach`` and
+nested schemas of these) and the value is a plain string, list or dict.
+Anything else, including every value which would be rejected, is handed to
+the original validator, so the results and errors are exactly those of
+``schema.to_python()``; the inlined checks only ever take the short cut
+for values the original validator would accept.
+"""
+import hashlib
+import re
+
+from formencode import ForEach, Invalid, NoDefault, Schema
+from formencode import validators
+from formencode.schema import format_compound_error, merge_dicts
+
+from pyramid_simpleform.instrumentation import schema_name
+
+_MISSING = object()
+
+_code_cache = None
+
+# str.isascii() needs Python 3.7
+_non_ascii = re.compile(r'[^\x00-\x7f]')
+
+_immutable = (type(None), bool, int, float, str, bytes, tuple, frozenset)
+
+#: methods which must not be overridden for a validator to be inlined
+_methods = ('to_python', '_convert_to_python', '_validate_python',
+            '_validate_other', 'is_empty', 'empty_value')
+
+_schema_methods = _methods + ('assert_dict', '_value_is_iterator')
+
+
+class _Fallback(Exception):
+    """
+    Raised by inlined checks to hand a value to the original validator.
+    """
+
+
+def _ordered(d, value_dict):
+    """
+    Returns `d` ordered like the results of ``Schema.to_python()``: keys of
+    `value_dict` first, in its order, then the others in the order of `d`.
+    """
+    result = dict((key, d[key]) for key in value_dict if key in d)
+    if len(result) != len(d):
+        for key, value in d.items():
+            result.setdefault(key, value)
+    return result
+
+
+def _field(schema, name, validator, value, value_dict, new, errors, state):
+    # the loop body of Schema._convert_to_python for a field
+    if schema._value_is_iterator(value) and not getattr(
+            validator, 'accept_iterator', False):
+        errors[name] = Invalid(schema.message(
+            'singleValueExpected', state), value_dict, state)
+    if state is not None:
+        state.key = name
+    try:
+        new[name] = validator.to_python(value, state)
+    except Invalid as e:
+        errors[name] = e
+
+
+def _missing(schema, name, validator, new, errors, state):
+    # Schema._convert_to_python for a missing field without if_missing
+    if schema.ignore_key_missing:
+        return
+    if schema.if_key_missing is NoDefault:
+        try:
+            message = validator.message('missing', state)
+        except KeyError:
+            message = schema.message('missingValue', state)
+        errors[name] = Invalid(message, None, state)
+    else:
+        if state is not None:
+            state.key = name
+        try:
+            new[name] = validator.to_python(schema.if_key_missing, state)
+        except Invalid as e:
+            errors[name] = e
+
+
+def _validate_partial(chained, value_dict, errors, state):
+    for validator in chained:
+        if (not hasattr(validator, 'validate_partial') or not getattr(
+                validator, 'validate_partial_form', False)):
+            continue
+        try:
+            validator.validate_partial(value_dict, state)
+        except Invalid as e:
+            sub_errors = e.unpack_errors()
+            if not isinstance(sub_errors, dict):
+                continue
+            merge_dicts(errors, sub_errors)
+
+
+def _lookup(cls, name):
+    # the attribute as defined, without calling descriptors
+    for klass in cls.__mro__:
+        if name in vars(klass):
+            return vars(klass)[name]
+    return None
+
+
+def _inherits(validator, base, methods=_methods):
+    """
+    Returns **True** if `validator` is an instance of `base` using all of
+    its `methods` unchanged.
+    """
+    if not isinstance(validator, base):
+        return False
+    attrs = getattr(validator, '__dict__', {})
+    cls = type(validator)
+    for name in methods:
+        if name in attrs or _lookup(cls, name) is not _lookup(base, name):
+            return False
+    return True
+
+
+class SchemaCompiler(object):
+    """
+    Generates the source of the function validating `schema` (a FormEncode
+    Schema class or instance). Use :func:`compile_schema`.
+    """
+
+    def __init__(self, schema):
+        if isinstance(schema, type):
+            schema = schema()
+        self.schema = schema
+        self.namespace = {
+            '_MISSING': _MISSING,
+            '_Fallback': _Fallback,
+            '_ordered': _ordered,
+            '_field': _field,
+            '_missing': _missing,
+            '_validate_partial': _validate_partial,
+            'Invalid': Invalid,
+            'format_compound_error': format_compound_error,
+        }
+        self.lines = []
+        self.names = {}
+        self.counter = 0
+        self.inlined = 0
+
+    def name(self, prefix='_t'):
+        self.counter += 1
+        return '%s%d' % (prefix, self.counter)
+
+    def const(self, value):
+        """
+        Returns the name under which `value` is available to the generated
+        code.
+        """
+        try:
+            return self.names[id(value)]
+        except KeyError:
+            pass
+        name = self.names[id(value)] = self.name('_c')
+        self.namespace[name] = value
+        return name
+
+    def emit(self, lines, indent, line):
+        lines.append('    ' * indent + line)
+
+    @staticmethod
+    def compilable(schema):
+        """
+        Returns **True** if the top level of `schema` can be compiled; its
+        fields needn't be.
+        """
+        return (_inherits(schema, Schema, _schema_methods) and
+                not schema.pre_validators and not schema.strip and
+                schema.if_invalid is NoDefault)
+
+    def inline(self, validator):
+        """
+        Returns the method emitting inline checks for `validator`, or
+        **None** if it has to be run as it is.
+        """
+        if isinstance(validator, type):
+            return None
+        for base, method in self.inliners:
+            if _inherits(validator, base):
+                emit = getattr(self, method)
+                if emit(validator, None, None, None, None, check=True):
+                    return emit
+                return None
+        if _inherits(validator, Schema, _schema_methods) and \
+                self.pure_schema(validator):
+            return self.emit_schema
+        return None
+
+    def pure_schema(self, schema):
+        if schema.pre_validators or schema.chained_validators or \
+                schema.strip or not schema.accept_iterator:
+            return False
+        return all(self.inline(v) is not None
+                   for v in schema.fields.values())
+
+    # inlined validators: each emits code setting `dst` to what
+    # validator.to_python(src) returns, or raising _Fallback
+
+    def emit_scalar(self, validator, src, dst, lines, indent):
+        """
+        Emits the checks FancyValidator.to_python() makes before converting
+        a string and returns the name of the non-empty string to convert.
+        """
+        emit = self.emit
+        emit(lines, indent, 'if type(%s) is not str:' % src)
+        emit(lines, indent + 1, 'raise _Fallback')
+        if validator.strip:
+            stripped = self.name()
+            emit(lines, indent, '%s = %s.strip()' % (stripped, src))
+            src = stripped
+        emit(lines, indent, 'if not %s:' % src)
+        if validator.not_empty:
+            emit(lines, indent + 1, 'raise _Fallback')
+        else:
+            if validator.if_empty is not NoDefault:
+                empty = self.const(validator.if_empty)
+            else:
+                value = validator.empty_value('')
+                if isinstance(value, _immutable):
+                    empty = self.const(value)
+                else:
+                    empty = '%s.empty_value(%s)' % (
+                        self.const(validator), src)
+            emit(lines, indent + 1, '%s = %s' % (dst, empty))
+        emit(lines, indent, 'else:')
+        return src
+
+    def emit_range(self, validator, dst, lines, indent):
+        if validator.min is not None:
+            self.emit(lines, indent, 'if %s < %s:' % (
+                dst, self.const(validator.min)))
+            self.emit(lines, indent + 1, 'raise _Fallback')
+        if validator.max is not None:
+            self.emit(lines, indent, 'if %s > %s:' % (
+                dst, self.const(validator.max)))
+            self.emit(lines, indent + 1, 'raise _Fallback')
+
+    def emit_string(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return True
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        indent += 1
+        if validator.max is not None:
+            self.emit(lines, indent, 'if len(%s) > %s:' % (
+                s, self.const(validator.max)))
+            self.emit(lines, indent + 1, 'raise _Fallback')
+        if validator.min is not None:
+            self.emit(lines, indent, 'if len(%s) < %s:' % (
+                s, self.const(validator.min)))
+            self.emit(lines, indent + 1, 'raise _Fallback')
+        self.emit(lines, indent, '%s = %s' % (dst, s))
+
+    def emit_bytestring(self, validator, src, dst, lines, indent,
+                        check=False):
+        if check:
+            return validator.encoding is None
+        return self.emit_string(validator, src, dst, lines, indent)
+
+    def emit_int(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return True
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        indent += 1
+        emit = self.emit
+        emit(lines, indent, 'try:')
+        emit(lines, indent + 1, '%s = int(%s)' % (dst, s))
+        emit(lines, indent, 'except ValueError:')
+        emit(lines, indent + 1, 'raise _Fallback')
+        self.emit_range(validator, dst, lines, indent)
+
+    def emit_number(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return True
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        indent += 1
+        emit = self.emit
+        i = self.name()
+        emit(lines, indent, 'try:')
+        emit(lines, indent + 1, '%s = float(%s)' % (dst, s))
+        emit(lines, indent + 1, 'try:')
+        emit(lines, indent + 2, '%s = int(%s)' % (i, dst))
+        emit(lines, indent + 1, 'except OverflowError:')
+        emit(lines, indent + 2, '%s = None' % i)
+        emit(lines, indent, 'except ValueError:')
+        emit(lines, indent + 1, 'raise _Fallback')
+        emit(lines, indent, 'if %s == %s:' % (dst, i))
+        emit(lines, indent + 1, '%s = %s' % (dst, i))
+        self.emit_range(validator, dst, lines, indent)
+
+    def emit_bool(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return True
+        self.emit_scalar(validator, src, dst, lines, indent)
+        self.emit(lines, indent + 1, '%s = True' % dst)
+
+    def emit_oneof(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return validator.list is not None
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        choices = validator.list
+        if all(type(choice) is str for choice in choices):
+            choices = frozenset(choices)
+        self.emit(lines, indent + 1, 'if %s not in %s:' % (
+            s, self.const(choices)))
+        self.emit(lines, indent + 2, 'raise _Fallback')
+        self.emit(lines, indent + 1, '%s = %s' % (dst, s))
+
+    def emit_email(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return not validator.resolve_domain
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        indent += 1
+        emit = self.emit
+        username, at, domain = self.name(), self.name(), self.name()
+        emit(lines, indent, '%s = %s.strip()' % (dst, s))
+        emit(lines, indent, '%s, %s, %s = %s.partition("@")' % (
+            username, at, domain, dst))
+        emit(lines, indent, 'if not %s or not %s.search(%s) or '
+             '%s.search(%s) or not %s.search(%s):' % (
+                 at, self.const(validator.usernameRE), username,
+                 self.const(_non_ascii), domain,
+                 self.const(validator.domainRE), domain))
+        emit(lines, indent + 1, 'raise _Fallback')
+        if validator.domainRE is not validators.Email.domainRE:
+            # the default pattern only allows labels idna accepts
+            emit(lines, indent, 'for %s in %s.split("."):' % (at, domain))
+            emit(lines, indent + 1, 'if not 0 < len(%s) < 64:' % at)
+            emit(lines, indent + 2, 'raise _Fallback')
+
+    def emit_regex(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return hasattr(validator.regex, 'search')
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        if validator.strip:
+            self.emit(lines, indent + 1, '%s = %s.strip()' % (s, s))
+        self.emit(lines, indent + 1, 'if not %s.search(%s):' % (
+            self.const(validator.regex), s))
+        self.emit(lines, indent + 2, 'raise _Fallback')
+        self.emit(lines, indent + 1, '%s = %s' % (dst, s))
+
+    def emit_notempty(self, validator, src, dst, lines, indent,
+                      check=False):
+        if check:
+            return True
+        s = self.emit_scalar(validator, src, dst, lines, indent)
+        self.emit(lines, indent + 1, '%s = %s' % (dst, s))
+
+    def emit_foreach(self, validator, src, dst, lines, indent, check=False):
+        if check:
+            return (validator.convert_to_list and not validator.strip and
+                    validator.accept_iterator and
+                    len(validator.validators) == 1 and
+                    self.inline(validator.validators[0]) is not None)
+        emit = self.emit
+        items, item, result, out = (self.name(), self.name(), self.name(),
+                                    self.name())
+        emit(lines, indent, 'if type(%s) is list or type(%s) is tuple:' % (
+            src, src))
+        emit(lines, indent + 1, '%s = %s' % (items, src))
+        emit(lines, indent, 'elif type(%s) is str:' % src)
+        emit(lines, indent + 1, '%s = [%s] if %s else ()' % (
+            items, src, src))
+        emit(lines, indent, 'elif %s is None:' % src)
+        emit(lines, indent + 1, '%s = ()' % items)
+        emit(lines, indent, 'else:')
+        emit(lines, indent + 1, 'raise _Fallback')
+        emit(lines, indent, 'if not %s:' % items)
+        if validator.not_empty:
+            emit(lines, indent + 1, 'raise _Fallback')
+        elif validator.if_empty is not NoDefault:
+            emit(lines, indent + 1, '%s = %s' % (
+                dst, self.const(validator.if_empty)))
+        else:
+            emit(lines, indent + 1, '%s = []' % dst)
+        emit(lines, indent, 'else:')
+        emit(lines, indent + 1, '%s = []' % out)
+        emit(lines, indent + 1, 'for %s in %s:' % (item, items))
+        sub = validator.validators[0]
+        self.inline(sub)(sub, item, result, lines, indent + 2)
+        emit(lines, indent + 2, '%s.append(%s)' % (out, result))
+        emit(lines, indent + 1, '%s = %s' % (dst, out))
+
+    def emit_schema(self, schema, src, dst, lines, indent):
+        self.emit(lines, indent, '%s = %s(%s)' % (
+            dst, self.pure_schema_function(schema), src))
+
+    inliners = (
+        (validators.UnicodeString, 'emit_string'),
+        (validators.ByteString, 'emit_bytestring'),
+        (validators.Int, 'emit_int'),
+        (validators.Number, 'emit_number'),
+        (validators.Bool, 'emit_bool'),
+        (validators.OneOf, 'emit_oneof'),
+        (validators.Email, 'emit_email'),
+        (validators.Regex, 'emit_regex'),
+        (validators.NotEmpty, 'emit_notempty'),
+        (ForEach, 'emit_foreach'),
+    )
+
+    def if_missing(self, validator):
+        """
+        Returns the expression for the `if_missing` of `validator`, or
+        **None** if it has none.
+        """
+        value = getattr(validator, 'if_missing', NoDefault)
+        if value is NoDefault:
+            return None
+        if isinstance(value, _immutable):
+            return self.const(value)
+        return '%s.if_missing' % self.const(validator)
+
+    def emit_extra_fields(self, schema, lines, indent):
+        fields = self.const(frozenset(schema.fields))
+        if not schema.allow_extra_fields:
+            return
+        if not schema.filter_extra_fields:
+            self.emit(lines, indent, 'for key in value_dict:')
+            self.emit(lines, indent + 1, 'if key not in %s:' % fields)
+            self.emit(lines, indent + 2, 'new[key] = value_dict[key]')
+
+    def pure_schema_function(self, schema):
+        """
+        Emits a function returning what `schema.to_python()` returns for
+        a dict, or raising _Fallback.
+        """
+        name = self.name('_schema')
+        lines = []
+        emit = self.emit
+        fields = self.const(frozenset(schema.fields))
+        emit(lines, 0, 'def %s(value_dict):' % name)
+        emit(lines, 1, 'if type(value_dict) is not dict or not value_dict:')
+        emit(lines, 2, 'raise _Fallback')
+        if not schema.allow_extra_fields:
+            emit(lines, 1, 'for key in value_dict:')
+            emit(lines, 2, 'if key not in %s:' % fields)
+            emit(lines, 3, 'raise _Fallback')
+        emit(lines, 1, 'new = {}')
+        for field, validator in schema.fields.items():
+            value = self.name('v')
+            emit(lines, 1, '%s = value_dict.get(%r, _MISSING)' % (
+                value, field))
+            emit(lines, 1, 'if %s is _MISSING:' % value)
+            if_missing = self.if_missing(validator)
+            if if_missing is not None:
+                emit(lines, 2, 'new[%r] = %s' % (field, if_missing))
+            elif schema.ignore_key_missing:
+                emit(lines, 2, 'pass')
+            else:
+                emit(lines, 2, 'raise _Fallback')
+            emit(lines, 1, 'else:')
+            result = self.name('r')
+            self.inline(validator)(validator, value, result, lines, 2)
+            emit(lines, 2, 'new[%r] = %s' % (field, result))
+        self.emit_extra_fields(schema, lines, 1)
+        emit(lines, 1, 'return _ordered(new, value_dict)')
+        self.lines.extend(lines)
+        self.lines.append('')
+        return name
+
+    def schema_function(self):
+        """
+        Emits the function replacing ``schema.to_python()``.
+        """
+        schema = self.schema
+        emit = self.emit
+        lines = []
+        s = self.const(schema)
+        fields = self.const(frozenset(schema.fields))
+        emit(lines, 0, 'def validate(value_dict, state=None):')
+        emit(lines, 1, 'if hasattr(value_dict, "mixed"):')
+        emit(lines, 2, 'value_dict = value_dict.mixed()')
+        emit(lines, 1, 'if type(value_dict) is not dict or not value_dict:')
+        emit(lines, 2, 'return %s.to_python(value_dict, state)' % s)
+        if not schema.allow_extra_fields:
+            emit(lines, 1, 'for key in value_dict:')
+            emit(lines, 2, 'if key not in %s:' % fields)
+            emit(lines, 3, 'return %s.to_python(value_dict, state)' % s)
+        emit(lines, 1, 'new = {}')
+        emit(lines, 1, 'errors = {}')
+        emit(lines, 1, 'if state is not None:')
+        emit(lines, 2, 'previous_key = getattr(state, "key", None)')
+        emit(lines, 2, 'previous_full_dict = getattr(state, "full_dict", '
+             'None)')
+        emit(lines, 2, 'state.full_dict = value_dict')
+        emit(lines, 1, 'try:')
+        for field, validator in schema.fields.items():
+            v = self.const(validator)
+            emit(lines, 2, 'v = value_dict.get(%r, _MISSING)' % field)
+            emit(lines, 2, 'if v is _MISSING:')
+            if_missing = self.if_missing(validator)
+            if if_missing is not None:
+                emit(lines, 3, 'new[%r] = %s' % (field, if_missing))
+            else:
+                emit(lines, 3, '_missing(%s, %r, %s, new, errors, state)' % (
+                    s, field, v))
+            emit(lines, 2, 'else:')
+            fallback = '_field(%s, %r, %s, v, value_dict, new, errors, ' \
+                'state)' % (s, field, v)
+            inline = self.inline(validator)
+            if inline is None:
+                emit(lines, 3, fallback)
+                continue
+            emit(lines, 3, 'try:')
+            inline(validator, 'v', 'r', lines, 4)
+            emit(lines, 4, 'new[%r] = r' % field)
+            emit(lines, 3, 'except _Fallback:')
+            emit(lines, 4, fallback)
+            self.inlined += 1
+        self.emit_extra_fields(schema, lines, 2)
+        emit(lines, 2, 'if state is not None:')
+        emit(lines, 3, 'state.key = previous_key')
+        emit(lines, 2, 'if errors:')
+        emit(lines, 3, 'errors = _ordered(errors, value_dict)')
+        if schema.chained_validators:
+            emit(lines, 2, '_validate_partial(%s, value_dict, errors, '
+                 'state)' % self.const(schema.chained_validators))
+            emit(lines, 2, 'if errors:')
+        emit(lines, 3, 'raise Invalid(format_compound_error(errors), '
+             'value_dict, state, error_dict=errors)')
+        emit(lines, 2, 'new = _ordered(new, value_dict)')
+        if schema.chained_validators:
+            emit(lines, 2, 'for validator in %s:' % self.const(
+                schema.chained_validators))
+            emit(lines, 3, 'new = validator.to_python(new, state)')
+        emit(lines, 2, 'return new')
+        emit(lines, 1, 'finally:')
+        emit(lines, 2, 'if state is not None:')
+        emit(lines, 3, 'state.key = previous_key')
+        emit(lines, 3, 'state.full_dict = previous_full_dict')
+        self.lines.extend(lines)
+
+    def source(self):
+        """
+        Returns the source of the generated module.
+        """
+        self.schema_function()
+        return '\n'.join(self.lines) + '\n'
+
+    def compile(self):
+        """
+        Returns the function validating the schema, with the generated
+        source as its **source** attribute and the number of fields that
+        were inlined as **inlined**.
+        """
+        source = self.source()
+        filename = '<compiled %s>' % schema_name(self.schema)
+        code = None
+        if _code_cache is not None:
+            code = _code_cache.get(code_key(source, filename))
+        if code is None:
+            code = compile(source, filename, 'exec')
+        exec(code, self.namespace)
+        validate = self.namespace['validate']
+        validate.source = source
+        validate.inlined = self.inlined
+        validate.schema = self.schema
+        return validate
+
+
+def code_key(source, filename):
+    """
+    Returns the key of the code compiled from `source` in a code cache.
+    """
+    data = '%s\0%s' % (filename, source)
+    return hashlib.sha1(data.encode('utf-8')).digest()
+
+
+def compiled_code(schema):
+    """
+    Returns the :func:`code_key` of the module generated for `schema` and
+    its code object, or **None** if `schema` can't be compiled.
+    """
+    if isinstance(schema, type):
+        schema = schema()
+    if not SchemaCompiler.compilable(schema):
+        return None
+    source = SchemaCompiler(schema).source()
+    filename = '<compiled %s>' % schema_name(schema)
+    return code_key(source, filename), compile(source, filename, 'exec')
+
+
+def set_code_cache(cache):
+    """
+    Makes :func:`compile_schema` take the code of the modules it generates
+    from `cache`, an object with a ``get(key)`` method returning a code
+    object or **None**, such as a
+    :class:`pyramid_simpleform.codecache.CodeCache`, instead of compiling
+    them. Pass **None** to stop using it.
+    """
+    global _code_cache
+    _code_cache = cache
+
+
+def compile_schema(schema):
+    """
+    Returns a function taking the same arguments as `schema.to_python()`
+    and returning the same data, or raising the same errors, with the
+    checks of common validators inlined. Returns **None** if `schema`
+    can't be compiled, e.g. because it has pre-validators or overrides a
+    method of ``Schema``.
+
+    The schema and its validators must not be changed afterwards.
+    """
+    if isinstance(schema, type):
+        schema = schema()
+    if not SchemaCompiler.compilable(schema):
+        return None
+    return SchemaCompiler(schema).compile()
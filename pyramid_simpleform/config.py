@@ -0,0 +1,214 @@
+"""
+Pyramid configuration: the ``add_form_schema`` directive, startup warm-up
+and the ``request.simpleform()`` method, set up by
+``config.include('pyramid_simpleform')``.
+"""
+from pyramid.config import PHASE3_CONFIG
+from pyramid.settings import asbool
+
+from pyramid_simpleform.cache import LRUCache
+from pyramid_simpleform.instrumentation import instruments_from_settings
+from pyramid_simpleform.instrumentation import tracer_from_settings
+from pyramid_simpleform.limits import get_limits
+from pyramid_simpleform.plans import get_plan, set_plan_cache_size
+
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+
+class FormSchema(object):
+    """
+    A schema registered with ``config.add_form_schema()``.
+    """
+
+    def __init__(self, name, schema, templates=(), validators=None,
+                 package=None):
+        self.name = name
+        self.schema = schema
+        self.templates = templates
+        self.validators = validators
+        self.package = package
+
+    @property
+    def plan(self):
+        return get_plan(self.schema, self.validators)
+
+
+def get_form_schemas(registry):
+    """
+    Returns a dict of the :class:`FormSchema` objects registered with
+    `registry`, by name.
+    """
+    try:
+        return registry.simpleform_schemas
+    except AttributeError:
+        schemas = registry.simpleform_schemas = {}
+        return schemas
+
+
+def get_form_schema(registry, name):
+    """
+    Returns the :class:`FormSchema` registered as `name`. Raises a
+    **KeyError** if there isn't one.
+    """
+    return get_form_schemas(registry)[name]
+
+
+def add_form_schema(config, name, schema, templates=(), validators=None):
+    """
+    Registers `schema` (a schema or dotted name) as `name`. Registered
+    schemas may be passed to :class:`pyramid_simpleform.Form` by name, and
+    are warmed up when the configuration is committed: their plans are
+    worked out and the `templates` they are rendered with are compiled.
+
+    `templates` : template name or list of template names
+
+    `validators` : dict of extra validators used with the schema
+    """
+    schema = config.maybe_dotted(schema)
+    if isinstance(templates, _text):
+        templates = (templates,)
+    form_schema = FormSchema(name, schema, tuple(templates or ()),
+                             validators, config.package)
+
+    def register():
+        get_form_schemas(config.registry)[name] = form_schema
+
+    intr = config.introspectable('simpleform schemas', name, name,
+                                 'simpleform schema')
+    intr['schema'] = schema
+    intr['templates'] = form_schema.templates
+    config.action(('simpleform-schema', name), register,
+                  introspectables=(intr,))
+
+
+def warm_up(registry):
+    """
+    Prepares the plans and templates of all registered schemas. Turned off
+    by the ``simpleform.warmup`` setting; templates are skipped if
+    ``simpleform.warmup_templates`` is false.
+    """
+    settings = registry.settings or {}
+    if not asbool(settings.get('simpleform.warmup', True)):
+        return
+    templates = asbool(settings.get('simpleform.warmup_templates', True))
+
+    for form_schema in get_form_schemas(registry).values():
+        form_schema.plan.warm()
+        if templates:
+            for template in form_schema.templates:
+                warm_template(registry, template, form_schema.package)
+
+
+def warm_template(registry, name, package=None):
+    """
+    Looks up and compiles the template `name`, as the first **render()**
+    of it would.
+    """
+    from pyramid.renderers import RendererHelper
+
+    helper = RendererHelper(name=name, package=package, registry=registry)
+    renderer = helper.renderer
+    # template renderers such as pyramid_mako's compile on first access
+    getattr(renderer, 'template', None)
+    return renderer
+
+
+class RequestForms(object):
+    """
+    The forms of a request, shared by everything handling it. This is
+    ``request.simpleform``: calling it returns the validated
+    :class:`pyramid_simpleform.Form` for a schema, creating it the first
+    time, so that a view predicate, a subscriber and the view itself all
+    get the same form and the params are only validated once.
+
+    `schema` : schema, or name of a schema registered with
+    ``config.add_form_schema()``
+
+    `form_class` : class of the form, :class:`pyramid_simpleform.Form` by
+    default
+
+    `validate` : validate the form if it hasn't been yet; **validate()**
+    then returns the same result whenever it is called again. A form
+    first asked for with `validate` off is validated by a later call
+    with it on.
+
+    Other arguments are passed to the form. Calls with different
+    arguments get different forms; arguments are compared by value, or
+    by identity for objects which aren't hashable, such as an `obj` to
+    read defaults from.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.forms = {}
+
+    def __call__(self, schema, form_class=None, validate=True, **kwargs):
+        if form_class is None:
+            from pyramid_simpleform import Form
+            form_class = Form
+        key = (form_class, _freeze(schema), _freeze(kwargs))
+        try:
+            form = self.forms[key][0]
+        except KeyError:
+            form = form_class(self.request, schema, **kwargs)
+            # the arguments are kept so that the ids in the key stay theirs
+            self.forms[key] = (form, schema, kwargs)
+        if validate and not form.is_validated:
+            form.validate()
+        return form
+
+    def __len__(self):
+        return len(self.forms)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return (dict, frozenset((key, _freeze(item))
+                                for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(item) for item in value))
+    if isinstance(value, set):
+        return (set, frozenset(_freeze(item) for item in value))
+    try:
+        hash(value)
+    except TypeError:
+        return (id, id(value))
+    return value
+
+
+def includeme(config):
+    settings = config.get_settings()
+    cache_size = settings.get('simpleform.plan_cache_size')
+    if cache_size:
+        set_plan_cache_size(int(cache_size))
+
+    result_cache_ttl = settings.get('simpleform.result_cache_ttl')
+    if result_cache_ttl:
+        result_cache_size = settings.get('simpleform.result_cache_size', 1024)
+        config.registry.simpleform_result_cache = LRUCache(
+            int(result_cache_size), ttl=float(result_cache_ttl))
+
+    # input limits are read from the settings once per registry
+    get_limits(config.registry)
+
+    code_cache = settings.get('simpleform.code_cache')
+    if code_cache:
+        from pyramid_simpleform.codecache import load_code_cache
+        from pyramid_simpleform.compiler import set_code_cache
+        set_code_cache(load_code_cache(code_cache))
+
+    instruments = instruments_from_settings(settings)
+    if instruments:
+        config.registry.simpleform_instruments = instruments
+
+    tracer = tracer_from_settings(settings)
+    if tracer is not None:
+        config.registry.simpleform_tracer = tracer
+
+    config.add_directive('add_form_schema', add_form_schema)
+    config.add_request_method(RequestForms, 'simpleform', reify=True)
+    config.action('simpleform-warmup', lambda: warm_up(config.registry),
+                  order=PHASE3_CONFIG + 1)
@@ -0,0 +1,359 @@
+"""
+Error storage for :class:`pyramid_simpleform.Form`.
+"""
+from formencode import Invalid
+
+try:
+    _text = basestring
+    _unicode = unicode
+except NameError:
+    _text = str
+    _unicode = str
+
+
+class ErrorMessage(_unicode):
+    """
+    A translated error message which remembers the untranslated message
+    template it was made from, as ``template``. Substituting values with
+    ``%`` keeps the template, so messages produced by FormEncode
+    validators can be mapped back to their message key (see
+    :meth:`pyramid_simpleform.Form.error_codes`).
+    """
+
+    template = None
+
+    def __new__(cls, message, template=None):
+        obj = _unicode.__new__(cls, message)
+        obj.template = template
+        return obj
+
+    def __mod__(self, values):
+        return ErrorMessage(_unicode.__mod__(self, values), self.template)
+
+
+def iter_messages(invalid):
+    """
+    Yields the messages of the innermost errors of FormEncode ``Invalid``
+    exception `invalid`, without unpacking them into a dict.
+    """
+    if invalid.error_dict:
+        for error in invalid.error_dict.values():
+            if isinstance(error, _text):
+                yield error
+            else:
+                for message in iter_messages(error):
+                    yield message
+    elif invalid.error_list:
+        for error in invalid.error_list:
+            if error is not None:
+                for message in iter_messages(error):
+                    yield message
+    else:
+        yield invalid.msg
+
+
+def strip_tracebacks(invalid):
+    """
+    Drops the tracebacks of FormEncode ``Invalid`` exception `invalid` and
+    of the errors nested in it, which keep the frames of the validators
+    (and everything they refer to) alive for as long as the exception is
+    kept. Returns `invalid`.
+    """
+    stack = [invalid]
+    while stack:
+        error = stack.pop()
+        if error is None or isinstance(error, _text):
+            continue
+        error.__traceback__ = None
+        error.__context__ = None
+        if error.error_dict:
+            stack.extend(error.error_dict.values())
+        elif error.error_list:
+            stack.extend(error.error_list)
+    return invalid
+
+
+def detach_state(invalid, state=None):
+    """
+    Returns a copy of FormEncode ``Invalid`` exception `invalid`, and of
+    the errors nested in it, with `state` instead of their state and
+    without tracebacks. The state of a form refers to the request, so
+    errors kept after the request, e.g. in a cache, should be detached
+    from it.
+    """
+    if invalid is None or isinstance(invalid, _text):
+        return invalid
+    error_list = error_dict = None
+    if invalid.error_dict:
+        error_dict = dict((key, detach_state(error, state))
+                          for key, error in invalid.error_dict.items())
+    elif invalid.error_list:
+        error_list = [detach_state(error, state)
+                      for error in invalid.error_list]
+    return Invalid(invalid.msg, invalid.value, state,
+                   error_list=error_list, error_dict=error_dict)
+
+
+class ErrorStore(dict):
+    """
+    Dict of errors keyed by field name, as found on **Form.errors**.
+
+    Keys may be plain field names or flattened paths such as
+    ``people-0.email`` (as produced by ``variable_decode``). Values may be
+    messages, lists of messages or the nested dicts and lists returned by
+    ``Invalid.unpack_errors``.
+
+    On first lookup the store builds an index of every message by each
+    prefix of its path, so that errors for a field or for a whole subtree
+    (e.g. ``people`` or ``people-0``) are found without scanning all
+    errors. The index is rebuilt after the store is changed.
+
+    Keys are only split at the dict and list chars if `nested` is
+    **True**, as for forms using ``variable_decode``; otherwise a field
+    named ``first-name`` is not below ``first``. Nested dicts and lists
+    of errors are always below their key.
+
+    `errors` : initial dict of errors
+
+    `dict_char` : variabledecode dict char
+
+    `list_char` : variabledecode list char
+
+    `nested` : keys are flattened paths
+    """
+
+    def __init__(self, errors=None, dict_char='.', list_char='-',
+                 nested=False):
+        dict.__init__(self, errors or {})
+        self.dict_char = dict_char
+        self.list_char = list_char
+        self.nested = nested
+        # where the keys of subtrees may be split, by key
+        self._key_cuts = {}
+        self._reset()
+
+    def _reset(self):
+        self._index = None
+        self._flat = None
+        self._cuts = None
+        self._subtrees = {}
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._reset()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._reset()
+
+    def clear(self):
+        dict.clear(self)
+        self._reset()
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self._reset()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._reset()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = dict.setdefault(self, key, default)
+        self._reset()
+        return value
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._reset()
+
+    def _flatten(self, path, value, cuts):
+        # cuts are the lengths of the prefixes of path it is below
+        if value is None:
+            return
+        if isinstance(value, dict):
+            cuts = cuts + (len(path),)
+            for k, v in value.items():
+                for item in self._flatten(
+                        '%s%s%s' % (path, self.dict_char, k), v, cuts):
+                    yield item
+        elif isinstance(value, (list, tuple)):
+            if all(isinstance(v, _text) for v in value):
+                # a list of messages for a single field; lists from
+                # ForEach validators are positional and hold None for
+                # valid items
+                for v in value:
+                    yield path, v, cuts
+            else:
+                cuts = cuts + (len(path),)
+                for i, v in enumerate(value):
+                    for item in self._flatten(
+                            '%s%s%d' % (path, self.list_char, i), v, cuts):
+                        yield item
+        else:
+            yield path, value, cuts
+
+    def _split(self, key):
+        try:
+            return self._key_cuts[key]
+        except KeyError:
+            pass
+        if not self.nested:
+            return ()
+        seps = (self.dict_char, self.list_char)
+        return tuple(i for i, c in enumerate(key) if i and c in seps)
+
+    def _build_index(self):
+        index = {}
+        flat = []
+        all_cuts = {}
+        for key, value in self.items():
+            for path, message, cuts in self._flatten(key, value,
+                                                     self._split(key)):
+                entry = (path, message)
+                flat.append(entry)
+                all_cuts[path] = cuts
+                for i in cuts:
+                    index.setdefault(path[:i], []).append(entry)
+                index.setdefault(path, []).append(entry)
+        self._index = index
+        self._flat = flat
+        self._cuts = all_cuts
+        return index
+
+    @property
+    def index(self):
+        """
+        Dict mapping every path prefix to a list of ``(path, message)``
+        pairs found at or below it.
+        """
+        if self._index is None:
+            return self._build_index()
+        return self._index
+
+    def is_error(self, path):
+        """
+        Checks if there are errors at or below `path`.
+        """
+        return path in self.index
+
+    def errors_for(self, path):
+        """
+        Returns a list of errors at or below `path`.
+        """
+        return [message for p, message in self.index.get(path, ())]
+
+    def flat(self):
+        """
+        Returns a list of ``(path, message)`` pairs for all errors.
+        """
+        if self._flat is None:
+            self._build_index()
+        return list(self._flat)
+
+    def all_errors(self):
+        """
+        Returns all errors in a single list.
+        """
+        if self._flat is None:
+            self._build_index()
+        return [message for path, message in self._flat]
+
+    def subtree(self, prefix):
+        """
+        Returns an :class:`ErrorStore` of the errors below `prefix`, keyed
+        by their path relative to it. For example, with errors for
+        ``people-0.email`` the subtree for ``people`` has errors for
+        ``0.email`` and the subtree for ``people-0`` has errors for
+        ``email``.
+
+        An error for `prefix` itself is found under the empty key.
+        """
+        try:
+            return self._subtrees[prefix]
+        except KeyError:
+            pass
+
+        start = len(prefix) + 1
+        errors = {}
+        key_cuts = {}
+        for path, message in self.index.get(prefix, ()):
+            key = path[start:]
+            errors.setdefault(key, []).append(message)
+            key_cuts[key] = tuple(i - start for i in self._cuts[path]
+                                  if i > start)
+        store = ErrorStore(errors, self.dict_char, self.list_char,
+                           self.nested)
+        store._key_cuts = key_cuts
+        self._subtrees[prefix] = store
+        return store
+
+
+def _split_path(path, dict_char, list_char):
+    parts = ['']
+    i = 0
+    while i < len(path):
+        c = path[i]
+        if c == dict_char:
+            parts.append('')
+        elif c == list_char:
+            end = i + 1
+            while end < len(path) and path[end].isdigit():
+                end += 1
+            if end > i + 1 and (end == len(path) or
+                                path[end] in (dict_char, list_char)):
+                parts.append(int(path[i + 1:end]))
+                i = end
+                continue
+            parts[-1] += c
+        else:
+            parts[-1] += c
+        i += 1
+    return parts
+
+
+def nest_errors(errors, dict_char='.', list_char='-', result=None):
+    """
+    Returns `errors` keyed by flattened paths such as ``people-2.name``
+    as nested dicts and lists. List indexes are kept, with **None** for
+    the items without errors, so an error stays with its item.
+
+    `result` : dict of nested errors to add them to
+    """
+    if result is None:
+        result = {}
+    for path, value in errors.items():
+        parts = _split_path(path, dict_char, list_char)
+        target = result
+        for part, next_part in zip(parts, parts[1:]):
+            container = [] if isinstance(next_part, int) else {}
+            if isinstance(target, list):
+                target.extend([None] * (part + 1 - len(target)))
+                if not isinstance(target[part], type(container)):
+                    target[part] = container
+                target = target[part]
+            else:
+                if not isinstance(target.get(part), type(container)):
+                    target[part] = container
+                target = target[part]
+        part = parts[-1]
+        if isinstance(target, list):
+            target.extend([None] * (part + 1 - len(target)))
+        target[part] = value
+    return result
+
+
+def as_error_store(errors, dict_char='.', list_char='-', nested=False):
+    """
+    Returns `errors` as an :class:`ErrorStore`. A single message or a list
+    of messages is stored under the empty key.
+    """
+    if isinstance(errors, ErrorStore):
+        return errors
+    if not errors:
+        return ErrorStore(None, dict_char, list_char, nested)
+    if isinstance(errors, (_text, list)):
+        return ErrorStore({'': errors}, dict_char, list_char, nested)
+    return ErrorStore(errors, dict_char, list_char, nested)
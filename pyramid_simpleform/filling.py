@@ -0,0 +1,131 @@
+"""
+Deciding whether htmlfill has anything to do.
+
+With no data and no errors to fill in, htmlfill doesn't fill anything in,
+but it still normalizes the markup it is given:
+
+``defaults``  : with **force_defaults** (the default) values already in
+the markup are cleared: ``value`` attributes of text, hidden and password
+inputs, ``checked`` checkboxes and radio buttons, ``selected`` options and
+the content of textareas
+
+``form_tags`` : ``<form:error>`` and ``<form:iferror>`` tags are replaced
+and ``form:`` attributes are removed
+
+``markup``    : the tags of fields are rewritten the way htmlfill writes
+them, e.g. attribute values are double quoted and text inputs get an empty
+``value``. This doesn't change what the browser shows.
+
+:func:`needs_fill` tells whether the normalizations that matter change the
+markup, so that htmlfill can be skipped when they don't.
+"""
+import re
+
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+NORMALIZATIONS = ('defaults', 'form_tags', 'markup')
+
+DEFAULT_NORMALIZE = ('defaults', 'form_tags')
+
+_field_re = re.compile(
+    r'<(input|option|textarea)\b((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>', re.I)
+_attr_re = re.compile(
+    r'([^\s"\'=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+_type_re = re.compile(r'(?:^|\s)type\s*=\s*["\']?([^\s"\'>/]+)')
+_form_tag_re = re.compile(r'<form:|\sform:[^\s"\'=/>]+\s*=', re.I)
+
+# input types htmlfill knows about, and what it does with their values
+_text_types = frozenset(
+    'text hidden search tel url email datetime date month week time '
+    'datetime-local number range color'.split())
+_kept_types = frozenset('file image submit reset button'.split())
+_known_types = _text_types | _kept_types | frozenset(
+    ['password', 'checkbox', 'radio'])
+
+
+def _attrs(text):
+    attrs = {}
+    for match in _attr_re.finditer(text):
+        name, double, single, bare = match.groups()
+        value = double if double is not None else single
+        if value is None:
+            value = bare
+        attrs.setdefault(name.lower(), value)
+    return attrs
+
+
+def _changes_defaults(content, force_defaults, text_as_default,
+                      skip_passwords):
+    for match in _field_re.finditer(content):
+        tag = match.group(1).lower()
+        text = match.group(2)
+        if tag == 'textarea':
+            end = match.end()
+            if force_defaults and \
+                    content[end:end + 10].lower() != '</textarea':
+                return True
+            continue
+        # attributes are only parsed when one of interest may be there
+        lowered = text.lower()
+        if tag == 'option':
+            if force_defaults and 'selected' in lowered and \
+                    'selected' in _attrs(text):
+                return True
+            continue
+        if 'value' not in lowered and 'checked' not in lowered:
+            kind = _type_re.search(lowered)
+            if kind is None or kind.group(1) in _known_types:
+                continue
+        attrs = _attrs(text)
+        kind = (attrs.get('type') or 'text').lower()
+        if kind in _text_types or kind == 'password':
+            if kind == 'password' and skip_passwords:
+                continue
+            if force_defaults and attrs.get('value'):
+                return True
+        elif kind == 'checkbox':
+            if 'checked' in attrs and (force_defaults or
+                                       not attrs.get('value')):
+                return True
+        elif kind == 'radio':
+            if force_defaults and 'checked' in attrs:
+                return True
+        elif kind not in _kept_types:
+            if not text_as_default:
+                # htmlfill refuses unknown types, let it say so
+                return True
+            if attrs.get('value'):
+                return True
+    return False
+
+
+def needs_fill(content, normalize=DEFAULT_NORMALIZE, force_defaults=True,
+               text_as_default=False, skip_passwords=False,
+               add_attributes=None, listener=None, **htmlfill_kwargs):
+    """
+    Returns whether running htmlfill with no defaults and no errors would
+    change `content` in one of the ways named in `normalize` (see
+    :data:`NORMALIZATIONS`). If it wouldn't, `content` may be used as it
+    is.
+
+    The other arguments are those of ``htmlfill.render()`` that matter
+    when there is nothing to fill in. The markup is scanned with regular
+    expressions, which is much cheaper than parsing it; when in doubt
+    this returns **True**.
+    """
+    for name in normalize:
+        if name not in NORMALIZATIONS:
+            raise ValueError('unknown htmlfill normalization %r' % name)
+    if 'markup' in normalize or add_attributes or listener or \
+            not isinstance(content, _text):
+        return True
+    if 'form_tags' in normalize and 'form:' in content and \
+            _form_tag_re.search(content):
+        return True
+    if 'defaults' in normalize:
+        return _changes_defaults(content, force_defaults, text_as_default,
+                                 skip_passwords)
+    return False
@@ -0,0 +1,367 @@
+"""
+Compact binary encoding of the state of a form, for keeping it in the
+session between the steps of a multi-step form.
+
+A state starts with a two byte header (format version and flags) and the
+:attr:`pyramid_simpleform.plans.SchemaPlan.fingerprint` of the fields of
+the form, followed by its body, compressed with zlib if that makes it
+smaller. The body holds the values which differ from the form's initial
+data, the names of those which were removed, the errors and whether the
+form was validated. Names of fields of the schema or validators are
+written as their small integer id in the plan rather than as strings.
+
+Values are written with tags for ``None``, booleans, integers, floats,
+text, bytes, lists, tuples, dicts, sets, dates, times, decimals and error
+messages. Unlike pickle, decoding never runs code. Other types raise a
+**TypeError** when the state is dumped.
+"""
+import datetime
+import decimal
+import re
+import struct
+import zlib
+
+from pyramid_simpleform.errors import ErrorMessage
+
+try:
+    _text = unicode
+    _int_types = (int, long)
+except NameError:
+    _text = str
+    _int_types = (int,)
+
+#: version of the encoding, bumped whenever it changes
+FORMAT_VERSION = 1
+
+_COMPRESSED = 1
+_VALIDATED = 2
+
+# bodies shorter than this are never worth compressing
+_compress_min = 64
+
+_header = struct.Struct('<BBI')
+_double = struct.Struct('<d')
+
+# tags; integers 0-127 are written as one byte 0x80 + value and text of
+# up to 31 bytes as 0x40 + its length followed by the bytes
+(_NONE, _TRUE, _FALSE, _INT, _NEGINT, _FLOAT, _TEXT, _BYTES, _LIST, _TUPLE,
+ _DICT, _SET, _FROZENSET, _DATE, _DATETIME, _TIME, _DECIMAL,
+ _MESSAGE) = range(18)
+_SHORT_TEXT = 0x40
+_SMALL_INT = 0x80
+
+# what datetime and time isoformat() write; fromisoformat() needs 3.7
+_iso_re = re.compile(
+    r'(?:(\d{4})-(\d\d)-(\d\d)T)?(\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?'
+    r'(?:([+-])(\d\d):(\d\d)(?::(\d\d)(?:\.(\d{6}))?)?)?$')
+
+
+class StateError(ValueError):
+    """
+    Raised by :func:`load_state` for states which can't be decoded or were
+    dumped with other fields.
+    """
+
+
+class _FixedOffset(datetime.tzinfo):
+    # datetime.timezone for Python 2
+
+    def __init__(self, offset):
+        self._offset = offset
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return None
+
+    def tzname(self, dt):
+        return None
+
+    def __eq__(self, other):
+        return isinstance(other, _FixedOffset) and \
+            other._offset == self._offset
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._offset)
+
+    def __repr__(self):
+        return '_FixedOffset(%r)' % self._offset
+
+
+_timezone = getattr(datetime, 'timezone', _FixedOffset)
+
+
+def _from_isoformat(value):
+    match = _iso_re.match(value)
+    if match is None:
+        raise StateError('bad time %r' % value)
+    parts = match.groups()
+    tzinfo = None
+    if parts[7] is not None:
+        offset = datetime.timedelta(
+            hours=int(parts[8]), minutes=int(parts[9]),
+            seconds=int(parts[10] or 0), microseconds=int(parts[11] or 0))
+        if parts[7] == '-':
+            offset = -offset
+        tzinfo = _timezone(offset)
+    time = [int(part or 0) for part in parts[3:7]]
+    if parts[0] is None:
+        return datetime.time(*time, tzinfo=tzinfo)
+    date = [int(part) for part in parts[:3]]
+    return datetime.datetime(*(date + time), tzinfo=tzinfo)
+
+
+def _write_uint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _encode(out, value):
+    cls = type(value)
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif cls in _int_types:
+        if 0 <= value < 0x80:
+            out.append(_SMALL_INT + value)
+        elif value > 0:
+            out.append(_INT)
+            _write_uint(out, value)
+        else:
+            out.append(_NEGINT)
+            _write_uint(out, -value)
+    elif cls is float:
+        out.append(_FLOAT)
+        out += _double.pack(value)
+    elif cls is ErrorMessage:
+        out.append(_MESSAGE)
+        _encode(out, _text(value))
+        template = value.template
+        _encode(out, None if template is None else _text(template))
+    elif isinstance(value, _text):
+        data = value.encode('utf-8')
+        if len(data) < 0x20:
+            out.append(_SHORT_TEXT + len(data))
+        else:
+            out.append(_TEXT)
+            _write_uint(out, len(data))
+        out += data
+    elif isinstance(value, bytes):
+        out.append(_BYTES)
+        _write_uint(out, len(value))
+        out += value
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_uint(out, len(value))
+        for key, item in value.items():
+            _encode(out, key)
+            _encode(out, item)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        if isinstance(value, list):
+            out.append(_LIST)
+        elif isinstance(value, tuple):
+            out.append(_TUPLE)
+        elif isinstance(value, set):
+            out.append(_SET)
+        else:
+            out.append(_FROZENSET)
+        _write_uint(out, len(value))
+        for item in value:
+            _encode(out, item)
+    elif isinstance(value, datetime.datetime):
+        out.append(_DATETIME)
+        _encode(out, value.isoformat())
+    elif isinstance(value, datetime.date):
+        out.append(_DATE)
+        _write_uint(out, value.toordinal())
+    elif isinstance(value, datetime.time):
+        out.append(_TIME)
+        _encode(out, value.isoformat())
+    elif isinstance(value, decimal.Decimal):
+        out.append(_DECIMAL)
+        _encode(out, str(value))
+    elif isinstance(value, int):
+        _encode(out, int(value))
+    else:
+        raise TypeError('values of type %s can\'t be dumped' % cls.__name__)
+
+
+class _Reader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def uint(self):
+        data = self.data
+        n = shift = 0
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def take(self, size):
+        start = self.pos
+        self.pos += size
+        if self.pos > len(self.data):
+            raise StateError('truncated state')
+        return self.data[start:self.pos]
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag >= _SMALL_INT:
+            return tag - _SMALL_INT
+        if tag >= _SHORT_TEXT:
+            return self.take(tag - _SHORT_TEXT).decode('utf-8')
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            return self.uint()
+        if tag == _NEGINT:
+            return -self.uint()
+        if tag == _FLOAT:
+            return _double.unpack(self.take(_double.size))[0]
+        if tag == _TEXT:
+            return self.take(self.uint()).decode('utf-8')
+        if tag == _BYTES:
+            return bytes(self.take(self.uint()))
+        if tag == _DICT:
+            result = {}
+            for i in range(self.uint()):
+                key = self.value()
+                result[key] = self.value()
+            return result
+        if tag in (_LIST, _TUPLE, _SET, _FROZENSET):
+            items = [self.value() for i in range(self.uint())]
+            if tag == _TUPLE:
+                return tuple(items)
+            if tag == _SET:
+                return set(items)
+            if tag == _FROZENSET:
+                return frozenset(items)
+            return items
+        if tag == _DATE:
+            return datetime.date.fromordinal(self.uint())
+        if tag in (_DATETIME, _TIME):
+            return _from_isoformat(self.value())
+        if tag == _DECIMAL:
+            return decimal.Decimal(self.value())
+        if tag == _MESSAGE:
+            message = self.value()
+            return ErrorMessage(message, self.value())
+        raise StateError('unknown tag %d' % tag)
+
+
+def _same(a, b):
+    # 1 == True == 1.0, but they aren't the same value for a form
+    return type(a) is type(b) and a == b
+
+
+def dump_state(plan, data, initial=None, errors=None, validated=False,
+               compress=None):
+    """
+    Returns the encoded state of a form with :class:`SchemaPlan` `plan`.
+
+    `data` : the form's data
+
+    `initial` : data the form started with; only the values which differ
+    from it are written
+
+    `errors` : dict of errors, if any
+
+    `validated` : whether the form was validated
+
+    `compress` : compress the body with zlib. By default it is compressed
+    if that makes it smaller.
+    """
+    field_ids = plan.field_ids
+    initial = initial or {}
+
+    changed = {}
+    for key, value in data.items():
+        if key in initial and _same(initial[key], value):
+            continue
+        changed[field_ids.get(key, key)] = value
+    removed = [field_ids.get(key, key) for key in initial
+               if key not in data]
+    if errors:
+        errors = dict((field_ids.get(key, key), value)
+                      for key, value in errors.items())
+
+    body = bytearray()
+    _encode(body, changed)
+    _encode(body, removed)
+    _encode(body, errors or None)
+    body = bytes(body)
+
+    flags = _VALIDATED if validated else 0
+    if compress or (compress is None and len(body) >= _compress_min):
+        compressed = zlib.compress(body)
+        if compress or len(compressed) < len(body):
+            body = compressed
+            flags |= _COMPRESSED
+    return _header.pack(FORMAT_VERSION, flags, plan.fingerprint) + body
+
+
+def load_state(plan, state, initial=None):
+    """
+    Decodes `state` dumped by :func:`dump_state` for a form with
+    :class:`SchemaPlan` `plan` and returns its data, errors and whether it
+    was validated. `initial` must be the data the form was dumped with.
+
+    Raises :class:`StateError` if `state` can't be decoded, was dumped
+    with another version of this encoding or for other fields.
+    """
+    if len(state) < _header.size:
+        raise StateError('truncated state')
+    version, flags, fingerprint = _header.unpack(state[:_header.size])
+    if version != FORMAT_VERSION:
+        raise StateError('state was dumped by another version')
+    if fingerprint != plan.fingerprint:
+        raise StateError('state was dumped for other fields')
+    body = state[_header.size:]
+    if flags & _COMPRESSED:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise StateError('corrupt state: %s' % e)
+
+    fields = plan.fields
+    data = dict(initial or {})
+    reader = _Reader(bytearray(body))
+    try:
+        changed = reader.value()
+        removed = reader.value()
+        errors = reader.value()
+        if reader.pos != len(reader.data):
+            raise StateError('corrupt state: trailing data')
+        for key in removed:
+            data.pop(fields[key] if isinstance(key, int) else key, None)
+        for key, value in changed.items():
+            data[fields[key] if isinstance(key, int) else key] = value
+        if errors:
+            errors = dict((fields[key] if isinstance(key, int) else key,
+                           value) for key, value in errors.items())
+    except StateError:
+        raise
+    except (ArithmeticError, AttributeError, IndexError, TypeError,
+            ValueError) as e:
+        raise StateError('corrupt state: %s' % e)
+    return data, errors or {}, bool(flags & _VALIDATED)
@@ -0,0 +1,521 @@
+"""
+Instruments measuring what forms do, e.g. profiling slow validations, and
+tracing of the phases of their work.
+
+An instrument has a ``measure(phase, form)`` method returning a context
+manager, which is entered around each phase of the form's work:
+``validate``, ``render`` and ``htmlfill``. Instruments are set as the
+**instruments** of a :class:`pyramid_simpleform.Form` subclass or set up
+from the ``simpleform.profile_*`` settings by ``includeme``.
+"""
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def schema_name(schema):
+    """
+    Returns the dotted name of the class of `schema`, or **None**.
+    """
+    if schema is None:
+        return None
+    cls = schema if isinstance(schema, type) else type(schema)
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def payload_shape(params, dict_char='.', list_char='-'):
+    """
+    Returns the shape of `params` as a dict of the number of ``fields``,
+    their nesting ``depth`` and the ``bytes`` of their keys and text
+    values, without the values themselves. `params` may be a flat
+    (Multi)Dict with keys such as ``people-0.name`` or a decoded JSON body.
+    """
+    shape = {'fields': 0, 'depth': 0, 'bytes': 0}
+
+    def size(value):
+        # bytes first: on Python 2 they are text too
+        if isinstance(value, bytes):
+            return len(value)
+        if isinstance(value, _text):
+            return len(value.encode('utf-8'))
+        return 0
+
+    def walk(value, depth):
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, (list, tuple)):
+            items = enumerate(value)
+        else:
+            shape['fields'] += 1
+            shape['depth'] = max(shape['depth'], depth)
+            shape['bytes'] += size(value)
+            return
+        for key, item in items:
+            shape['bytes'] += size(key)
+            walk(item, depth + 1)
+
+    if hasattr(params, 'getall'):
+        for key, value in params.items():
+            depth = key.count(dict_char) + key.count(list_char) + 1
+            shape['fields'] += 1
+            shape['depth'] = max(shape['depth'], depth)
+            shape['bytes'] += size(key) + size(value)
+    else:
+        walk(params or {}, 0)
+    return shape
+
+
+class Sampler(object):
+    """
+    Profiles form validation and rendering, writing a ``cProfile`` dump of
+    the calls that turn out to be slow to `directory`. Next to each
+    ``.prof`` dump, which can be read with ``pstats``, a ``.json`` file
+    records the phase, the schema, the duration and the
+    :func:`payload_shape` of the params (or of the data, when rendering).
+
+    `directory` : where dumps are written
+
+    `threshold` : calls taking at least this many seconds are dumped
+
+    `every` : only profile one in this many calls, as profiling slows
+    calls down
+
+    `max_bytes` : disk space used by dumps, beyond which the oldest are
+    removed
+
+    `phases` : phases to profile
+    """
+
+    def __init__(self, directory, threshold=1.0, every=1,
+                 max_bytes=100 * 1024 * 1024, phases=('validate', 'render')):
+        self.directory = directory
+        self.threshold = threshold
+        self.every = max(int(every), 1)
+        self.max_bytes = max_bytes
+        self.phases = phases
+        self._calls = itertools.count(1)
+        self._dumps = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, phase, form):
+        if phase not in self.phases or next(self._calls) % self.every:
+            yield
+            return
+
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is running in this thread
+            yield
+            return
+
+        start = _timer()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duration = _timer() - start
+            if duration >= self.threshold:
+                self.dump(profile, phase, form, duration)
+
+    def dump(self, profile, phase, form, duration):
+        """
+        Writes the stats of `profile` and their ``.json`` description, then
+        removes old dumps if there are too many.
+        """
+        name = schema_name(getattr(form, 'schema', None))
+        params = getattr(form, '_params', None)
+        if params is None or phase != 'validate':
+            params = getattr(form, 'data', None)
+        info = {
+            'phase': phase,
+            'schema': name,
+            'duration': duration,
+            'time': time.time(),
+        }
+        info.update(payload_shape(params,
+                                  getattr(form, 'dict_char', '.'),
+                                  getattr(form, 'list_char', '-')))
+
+        base = os.path.join(self.directory, '%s-%d-%d-%s-%s' % (
+            time.strftime('%Y%m%d%H%M%S'), os.getpid(), next(self._dumps),
+            phase, (name or 'validators').rsplit('.', 1)[-1]))
+
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            profile.dump_stats(base + '.prof')
+            with open(base + '.json', 'w') as f:
+                json.dump(info, f, sort_keys=True)
+            self._trim()
+        return base + '.prof'
+
+    def dumps(self):
+        """
+        Returns the paths of the dumps in `directory`, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        paths = [os.path.join(self.directory, filename)
+                 for filename in os.listdir(self.directory)
+                 if filename.endswith('.prof')]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+    def _trim(self):
+        files = []
+        total = 0
+        for path in self.dumps():
+            size = os.path.getsize(path)
+            info = path[:-len('.prof')] + '.json'
+            if os.path.exists(info):
+                size += os.path.getsize(info)
+            files.append((path, info, size))
+            total += size
+
+        for path, info, size in files:
+            if total <= self.max_bytes:
+                break
+            for p in (path, info):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+
+class MemoryStats(object):
+    """
+    Allocations of one phase of one schema's forms, in bytes, as recorded
+    by :class:`MemoryAccounting`.
+
+    `calls` : number of calls measured
+
+    `peak`, `net` : the peak and net allocations of the last call
+
+    `max_peak` : the highest peak of all calls
+
+    `total_net` : the net allocations of all calls added up
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.peak = self.net = 0
+        self.max_peak = self.total_net = 0
+
+    def __repr__(self):
+        return '<MemoryStats calls=%d peak=%d net=%d max_peak=%d>' % (
+            self.calls, self.peak, self.net, self.max_peak)
+
+    def add(self, peak, net):
+        self.calls += 1
+        self.peak = peak
+        self.net = net
+        self.max_peak = max(self.max_peak, peak)
+        self.total_net += net
+
+
+class MemoryAccounting(object):
+    """
+    Records the memory allocated by form phases with ``tracemalloc``,
+    which is started if it isn't running already. For each schema and
+    phase, the peak allocations during a call (above what was allocated
+    when it started) and the net allocations left when it ends are kept as
+    :class:`MemoryStats`.
+
+    ``tracemalloc`` slows everything down and counts the allocations of
+    all threads, so this is meant for tests and for investigating
+    workers, not for permanent use in production. ``tracemalloc`` needs
+    Python 3.4; before Python 3.9, whose ``tracemalloc`` can't reset the
+    peak, the peak of a call is only measured at its start and end.
+
+    `phases` : phases to measure
+    """
+
+    def __init__(self, phases=('validate', 'render', 'htmlfill')):
+        import tracemalloc
+        self._tracemalloc = tracemalloc
+        # Python 3.9+
+        self._reset_peak = getattr(tracemalloc, 'reset_peak', None)
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        self.phases = phases
+        self._stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, phase, form):
+        if phase not in self.phases:
+            yield
+            return
+
+        try:
+            stack = self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+
+        start, peak = self._traced_memory()
+        if stack:
+            # the enclosing phase's peak so far, before it's reset
+            stack[-1][1] = max(stack[-1][1], peak)
+        if self._reset_peak is not None:
+            self._reset_peak()
+        frame = [start, start]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            end, peak = self._traced_memory()
+            peak = max(frame[1], peak)
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            self.stats(getattr(form, 'schema', None), phase, True).add(
+                peak - start, end - start)
+
+    def _traced_memory(self):
+        current, peak = self._tracemalloc.get_traced_memory()
+        if self._reset_peak is None:
+            # the peak since tracing started says nothing about this call
+            return current, current
+        return current, peak
+
+    def stats(self, schema=None, phase=None, create=False):
+        """
+        Returns the :class:`MemoryStats` of `phase` for `schema` (a schema
+        or the name returned by :func:`schema_name`), or **None** if
+        nothing was recorded. Without arguments, returns a dict of all the
+        stats by ``(schema name, phase)``.
+        """
+        if schema is None and phase is None:
+            return dict(self._stats)
+        if not isinstance(schema, _text) and schema is not None:
+            schema = schema_name(schema)
+        key = (schema, phase)
+        stats = self._stats.get(key)
+        if stats is None and create:
+            with self._lock:
+                stats = self._stats.setdefault(key, MemoryStats())
+        return stats
+
+    def clear(self):
+        self._stats = {}
+
+    def stop(self):
+        """
+        Stops ``tracemalloc``, if it was started by this instance.
+        """
+        if self._started:
+            self._tracemalloc.stop()
+            self._started = False
+
+
+class Span(object):
+    """
+    A timed part of a form's work, as recorded by :class:`MemoryTracer`.
+    Spans are context managers, ending when the context is left.
+
+    `name` : e.g. ``form.validate``
+
+    `attributes` : dict of attributes such as the ``schema``
+
+    `parent` : the span this one is nested in, or **None**
+
+    `children` : list of the spans nested in this one
+    """
+
+    recording = True
+
+    def __init__(self, tracer, name, attributes, parent=None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.children = []
+        self.start_time = _timer()
+        self.end_time = None
+
+    def __repr__(self):
+        return '<Span %s %r>' % (self.name, self.attributes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self.set_attribute('error', exc_type.__name__)
+        self.end()
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = _timer()
+            self.tracer._end(self)
+
+
+class NoopSpan(object):
+    """
+    Span which records nothing, returned by :class:`NoopTracer`.
+    """
+
+    recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer(object):
+    """
+    The default tracer, which records nothing.
+
+    A tracer has a single method, ``start_span(name, **attributes)``,
+    returning a span: a context manager with ``set_attribute(key,
+    value)`` and ``end()`` methods and a ``recording`` flag, which is
+    **False** if attributes are thrown away. Adapt your tracing library to
+    this to see forms in your request traces.
+    """
+
+    def start_span(self, name, **attributes):
+        return NOOP_SPAN
+
+
+NOOP_TRACER = NoopTracer()
+
+
+class MemoryTracer(object):
+    """
+    Tracer keeping :class:`Span` objects in memory, for tests and
+    debugging. Spans started while another is open in the same thread
+    are nested in it.
+
+    `spans` : list of the spans that have ended, in the order they ended
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def start_span(self, name, **attributes):
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = Span(self, name, attributes, parent)
+        if parent is not None:
+            parent.children.append(span)
+        stack.append(span)
+        return span
+
+    def _end(self, span):
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        self.spans.append(span)
+
+    def find(self, name):
+        """
+        Returns the ended spans called `name`.
+        """
+        return [span for span in self.spans if span.name == name]
+
+    def roots(self):
+        """
+        Returns the ended spans which aren't nested in another span.
+        """
+        return [span for span in self.spans if span.parent is None]
+
+    def clear(self):
+        self.spans = []
+
+
+@contextlib.contextmanager
+def measure(instruments, phase, form):
+    """
+    Enters the ``measure()`` context of each of `instruments`.
+    """
+    # nested by hand, contextlib.ExitStack() is Python 3 only
+    if not instruments:
+        yield
+        return
+    with instruments[0].measure(phase, form):
+        with measure(instruments[1:], phase, form):
+            yield
+
+
+def instruments_from_settings(settings, prefix='simpleform.'):
+    """
+    Returns a list of instruments configured by `settings`:
+
+    ``simpleform.profile_dir``
+        directory for the dumps of a :class:`Sampler`, which is only used
+        if this is set
+
+    ``simpleform.profile_threshold``, ``simpleform.profile_every``,
+    ``simpleform.profile_max_bytes``
+        the `threshold`, `every` and `max_bytes` of the :class:`Sampler`
+    """
+    instruments = []
+    directory = settings.get(prefix + 'profile_dir')
+    if directory:
+        instruments.append(Sampler(
+            directory,
+            threshold=float(settings.get(prefix + 'profile_threshold', 1.0)),
+            every=int(settings.get(prefix + 'profile_every', 1)),
+            max_bytes=int(settings.get(prefix + 'profile_max_bytes',
+                                       100 * 1024 * 1024))))
+    return instruments
+
+
+def tracer_from_settings(settings, prefix='simpleform.'):
+    """
+    Returns the tracer named by the ``simpleform.tracer`` setting, a
+    dotted name of a tracer or of a class which is called to create one,
+    or **None**.
+    """
+    tracer = settings.get(prefix + 'tracer')
+    if not tracer:
+        return None
+    from pyramid.path import DottedNameResolver
+    tracer = DottedNameResolver().maybe_resolve(tracer)
+    if isinstance(tracer, type):
+        tracer = tracer()
+    return tracer
@@ -0,0 +1,153 @@
+"""
+Decoding of JSON request bodies and encoding of JSON responses.
+"""
+import datetime
+import decimal
+import json
+
+ENVIRON_KEY = 'pyramid_simpleform.json_body'
+
+_resolved = {}
+
+
+def json_default(obj):
+    """
+    Converts objects the JSON encoders don't know about: dates and times to
+    ISO 8601 strings, decimals to strings, sets to lists and objects with a
+    ``__json__()`` method to whatever it returns. Anything else is
+    converted to a string.
+    """
+    if hasattr(obj, '__json__'):
+        return obj.__json__()
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+_stdlib_encoder = json.JSONEncoder(default=json_default,
+                                   separators=(',', ':'))
+
+
+def stdlib_json_encoder(obj):
+    """
+    Encodes `obj` to UTF-8 JSON bytes with a single, reused
+    ``json.JSONEncoder``.
+    """
+    return _stdlib_encoder.encode(obj).encode('utf-8')
+
+
+def default_json_encoder():
+    """
+    Returns the fastest JSON encoder available, as a function returning
+    bytes: ``orjson.dumps`` if installed, otherwise
+    :func:`stdlib_json_encoder`. Both use :func:`json_default`.
+    """
+    try:
+        import orjson
+    except ImportError:
+        return stdlib_json_encoder
+
+    def orjson_encoder(obj):
+        return orjson.dumps(obj, default=json_default)
+    return orjson_encoder
+
+
+def default_json_decoder():
+    """
+    Returns the fastest JSON decoder available: ``orjson.loads`` or
+    ``ujson.loads`` if installed, otherwise the standard library's
+    ``json.loads``. All of these decode bytes directly, except
+    ``json.loads`` before Python 3.6, for which :func:`get_json_body`
+    decodes the bytes to text first.
+    """
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+        return ujson.loads
+    except ImportError:
+        pass
+    return json.loads
+
+
+def _resolve(func, default):
+    if callable(func):
+        return func
+    key = (func, default)
+    try:
+        return _resolved[key]
+    except KeyError:
+        pass
+
+    if func is None:
+        resolved = default()
+    else:
+        from pyramid.path import DottedNameResolver
+        resolved = DottedNameResolver().resolve(func)
+    _resolved[key] = resolved
+    return resolved
+
+
+def resolve_json_decoder(decoder):
+    """
+    Returns `decoder`, resolving it first if it is a dotted name such as
+    ``"orjson.loads"``. If `decoder` is **None** returns
+    :func:`default_json_decoder`.
+    """
+    return _resolve(decoder, default_json_decoder)
+
+
+def resolve_json_encoder(encoder):
+    """
+    Returns `encoder`, a function encoding an object to JSON bytes,
+    resolving it first if it is a dotted name. If `encoder` is **None**
+    returns :func:`default_json_encoder`.
+    """
+    return _resolve(encoder, default_json_encoder)
+
+
+def get_json_body(request, decoder=None):
+    """
+    Returns the JSON body of `request` decoded with `decoder`, or **None**
+    if the request has no JSON body.
+
+    The body bytes are decoded directly, without first decoding them to
+    text, unless `decoder` only takes text (raising ``TypeError``), as
+    ``json.loads`` did before Python 3.6. Form-encoded and multipart
+    requests are not decoded at all. The
+    result is kept in the WSGI environ so the body is decoded only once per
+    request.
+    """
+    environ = getattr(request, 'environ', None)
+    if environ is not None and ENVIRON_KEY in environ:
+        return environ[ENVIRON_KEY]
+
+    if 'json_body' in request.__dict__:
+        # explicitly set, e.g. on a testing.DummyRequest
+        result = request.__dict__['json_body']
+    else:
+        result = None
+        content_type = getattr(request, 'content_type', None) or ''
+        body = getattr(request, 'body', None)
+        if body and not content_type.startswith(
+                ('application/x-www-form-urlencoded', 'multipart/')):
+            decode = resolve_json_decoder(decoder)
+            try:
+                try:
+                    result = decode(body)
+                except TypeError:
+                    charset = getattr(request, 'charset', None) or 'utf-8'
+                    result = decode(body.decode(charset))
+            except ValueError:
+                pass
+
+    if environ is not None:
+        environ[ENVIRON_KEY] = result
+    return result
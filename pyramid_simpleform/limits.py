@@ -0,0 +1,193 @@
+"""
+Limits on the size and shape of submitted form data.
+"""
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+_ = lambda s: s
+
+
+class PayloadRejected(ValueError):
+    """
+    Raised by :meth:`InputLimits.check` when the input breaks a limit.
+
+    `code` : name of the message, e.g. ``tooManyFields``
+
+    `message` : untranslated message
+    """
+
+    def __init__(self, code, message, **kw):
+        ValueError.__init__(self, message % kw)
+        self.code = code
+        self.message = message
+        self.kw = kw
+
+
+class InputLimits(object):
+    """
+    Limits checked against the raw params in :meth:`pyramid_simpleform.Form.validate`
+    before they are decoded or validated. Any limit may be **None**, in
+    which case it isn't checked.
+
+    `max_fields`      : maximum number of fields (values, for JSON bodies)
+
+    `max_key_length`  : maximum length of a field name
+
+    `max_depth`       : maximum nesting depth of a field name (``a.b-0.c``
+    has a depth of 4) with `variable_decode`, or of a JSON body
+
+    `max_list_index`  : maximum list index in a field name with
+    `variable_decode`, or in a JSON body
+
+    `max_value_bytes` : maximum total size of the values in bytes, with
+    text counted as UTF-8. Uploaded files are not counted.
+
+    The input is scanned once, so the cost of rejecting it is proportional
+    to its size.
+    """
+
+    settings = ('max_fields', 'max_key_length', 'max_depth',
+                'max_list_index', 'max_value_bytes')
+
+    _messages = dict(
+        tooManyFields=_('The form has too many fields'),
+        keyTooLong=_('The form has a field name that is too long'),
+        tooDeep=_('The form is nested too deeply'),
+        indexTooLarge=_('The form has a list that is too long'),
+        tooLarge=_('The form data is too large'),
+    )
+
+    def __init__(self, max_fields=None, max_key_length=None, max_depth=None,
+                 max_list_index=None, max_value_bytes=None):
+        self.max_fields = max_fields
+        self.max_key_length = max_key_length
+        self.max_depth = max_depth
+        self.max_list_index = max_list_index
+        self.max_value_bytes = max_value_bytes
+
+    @classmethod
+    def from_settings(cls, settings, prefix='simpleform.'):
+        """
+        Returns limits read from Pyramid `settings`, e.g.
+        ``simpleform.max_fields = 1000``.
+        """
+        kw = {}
+        for name in cls.settings:
+            value = settings.get(prefix + name)
+            if value not in (None, ''):
+                kw[name] = int(value)
+        return cls(**kw)
+
+    def __bool__(self):
+        return any(getattr(self, name) is not None for name in self.settings)
+
+    __nonzero__ = __bool__
+
+    def _reject(self, code, **kw):
+        raise PayloadRejected(code, self._messages[code], **kw)
+
+    def _add_bytes(self, total, value):
+        if isinstance(value, bytes):
+            total += len(value)
+        elif isinstance(value, _text):
+            total += len(value.encode('utf-8'))
+        else:
+            return total
+        if self.max_value_bytes is not None and total > self.max_value_bytes:
+            self._reject('tooLarge')
+        return total
+
+    def check(self, params, dict_char='.', list_char='-', structured=False,
+              nested=False):
+        """
+        Checks `params`, a dict or MultiDict of flat params, raising
+        :class:`PayloadRejected` for the first limit broken.
+
+        `structured` : `params` is a decoded JSON body of nested dicts and
+        lists
+
+        `nested` : field names are paths to be decoded by
+        ``variable_decode``; otherwise their depth is always 1 and they
+        have no list index
+        """
+        if structured:
+            return self._check_structure(params)
+
+        max_fields = self.max_fields
+        max_key_length = self.max_key_length
+        max_depth = self.max_depth
+        max_list_index = self.max_list_index
+        check_key = nested and (max_depth is not None or
+                                max_list_index is not None)
+
+        count = 0
+        total = 0
+        for key, value in params.items():
+            count += 1
+            if max_fields is not None and count > max_fields:
+                self._reject('tooManyFields')
+            if max_key_length is not None and len(key) > max_key_length:
+                self._reject('keyTooLong')
+            if check_key:
+                self._check_key(key, dict_char, list_char)
+            total = self._add_bytes(total, value)
+
+    def _check_key(self, key, dict_char, list_char):
+        if self.max_depth is not None:
+            depth = key.count(dict_char) + key.count(list_char) + 1
+            if depth > self.max_depth:
+                self._reject('tooDeep')
+        if self.max_list_index is not None and list_char in key:
+            for part in key.split(list_char)[1:]:
+                digits = part.split(dict_char, 1)[0]
+                if digits.isdigit() and (
+                        len(digits) > 18 or
+                        int(digits) > self.max_list_index):
+                    self._reject('indexTooLarge')
+
+    def _check_structure(self, params):
+        count = 0
+        total = 0
+        stack = [(params, 1)]
+        while stack:
+            value, depth = stack.pop()
+            if isinstance(value, dict):
+                items = value.items()
+            elif isinstance(value, list):
+                if self.max_list_index is not None and \
+                        len(value) - 1 > self.max_list_index:
+                    self._reject('indexTooLarge')
+                items = enumerate(value)
+            else:
+                count += 1
+                if self.max_fields is not None and count > self.max_fields:
+                    self._reject('tooManyFields')
+                total = self._add_bytes(total, value)
+                continue
+
+            if self.max_depth is not None and depth > self.max_depth:
+                self._reject('tooDeep')
+            for key, item in items:
+                if self.max_key_length is not None and \
+                        isinstance(key, _text) and \
+                        len(key) > self.max_key_length:
+                    self._reject('keyTooLong')
+                stack.append((item, depth + 1))
+
+
+def get_limits(registry):
+    """
+    Returns the :class:`InputLimits` read from the settings of `registry`,
+    or **None** if none are set. They are read once and kept on the
+    registry.
+    """
+    try:
+        return registry.simpleform_limits
+    except AttributeError:
+        pass
+    settings = getattr(registry, 'settings', None) or {}
+    limits = registry.simpleform_limits = \
+        InputLimits.from_settings(settings) or None
+    return limits
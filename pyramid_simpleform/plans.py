@@ -0,0 +1,534 @@
+"""
+Per-schema metadata that is worked out once and then reused by every
+:class:`pyramid_simpleform.Form` built from the same schema.
+"""
+import copy
+import zlib
+from operator import attrgetter
+
+from formencode import Invalid, NoDefault, Validator
+
+from pyramid_simpleform.cache import LRUCache
+from pyramid_simpleform.compiler import compile_schema
+from pyramid_simpleform.errors import iter_messages
+
+try:
+    _text = basestring
+except NameError:
+    _text = str
+
+_marker = object()
+
+_plans = LRUCache(512)
+
+
+class SchemaPlan(object):
+    """
+    Field metadata derived from a FormEncode schema and/or a dict of
+    validators.
+
+    `schema` : FormEncode Schema class or instance
+
+    `validators` : names (or dict) of extra field validators
+
+    Plans should normally be obtained with :func:`get_plan`, which caches
+    them.
+    """
+
+    def __init__(self, schema=None, validators=None):
+        fields = []
+        if schema is not None:
+            fields.extend(schema.fields.keys())
+        for name in validators or ():
+            if name not in fields:
+                fields.append(name)
+
+        self.schema = schema
+        self.fields = tuple(fields)
+        self._getters = {}
+        self._message_codes = None
+        self._validation_order = None
+        self._budgeted_schema = None
+        self._cacheable = None
+        self._compiled = _marker
+        self._field_schemas = {}
+        self._field_ids = None
+        #: set by :func:`pyramid_simpleform.clientside.get_client_rules`
+        self.client_rules = None
+
+    @property
+    def message_codes(self):
+        """
+        Dict mapping the message templates of the schema and all of its
+        subvalidators to their message keys, e.g. ``'Missing value'`` to
+        ``'missingValue'``.
+        """
+        if self._message_codes is None:
+            validators = [self.schema] if self.schema is not None else []
+            self._message_codes = message_codes(validators)
+        return self._message_codes
+
+    @property
+    def validation_order(self):
+        """
+        Schema field names ordered by :func:`validation_cost`, cheapest
+        first.
+        """
+        if self._validation_order is None:
+            fields = self.schema.fields if self.schema is not None else {}
+            self._validation_order = tuple(sorted(
+                fields, key=lambda name: validation_cost(fields[name])))
+        return self._validation_order
+
+    @property
+    def budgeted_schema(self):
+        """
+        A copy of the schema whose field validators stop validation once
+        the :class:`ErrorBudget` found on the state is spent.
+        """
+        if self._budgeted_schema is None:
+            schema = self.schema
+            if isinstance(schema, type):
+                schema = schema()
+            schema = copy.copy(schema)
+            schema.fields = dict((name, BudgetedValidator(validator=v))
+                                 for name, v in schema.fields.items())
+            schema.pre_validators = list(schema.pre_validators) + [
+                BudgetedKeys(schema=schema)]
+            self._budgeted_schema = schema
+        return self._budgeted_schema
+
+    @property
+    def cacheable(self):
+        """
+        Whether the schema's results may be cached, see
+        :func:`is_cacheable`.
+        """
+        if self._cacheable is None:
+            self._cacheable = self.schema is None or \
+                is_cacheable(self.schema)
+        return self._cacheable
+
+    @property
+    def compiled(self):
+        """
+        The schema compiled by
+        :func:`pyramid_simpleform.compiler.compile_schema`, or **None** if
+        it can't be compiled.
+        """
+        if self._compiled is _marker:
+            self._compiled = None
+            if self.schema is not None:
+                self._compiled = compile_schema(self.schema)
+        return self._compiled
+
+    @property
+    def field_ids(self):
+        """
+        Dict mapping each field name to its position in **fields**, used
+        to write field names compactly.
+        """
+        if self._field_ids is None:
+            self._field_ids = dict(
+                (name, i) for i, name in enumerate(self.fields))
+        return self._field_ids
+
+    @property
+    def fingerprint(self):
+        """
+        CRC-32 of the field names, which changes whenever the ids in
+        **field_ids** do.
+        """
+        data = '\n'.join(self.fields).encode('utf-8')
+        return zlib.crc32(data) & 0xffffffff
+
+    def field_schema(self, name):
+        """
+        Returns a copy of the schema with just field `name` and the
+        chained validators naming it (see :func:`chained_fields`), along
+        with the other fields they name. Other params are ignored.
+        """
+        return self._field_plan(name)[0]
+
+    def field_validator(self, name):
+        """
+        Returns a function validating the :meth:`field_schema` of `name`,
+        compiled if it can be, with the same signature and results as
+        ``schema.to_python()``.
+        """
+        return self._field_plan(name)[1]
+
+    def _field_plan(self, name):
+        try:
+            return self._field_schemas[name]
+        except KeyError:
+            pass
+
+        schema = self.schema
+        if isinstance(schema, type):
+            schema = schema()
+        names = set([name])
+        chained = []
+        for validator in schema.chained_validators:
+            fields = chained_fields(validator)
+            if name in fields:
+                chained.append(validator)
+                names.update(fields)
+        schema = copy.copy(schema)
+        schema.fields = dict((n, v) for n, v in schema.fields.items()
+                             if n in names)
+        schema.chained_validators = chained
+        schema.allow_extra_fields = True
+        schema.filter_extra_fields = True
+        plan = self._field_schemas[name] = (
+            schema, compile_schema(schema) or schema.to_python)
+        return plan
+
+    def warm(self, budget=True):
+        """
+        Works out everything the plan computes lazily, so the first form
+        using it doesn't have to.
+
+        `budget` : also prepare the copy of the schema used by forms with
+        an error budget
+        """
+        self.message_codes
+        self.cacheable
+        if self.schema is not None:
+            self.validation_order
+            self.compiled
+            if budget:
+                self.budgeted_schema
+        return self
+
+    def getter(self, cls):
+        """
+        Returns a function which reads the plan's fields from an instance
+        of `cls` into a dict. Fields the object doesn't have are left out.
+
+        Attributes declared on the class itself (e.g. SQLAlchemy columns
+        and relationships, properties) are fetched in a single
+        ``attrgetter`` call; anything else falls back to ``getattr``.
+        """
+        try:
+            return self._getters[cls]
+        except KeyError:
+            pass
+
+        declared = tuple(f for f in self.fields if hasattr(cls, f))
+        others = tuple(f for f in self.fields if f not in declared)
+        fetch = attrgetter(*declared) if declared else None
+
+        def get_values(obj):
+            values = {}
+            if fetch is not None:
+                try:
+                    fetched = fetch(obj)
+                except AttributeError:
+                    fetched = _marker
+                if fetched is _marker:
+                    for f in declared:
+                        value = getattr(obj, f, _marker)
+                        if value is not _marker:
+                            values[f] = value
+                else:
+                    if len(declared) == 1:
+                        fetched = (fetched,)
+                    values.update(zip(declared, fetched))
+            for f in others:
+                value = getattr(obj, f, _marker)
+                if value is not _marker:
+                    values[f] = value
+            return values
+
+        self._getters[cls] = get_values
+        return get_values
+
+    def load_only(self, model):
+        """
+        Returns the names of the mapped column attributes of SQLAlchemy
+        class `model` that the form needs.
+        """
+        from sqlalchemy import inspect
+        columns = inspect(model).column_attrs.keys()
+        return tuple(f for f in self.fields if f in columns)
+
+    def relationships(self, model):
+        """
+        Returns the names of the relationships of SQLAlchemy class `model`
+        that the form needs.
+        """
+        from sqlalchemy import inspect
+        relationships = inspect(model).relationships.keys()
+        return tuple(f for f in self.fields if f in relationships)
+
+    def loader_options(self, model, relationship_loader=None):
+        """
+        Returns a list of SQLAlchemy loader options that load exactly the
+        attributes of `model` needed to populate the form, for example::
+
+            plan = get_plan(MySchema)
+            obj = DBSession.query(Model).options(
+                *plan.loader_options(Model)).get(id)
+            form = Form(request, MySchema, obj=obj)
+
+        Deferred columns named by the schema are undeferred and any other
+        columns are deferred.
+
+        `relationship_loader` : loader used for relationships, by default
+        ``sqlalchemy.orm.joinedload`` so the object is fetched with one
+        query.
+        """
+        from sqlalchemy.orm import joinedload, load_only
+
+        if relationship_loader is None:
+            relationship_loader = joinedload
+
+        options = []
+        columns = self.load_only(model)
+        if columns:
+            options.append(load_only(*[getattr(model, c) for c in columns]))
+        for name in self.relationships(model):
+            options.append(relationship_loader(getattr(model, name)))
+        return options
+
+
+def validation_cost(validator):
+    """
+    Returns the relative cost of running `validator`, used to run cheap
+    checks first when a form has an error budget. Set a
+    ``validation_cost`` attribute on a validator (class) to override the
+    default, which is 1 for simple validators and 10 for compound or
+    repeating ones such as schemas and ``ForEach``.
+    """
+    cost = getattr(validator, 'validation_cost', None)
+    if cost is not None:
+        return cost
+    if getattr(validator, 'compound', False) or \
+            getattr(validator, 'repeating', False):
+        return 10
+    return 1
+
+
+class BudgetExhausted(Exception):
+    """
+    Raised by :class:`BudgetedValidator` when the error budget is spent.
+    """
+
+
+class ErrorBudget(object):
+    """
+    Counts errors during validation.
+
+    `max_errors` : number of errors after which validation stops
+    """
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.count = 0
+        self.errors = {}
+
+    @property
+    def exhausted(self):
+        return self.count >= self.max_errors
+
+    def add(self, name, error):
+        self.errors[name] = error
+        if isinstance(error, Invalid):
+            self.count += sum(1 for message in iter_messages(error))
+        else:
+            self.count += 1
+
+
+class BudgetedValidator(Validator):
+    """
+    Wraps a schema field validator, recording its errors in the
+    :class:`ErrorBudget` found as ``_error_budget`` on the state and
+    raising :class:`BudgetExhausted` instead of validating once the
+    budget is spent.
+    """
+
+    validator = None
+
+    @property
+    def if_missing(self):
+        return getattr(self.validator, 'if_missing', NoDefault)
+
+    @property
+    def accept_iterator(self):
+        return getattr(self.validator, 'accept_iterator', False)
+
+    def message(self, msgName, state, **kw):
+        return self.validator.message(msgName, state, **kw)
+
+    def to_python(self, value, state=None):
+        budget = getattr(state, '_error_budget', None)
+        if budget is not None and budget.exhausted:
+            raise BudgetExhausted()
+        try:
+            return self.validator.to_python(value, state)
+        except Invalid as e:
+            if budget is not None:
+                budget.add(getattr(state, 'key', None), e)
+            raise
+
+
+class BudgetedKeys(Validator):
+    """
+    Last pre-validator of a budgeted `schema`, recording the errors the
+    schema raises for missing and unexpected fields itself, without
+    running the field validators, in the :class:`ErrorBudget` on the
+    state. Missing fields are counted before any field is validated, as
+    they are the cheapest errors to find.
+    """
+
+    schema = None
+
+    def to_python(self, value_dict, state=None):
+        budget = getattr(state, '_error_budget', None)
+        if budget is None or not isinstance(value_dict, dict):
+            return value_dict
+        schema = self.schema
+        if not schema.allow_extra_fields:
+            for name in value_dict:
+                if name not in schema.fields:
+                    # the schema gives up on the first one
+                    raise Invalid(schema.message(
+                        'notExpected', state, name=repr(name)),
+                        value_dict, state)
+        if schema.ignore_key_missing or \
+                schema.if_key_missing is not NoDefault:
+            return value_dict
+        for name, validator in schema.fields.items():
+            if name in value_dict or validator.if_missing is not NoDefault:
+                continue
+            if budget.exhausted:
+                raise BudgetExhausted()
+            try:
+                message = validator.message('missing', state)
+            except KeyError:
+                message = schema.message('missingValue', state)
+            budget.add(name, Invalid(message, None, state))
+        return value_dict
+
+
+#: attributes of FormEncode's chained validators naming the fields they check
+chained_field_attrs = ('field_names', 'required', 'missing', 'present',
+                       'field', 'required_fields', 'cc_type_field',
+                       'cc_number_field', 'cc_code_field',
+                       'cc_expires_month_field', 'cc_expires_year_field')
+
+
+def chained_fields(validator):
+    """
+    Returns the set of field names chained `validator` checks, read from
+    the attributes in :data:`chained_field_attrs`. Give your own chained
+    validators a ``field_names`` attribute to have them run by
+    :meth:`SchemaPlan.field_validator`.
+    """
+    fields = set()
+    for attr in chained_field_attrs:
+        value = getattr(validator, attr, None)
+        if isinstance(value, _text):
+            fields.add(value)
+        elif isinstance(value, (list, tuple)):
+            fields.update(v for v in value if isinstance(v, _text))
+    return fields
+
+
+def iter_validators(validator):
+    """
+    Yields `validator` and, recursively, all of its subvalidators.
+    """
+    stack = [validator]
+    seen = set()
+    while stack:
+        validator = stack.pop()
+        if id(validator) in seen:
+            continue
+        seen.add(id(validator))
+        yield validator
+        try:
+            stack.extend(validator.subvalidators())
+        except (AttributeError, TypeError):
+            pass
+
+
+def is_cacheable(validator):
+    """
+    Returns **False** if `validator` or any of its subvalidators has a
+    ``cacheable`` attribute set to **False**, or is a ``DateValidator``
+    comparing against the current date. Results of such validators depend
+    on more than their input, e.g. on the database or the time, and are
+    never taken from the form result cache.
+    """
+    for v in iter_validators(validator):
+        if not getattr(v, 'cacheable', True):
+            return False
+        if getattr(v, 'after_now', False) or \
+                getattr(v, 'today_or_after', False):
+            return False
+    return True
+
+
+def message_codes(validators):
+    """
+    Returns a dict mapping each message template of `validators` and
+    their subvalidators to its message key.
+    """
+    codes = {}
+    for validator in validators:
+        for v in iter_validators(validator):
+            for key, template in getattr(v, '_messages', {}).items():
+                codes.setdefault(template, key)
+    return codes
+
+
+def schema_key(schema):
+    """
+    Returns the key of `schema` in the plan cache: classes are their own
+    key, instances are keyed by their class and configuration, so that a
+    ``MySchema()`` built for each request reuses one plan.
+
+    Validators and other unhashable settings are keyed by identity, which
+    is safe because the plan holds on to the first instance.
+    """
+    attrs = getattr(schema, '__dict__', None)
+    if schema is None or isinstance(schema, type) or attrs is None:
+        return schema
+    config = []
+    for name, value in sorted(attrs.items()):
+        if name == 'declarative_count':
+            continue
+        if name == 'fields':
+            value = tuple(sorted((key, id(validator))
+                                 for key, validator in value.items()))
+        elif isinstance(value, list):
+            value = tuple(id(item) for item in value)
+        else:
+            try:
+                hash(value)
+            except TypeError:
+                value = id(value)
+        config.append((name, value))
+    return type(schema), tuple(config)
+
+
+def get_plan(schema=None, validators=None):
+    """
+    Returns the cached :class:`SchemaPlan` for `schema` and the names in
+    `validators`, creating it on first use. Instances of a schema class
+    built with the same settings share a plan, see :func:`schema_key`.
+    """
+    key = (schema_key(schema), tuple(validators or ()))
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = SchemaPlan(schema, validators)
+    return plan
+
+
+def set_plan_cache_size(maxsize):
+    """
+    Sets the number of plans kept by :func:`get_plan` (512 by default).
+    """
+    _plans.resize(maxsize)
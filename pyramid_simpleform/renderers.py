@@ -1,43 +1,108 @@
 import datetime
+import sys
+import warnings
+
 try:
-    from webhelpers2.html import tags
-    from webhelpers2.html.tags import Option, OptGroup
-    from webhelpers2.html.builder import HTML
-    OLD_WEBHELPERS = False
+    from html.parser import HTMLParser
 except ImportError:
-    OLD_WEBHELPERS = True
-    from webhelpers.html import tags
-    from webhelpers.html.tags import Option, OptGroup
-    from webhelpers.html.builder import HTML
+    from HTMLParser import HTMLParser
+
+from pyramid_simpleform.errors import as_error_store
+
+_webhelpers = {}
+
+
+def _load_webhelpers():
+    """
+    Imports WebHelpers2, or WebHelpers if it isn't installed, the first
+    time a widget is rendered.
+    """
+    if not _webhelpers:
+        try:
+            from webhelpers2.html import tags
+            from webhelpers2.html.tags import Option, OptGroup
+            from webhelpers2.html.builder import HTML
+            old_webhelpers = False
+        except ImportError:
+            old_webhelpers = True
+            from webhelpers.html import tags
+            from webhelpers.html.tags import Option, OptGroup
+            from webhelpers.html.builder import HTML
+        _webhelpers.update(tags=tags, Option=Option, OptGroup=OptGroup,
+                           HTML=HTML, OLD_WEBHELPERS=old_webhelpers)
+    return _webhelpers
+
+
+class _LazyWebHelper(object):
+    """
+    Stands in for a WebHelpers module or object until it is first used, then
+    replaces itself in this module with the real thing.
+    """
+
+    def __init__(self, name):
+        self._name = name
 
+    def __getattr__(self, attr):
+        obj = _load_webhelpers()[self._name]
+        globals()[self._name] = obj
+        return getattr(obj, attr)
+
+
+tags = _LazyWebHelper('tags')
+HTML = _LazyWebHelper('HTML')
+
+
+def __getattr__(name):
+    # Option, OptGroup and OLD_WEBHELPERS used to be imported eagerly
+    if name in ('Option', 'OptGroup', 'OLD_WEBHELPERS'):
+        return _load_webhelpers()[name]
+    raise AttributeError(name)
+
+
+if sys.version_info < (3, 7):
+    # modules only look up missing names with __getattr__ (PEP 562) from
+    # Python 3.7, so before that these are imported right away
+    globals().update((name, _load_webhelpers()[name])
+                     for name in ('Option', 'OptGroup', 'OLD_WEBHELPERS'))
 
 
 class Renderer(object):
 
+    #: add error classes and messages to the widgets themselves, as
+    #: htmlfill would
+    direct_fill = False
+    #: class added to widgets of fields with errors in direct-fill mode
+    error_class = 'error'
+    #: set of the names of the fields emitted, if they are recorded
+    emitted = None
+
     def __init__(self, data, errors, id_prefix=None):
         self.data = data
-        self.errors = errors
+        self.errors = as_error_store(errors)
         self.id_prefix = id_prefix
+        self._errors_shown = set()
 
     def get_sequence(self, name, min_entries=0):
 
         data = self.value(name, [])
-        errors = self.errors.get(name, {})
+        errors = self.errors.subtree(name)
 
-        return SequenceRenderer(name, data, errors, min_entries=min_entries)
+        return self._child(SequenceRenderer(name, data, errors,
+                                            min_entries=min_entries))
 
     def get_mapping(self, name):
 
         data = self.value(name, {})
-        errors = self.errors(name, [])
+        errors = self.errors.subtree(name)
 
-        return MappingRenderer(name, data, errors)
+        return self._child(MappingRenderer(name, data, errors))
 
     def text(self, name, value=None, id=None, **attrs):
         """
         Outputs text input.
         """
-        return tags.text(
+        errors = self._fill(name, attrs)
+        return errors + tags.text(
             name, 
             self.value(name, value), 
             self._get_id(id, name), 
@@ -52,7 +117,8 @@ class Renderer(object):
         if isinstance(value, datetime.date) and date_format:
             value = value.strftime(date_format)
 
-        return tags.text(
+        errors = self._fill(name, attrs)
+        return errors + tags.text(
             name,
             value,
             self._get_id(id, name),
@@ -63,7 +129,8 @@ class Renderer(object):
         """
         Outputs file input.
         """
-        return tags.file(
+        errors = self._fill(name, attrs)
+        return errors + tags.file(
             name, 
             self.value(name, value), 
             self._get_id(id, name), 
@@ -77,7 +144,8 @@ class Renderer(object):
         if value is None:
             value = self.value(name)
 
-        return tags.hidden(
+        errors = self._fill(name, attrs)
+        return errors + tags.hidden(
             name, 
             value, 
             self._get_id(id, name), 
@@ -89,13 +157,15 @@ class Renderer(object):
         Outputs radio input.
         """
         checked = self.value(name) == value or checked
-        return tags.radio(name, value, checked, label, **attrs)
+        errors = self._fill(name, attrs)
+        return errors + tags.radio(name, value, checked, label, **attrs)
 
     def submit(self, name, value=None, id=None, **attrs):
         """
         Outputs submit button.
         """
-        return tags.submit(
+        errors = self._fill(name, attrs)
+        return errors + tags.submit(
             name, 
             self.value(name, value), 
             self._get_id(id, name), 
@@ -106,6 +176,9 @@ class Renderer(object):
         """
         Outputs <select> element.
         """
+        webhelpers = _load_webhelpers()
+        Option = webhelpers['Option']
+        OptGroup = webhelpers['OptGroup']
 
         def parse_options(options):                                 # For compatibility with webhelpers1
             opts = []
@@ -125,12 +198,13 @@ class Renderer(object):
                 opts.append(opt)
             return opts
 
-        if OLD_WEBHELPERS:
+        if webhelpers['OLD_WEBHELPERS']:
             wh2_options = options
         else:
             wh2_options = parse_options(options)
 
-        return tags.select(
+        errors = self._fill(name, attrs)
+        return errors + tags.select(
             name,
             self.value(name, selected_value),
             wh2_options,
@@ -144,7 +218,8 @@ class Renderer(object):
         Outputs checkbox input.
         """
     
-        return tags.checkbox(
+        errors = self._fill(name, attrs)
+        return errors + tags.checkbox(
             name, 
             value, 
             self.value(name, checked), 
@@ -158,7 +233,8 @@ class Renderer(object):
         Outputs <textarea> element.
         """
 
-        return tags.textarea(
+        errors = self._fill(name, attrs)
+        return errors + tags.textarea(
             name, 
             self.value(name, content), 
             self._get_id(id, name), 
@@ -169,7 +245,8 @@ class Renderer(object):
         """
         Outputs a password input.
         """
-        return tags.password(
+        errors = self._fill(name, attrs)
+        return errors + tags.password(
             name, self.value(name, value), 
             self._get_id(id, name), 
             **attrs)
@@ -178,19 +255,19 @@ class Renderer(object):
         """
         Shortcut for **self.form.is_error(name)**
         """
-        return name in self.errors
+        return self.errors.is_error(name)
 
     def errors_for(self, name):
         """
         Shortcut for **self.form.errors_for(name)**
         """
-        return self.form.errors_for(name)
+        return self.errors.errors_for(name)
 
     def all_errors(self):
         """
         Shortcut for **self.form.all_errors()**
         """
-        return self.errors.values()
+        return self.errors.all_errors()
 
     def errorlist(self, name=None, **attrs):
         """
@@ -237,6 +314,37 @@ class Renderer(object):
     def value(self, name, default=None):
         return self.data.get(name, default)
 
+    def _fill(self, name, attrs):
+        """
+        Records that field `name` is emitted and, in direct-fill mode,
+        adds the error class to the widget `attrs` and returns the markup
+        of its errors, as htmlfill inserts it before the first widget of
+        the field.
+        """
+        if self.emitted is not None:
+            self.emitted.add(name)
+        if not self.direct_fill or not self.errors or \
+                not self.errors.is_error(name):
+            return HTML.literal('')
+
+        classes = attrs.get('class_')
+        attrs['class_'] = '%s %s' % (classes, self.error_class) \
+            if classes else self.error_class
+
+        if name in self._errors_shown:
+            return HTML.literal('')
+        self._errors_shown.add(name)
+        return (HTML.literal('<!-- for: %s -->\n' % name) +
+                HTML.tag('span', '\n'.join(self.errors_for(name)),
+                         class_='error-message') +
+                HTML.literal('<br />\n'))
+
+    def _child(self, renderer):
+        renderer.direct_fill = self.direct_fill
+        renderer.error_class = self.error_class
+        renderer.emitted = self.emitted
+        return renderer
+
     def _get_id(self, id, name):
         if id is None:
             id = name
@@ -250,12 +358,21 @@ class FormRenderer(Renderer):
     A simple form helper. Uses WebHelpers to render individual
     form widgets: see the WebHelpers library for more information
     on individual widgets.
+
+    The markup between **begin()** and **end()** is traced as a
+    ``renderer.form`` span with the form's tracer.
+
+    `direct_fill` : add error classes and messages to the widgets
+    themselves, so the markup doesn't need htmlfill. By default this is
+    done while the form is rendered with ``direct_fill`` turned on.
     """
 
-    def __init__(self, form, csrf_field='_csrf', id_prefix=None):
+    def __init__(self, form, csrf_field='_csrf', id_prefix=None,
+                 direct_fill=None):
 
         self.form = form
         self.csrf_field = csrf_field
+        self._span = None
 
         super(FormRenderer, self).__init__(
             self.form.data, 
@@ -263,6 +380,13 @@ class FormRenderer(Renderer):
             id_prefix,
         )
 
+        emitted = getattr(form, '_direct_fill_fields', None)
+        if direct_fill is None:
+            direct_fill = emitted is not None or \
+                getattr(form, 'direct_fill', False)
+        self.direct_fill = direct_fill
+        self.emitted = emitted
+
 
     def begin(self, url=None, **attrs):
         """
@@ -270,6 +394,9 @@ class FormRenderer(Renderer):
 
         By default URL will be current path.
         """
+        tracer = getattr(self.form, 'tracer', None)
+        if tracer is not None:
+            self._span = tracer.start_span('renderer.form')
         url = url or self.form.request.path
         multipart = attrs.pop('multipart', self.form.multipart)
         return tags.form(url, multipart=multipart, **attrs)
@@ -278,6 +405,9 @@ class FormRenderer(Renderer):
         """
         Closes the form, i.e. outputs </form>.
         """
+        if self._span is not None:
+            self._span.end()
+            self._span = None
         return tags.end_form()
     
     def csrf(self, name=None):
@@ -314,6 +444,25 @@ class FormRenderer(Renderer):
                         tags.literal("".join(inputs)), 
                         style="display:none;")
 
+    def fragment(self, name, widget='text', *args, **attrs):
+        """
+        Renders just field `name`: its **errorlist()** followed by the
+        `widget` method called with `args` and `attrs`, e.g. to replace
+        the field in the page after an inline check with
+        :meth:`pyramid_simpleform.Form.validate_field`::
+
+            form = Form(request, SignupSchema)
+            form.validate_field(request.params['field'])
+            return Response(FormRenderer(form).fragment('email'))
+
+        In direct-fill mode the widget shows the errors itself, as it
+        would in the whole form, and no errorlist is added.
+        """
+        html = getattr(self, widget)(name, *args, **attrs)
+        if self.direct_fill:
+            return html
+        return tags.literal(self.errorlist(name)) + html
+
 
 class SequenceRenderer(Renderer):
 
@@ -323,7 +472,7 @@ class SequenceRenderer(Renderer):
         
         num_entries = min_entries - len(data)
         if num_entries > 0:
-            for i in xrange(num_entries):
+            for i in range(num_entries):
                 data.append({})
 
         super(SequenceRenderer, self).__init__(
@@ -344,13 +493,16 @@ class SequenceRenderer(Renderer):
     
         for i, d in enumerate(self.data):
 
+            errors = self.errors.subtree(str(i))
+
             if not isinstance(d, dict):
                 d = {self.name : d}
+                errors = {self.name : errors.errors_for('')}
 
-            errors = [] # to be determined
             id_prefix = "%d-" % i
 
-            yield MappingRenderer(self.name, d, errors, id_prefix=id_prefix) 
+            yield self._child(MappingRenderer(self.name, d, errors,
+                                              id_prefix=id_prefix))
 
 
 class MappingRenderer(Renderer):
@@ -378,3 +530,52 @@ class MappingRenderer(Renderer):
         return self.hidden('__end__', value='%s:mapping' % name, id='')
 
 
+class DirectFillWarning(UserWarning):
+    """
+    Warns about markup that isn't filled when htmlfill is skipped.
+    """
+
+
+class _FieldCollector(HTMLParser):
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.fields = []
+        self.form_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('input', 'select', 'textarea'):
+            name = dict(attrs).get('name')
+            if name:
+                self.fields.append(name)
+        elif tag.startswith('form:'):
+            self.form_tags.append(tag)
+
+    handle_startendtag = handle_starttag
+
+
+def check_direct_fill(html, emitted):
+    """
+    Checks markup rendered without htmlfill for fields whose names aren't
+    in the set of `emitted` names, i.e. which weren't output by a
+    renderer and so aren't filled in, and for htmlfill ``form:`` tags,
+    which are left as they are. Each problem found is reported with a
+    :class:`DirectFillWarning` and the list of them is returned.
+
+    Parsing the markup is slow, so this is meant for development.
+    """
+    collector = _FieldCollector()
+    collector.feed(html)
+    collector.close()
+
+    problems = []
+    for name in collector.fields:
+        if name not in emitted and name not in problems:
+            problems.append(name)
+    messages = ['field %r was not emitted by a renderer, so it is not '
+                'filled' % name for name in problems]
+    for tag in sorted(set(collector.form_tags)):
+        messages.append('<%s> tags are only handled by htmlfill' % tag)
+    for message in messages:
+        warnings.warn(message, DirectFillWarning, stacklevel=3)
+    return messages
@@ -0,0 +1,4 @@
+<form method="POST" action=".">
+    ${renderer.text('name', size=20)}
+    ${renderer.select('color', [('red', 'Red'), ('blue', 'Blue')])}
+</form>
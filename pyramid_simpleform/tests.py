@@ -25,6 +25,25 @@ class SimpleObj(object):
         self.name = name
 
 
+try:
+    import tracemalloc
+    _has_tracemalloc = True
+except ImportError:
+    # Python 2
+    _has_tracemalloc = False
+
+
+def _make_form(schema=SimpleFESchema, post=None, form_class=None, **kw):
+    """
+    Returns a form of `form_class`, **Form** by default, for a dummy
+    request posting `post`, or a GET request if it's **None**.
+    """
+    from pyramid_simpleform import Form
+
+    request = testing.DummyRequest(post=post)
+    return (form_class or Form)(request, schema, **kw)
+
+
 class TestState(unittest.TestCase):
 
     def test_state(self):
@@ -1010,3 +1029,2822 @@ class TestFormencodeFormRenderer(unittest.TestCase):
         self.assertTrue(renderer.label("name", "Your name") == \
                    '<label for="name">Your name</label>') 
 
+
+class TestDirectFill(unittest.TestCase):
+
+    def _make_form(self, post=None, **kw):
+        form = _make_form(SimpleFESchema, post or {'name': ''}, **kw)
+        form.validate()
+        return form
+
+    def test_same_as_htmlfill(self):
+        from pyramid_simpleform.renderers import FormRenderer
+
+        form = self._make_form()
+        direct = FormRenderer(form, direct_fill=True)
+        filled = form.htmlfill(FormRenderer(form).text('name', class_='x'))
+        self.assertEqual(direct.text('name', class_='x'), filled)
+        self.assertTrue('class="x error"' in filled)
+        self.assertTrue('<span class="error-message">Please enter a value'
+                        '</span>' in filled)
+
+    def test_no_errors(self):
+        from pyramid_simpleform.renderers import FormRenderer
+
+        form = self._make_form({'name': 'Jane'})
+        renderer = FormRenderer(form, direct_fill=True)
+        self.assertEqual(renderer.text('name'),
+                         FormRenderer(form).text('name'))
+
+    def test_errors_shown_once(self):
+        from pyramid_simpleform.renderers import FormRenderer
+
+        form = self._make_form()
+        renderer = FormRenderer(form, direct_fill=True)
+        html = renderer.radio('name', 'a') + renderer.radio('name', 'b')
+        self.assertEqual(html.count('error-message'), 1)
+        self.assertEqual(html.count('class="error"'), 2)
+
+    def test_sequence(self):
+        from pyramid_simpleform.renderers import FormRenderer
+
+        form = self._make_form({'name': 'x'}, variable_decode=True)
+        form.errors['rows'] = [{'email': 'Bad email'}]
+        form.data['rows'] = [{'email': 'jane'}]
+        renderer = FormRenderer(form, direct_fill=True)
+        row, = renderer.get_sequence('rows')
+        self.assertTrue(row.direct_fill)
+        self.assertTrue('Bad email' in row.text('email'))
+
+    def test_render(self):
+        settings = {'mako.directories': 'pyramid_simpleform:templates'}
+        config = testing.setUp(settings=settings)
+        config.include('pyramid_mako')
+        try:
+            form = self._make_form()
+            result = form.render('test_direct_form.mako', direct_fill=True)
+        finally:
+            testing.tearDown()
+
+        self.assertTrue('Please enter a value' in result)
+        self.assertTrue('class="error"' in result)
+        self.assertEqual(form._direct_fill_fields, None)
+
+    def test_check(self):
+        import warnings
+        from pyramid_simpleform.renderers import DirectFillWarning
+
+        config = testing.setUp(settings={
+            'simpleform.check_direct_fill': 'true'})
+        try:
+            config.testing_add_renderer('form.mako').string_response = \
+                '<form><input name="name"><form:error name="name"></form>'
+            form = self._make_form()
+            form.direct_fill = True
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                form.render('form.mako')
+        finally:
+            testing.tearDown()
+
+        messages = [str(w.message) for w in caught
+                    if w.category is DirectFillWarning]
+        self.assertEqual(len(messages), 2)
+        self.assertTrue("'name'" in messages[0])
+        self.assertTrue('form:error' in messages[1])
+
+    def test_check_emitted(self):
+        from pyramid_simpleform.renderers import FormRenderer
+        from pyramid_simpleform.renderers import check_direct_fill
+
+        form = self._make_form()
+        form._direct_fill_fields = set()
+        html = FormRenderer(form).text('name')
+        self.assertEqual(check_direct_fill(html, form._direct_fill_fields),
+                         [])
+
+
+class TestSkipHtmlfill(unittest.TestCase):
+
+    def test_nothing_to_fill(self):
+        html = """
+        <form method="POST" action=".">
+            <input type='text' name=name>
+            <input type="checkbox" name="a" value="1">
+            <input type="submit" name="go" value="Go">
+            <select name="b"><option value="1">One</option></select>
+            <textarea name="c"></textarea>
+        </form>
+        """
+        self.assertIs(_make_form().htmlfill(html), html)
+
+    def test_values_cleared(self):
+        from formencode import htmlfill
+
+        form = _make_form()
+        for html in ['<input type="text" name="a" value="x">',
+                     '<input type="hidden" name="a" value="x" />',
+                     '<input type="checkbox" name="a" value="1" checked>',
+                     '<input type="radio" name="a" value="1" checked>',
+                     '<select name="a"><option value="1" selected>'
+                     '</option></select>',
+                     '<textarea name="a">x</textarea>',
+                     '<input type="unknown" name="a">']:
+            try:
+                expected = htmlfill.render(html)
+            except AssertionError:
+                self.assertRaises(AssertionError, form.htmlfill, html)
+            else:
+                self.assertNotEqual(expected, html)
+                self.assertEqual(form.htmlfill(html), expected)
+
+    def test_force_defaults(self):
+        form = _make_form()
+        html = '<input type="text" name="a" value="x">'
+        self.assertIs(form.htmlfill(html, force_defaults=False), html)
+        html = '<input type="checkbox" name="a" checked>'
+        self.assertEqual(form.htmlfill(html, force_defaults=False),
+                         '<input type="checkbox" name="a">')
+
+    def test_form_tags(self):
+        form = _make_form()
+        html = '<form:iferror name="a">x</form:iferror>'
+        self.assertEqual(form.htmlfill(html), '')
+        html = '<input type="text" name="a" form:required="yes">'
+        self.assertEqual(form.htmlfill(html),
+                         '<input type="text" name="a" value="">')
+        self.assertIs(form.htmlfill(html, normalize=()), html)
+
+    def test_normalize(self):
+        html = '<input type="text" name="a">'
+        form = _make_form()
+        self.assertEqual(form.htmlfill(html, normalize=('markup',)),
+                         '<input type="text" name="a" value="">')
+        form.htmlfill_normalize = ('defaults', 'form_tags', 'markup')
+        self.assertNotEqual(form.htmlfill(html), html)
+        self.assertRaises(ValueError, form.htmlfill, html,
+                          normalize=('everything',))
+
+    def test_unterminated_tags(self):
+        import time
+        from pyramid_simpleform.filling import _changes_defaults
+
+        for html in ['<input type="text" name="a" ' + 'x' * 5000,
+                     '<input ' + 'a b ' * 2000 + '"unterminated',
+                     '<option ' + "x='y' " * 2000]:
+            start = time.time()
+            self.assertFalse(_changes_defaults(html, True, False, True))
+            self.assertTrue(time.time() - start < 1)
+
+    def test_data_and_errors(self):
+        html = '<input type="text" name="name">'
+        form = _make_form(defaults={'name': 'x'})
+        self.assertTrue('value="x"' in form.htmlfill(html))
+
+        form = _make_form()
+        form.errors = {'name': 'Missing'}
+        self.assertTrue('Missing' in form.htmlfill(html))
+
+    def test_render(self):
+        from pyramid_simpleform import Form
+
+        settings = {'mako.directories': 'pyramid_simpleform:templates'}
+        config = testing.setUp(settings=settings)
+        config.include('pyramid_mako')
+        request = testing.DummyRequest()
+        request.registry = config.registry
+
+        form = Form(request, SimpleFESchema)
+        self.assertEqual(form.render("test_form.mako"),
+                         form.render("test_form.mako", htmlfill=False))
+        form.htmlfill_normalize += ('markup',)
+        self.assertTrue('value=""' in form.render("test_form.mako"))
+
+
+class TestValidateField(unittest.TestCase):
+
+    def _make_form(self, post, schema=None, **kw):
+
+        class SignupSchema(Schema):
+            allow_extra_fields = True
+            name = validators.String(not_empty=True)
+            age = validators.Int(min=18)
+            password = validators.String(min=3)
+            confirm = validators.String()
+            chained_validators = [
+                validators.FieldsMatch('password', 'confirm')]
+
+        return _make_form(schema or SignupSchema, post, **kw)
+
+    def test_valid(self):
+        form = self._make_form({'name': 'Jane', 'age': '20'})
+        self.assertTrue(form.validate_field('age'))
+        self.assertEqual(form.data['age'], 20)
+        self.assertEqual(form.errors, {})
+        self.assertFalse(form.is_validated)
+
+    def test_invalid(self):
+        form = self._make_form({'name': '', 'age': 'x'})
+        self.assertFalse(form.validate_field('age'))
+        self.assertEqual(form.errors_for('age'),
+                         ['Please enter an integer value'])
+        self.assertFalse(form.is_error('name'))
+
+    def test_several_fields(self):
+        form = self._make_form({'name': '', 'age': 'x'})
+        self.assertFalse(form.validate_field('age'))
+        self.assertFalse(form.validate_field('name'))
+        self.assertEqual(sorted(form.errors), ['age', 'name'])
+
+        form.request.POST['age'] = '30'
+        self.assertTrue(form.validate_field('age'))
+        self.assertEqual(sorted(form.errors), ['name'])
+
+    def test_chained(self):
+        form = self._make_form({'password': 'secret', 'confirm': 'other'})
+        self.assertFalse(form.validate_field('confirm'))
+        self.assertTrue(form.is_error('confirm'))
+
+        form = self._make_form({'password': 'secret', 'confirm': 'secret'})
+        self.assertTrue(form.validate_field('password'))
+        self.assertEqual(form.data['confirm'], 'secret')
+
+    def test_same_as_validate(self):
+        post = {'name': 'Jane', 'age': '12', 'password': 'ab',
+                'confirm': 'cd'}
+        whole = self._make_form(post)
+        whole.validate()
+        for name in ('name', 'age', 'password'):
+            form = self._make_form(post)
+            form.validate_field(name)
+            self.assertEqual(form.errors_for(name), whole.errors_for(name))
+
+    def test_validators(self):
+        from formencode import validators
+
+        form = self._make_form({'name': 'x'}, schema=None, validators={
+            'name': validators.String(min=3)})
+        self.assertFalse(form.validate_field('name'))
+        self.assertEqual(list(form.errors), ['name'])
+
+    def test_nested(self):
+        from formencode import ForEach, Schema, validators
+
+        class RowSchema(Schema):
+            quantity = validators.Int(min=1)
+
+        class OrderSchema(Schema):
+            title = validators.String(not_empty=True)
+            rows = ForEach(RowSchema())
+
+        post = {'title': 'Order', 'rows-0.quantity': '2',
+                'rows-1.quantity': 'x'}
+        form = self._make_form(post, schema=OrderSchema,
+                               variable_decode=True)
+        self.assertTrue(form.validate_field('rows-0.quantity'))
+        self.assertFalse(form.validate_field('rows-1.quantity'))
+        self.assertEqual(list(form.errors), ['rows-1.quantity'])
+
+    def test_unknown_field(self):
+        from pyramid_simpleform import UnknownField
+
+        form = self._make_form({})
+        self.assertRaises(UnknownField, form.validate_field, 'nope')
+        self.assertRaises(ValueError, form.validate_field, 'nope')
+        self.assertRaises(UnknownField, form.validate_field, None)
+        form = self._make_form({}, variable_decode=True)
+        self.assertRaises(UnknownField, form.validate_field, 'nope-0.x')
+        self.assertRaises(UnknownField, form.validate_field, None)
+
+    def test_flat_names_not_prefixes(self):
+        form = self._make_form({'name': '', 'age': 'x'})
+        form.errors['name.first'] = u'Other field'
+        self.assertFalse(form.validate_field('name'))
+        self.assertEqual(form.errors['name.first'], u'Other field')
+
+    def test_fragment(self):
+        from pyramid_simpleform.renderers import FormRenderer
+
+        form = self._make_form({'age': 'x'})
+        form.validate_field('age')
+        renderer = FormRenderer(form)
+        html = renderer.fragment('age', size=3)
+        self.assertEqual(html, renderer.errorlist('age') +
+                         renderer.text('age', size=3))
+        self.assertTrue('<ul class="error">' in html)
+
+        renderer = FormRenderer(form, direct_fill=True)
+        html = renderer.fragment('age')
+        self.assertTrue('error-message' in html)
+        self.assertFalse('<ul' in html)
+
+        html = renderer.fragment('name', 'select', [('a', 'A')])
+        self.assertTrue(html.startswith('<select'))
+
+
+class TestFormState(unittest.TestCase):
+
+    def _make_form(self, post=None, **kw):
+
+        class WizardSchema(Schema):
+            allow_extra_fields = True
+            name = validators.String(not_empty=True)
+            age = validators.Int()
+            country = validators.String()
+            born = validators.DateConverter()
+
+        return _make_form(WizardSchema, post, **kw)
+
+    def test_round_trip(self):
+        import datetime
+        import decimal
+
+        values = [None, True, False, 0, 127, 128, -1, 2 ** 70, 1.5, u'',
+                  u'short', u'\xfcn\xefcode' * 10, b'\x00\xff', [1, [2]],
+                  (1, u'a'), {u'a': {1: None}}, set([1, 2]),
+                  frozenset([u'x']), datetime.date(2020, 2, 29),
+                  datetime.datetime(2020, 2, 29, 12, 30, 1, 5),
+                  datetime.time(23, 59), decimal.Decimal('1.10')]
+        form = self._make_form()
+        form.data = {'name': values, 'other': u'x'}
+        restored = self._make_form()
+        restored.load_state(form.dump_state())
+        self.assertEqual(restored.data, form.data)
+        for before, after in zip(values, restored.data['name']):
+            self.assertEqual(type(before), type(after))
+
+    def test_time_zones(self):
+        import datetime
+
+        class Offset(datetime.tzinfo):
+            # datetime.timezone is Python 3 only
+            def __init__(self, minutes):
+                self.offset = datetime.timedelta(minutes=minutes)
+
+            def utcoffset(self, dt):
+                return self.offset
+
+            def dst(self, dt):
+                return None
+
+        values = [datetime.datetime(2020, 2, 29, 12, 30, tzinfo=Offset(-330)),
+                  datetime.time(23, 59, 0, 1, tzinfo=Offset(0))]
+        form = self._make_form()
+        form.data = {'name': values, 'other': u'x'}
+        restored = self._make_form()
+        restored.load_state(form.dump_state())
+        self.assertEqual(restored.data['name'], values)
+        for value in restored.data['name']:
+            self.assertEqual(value.utcoffset(), value.tzinfo.utcoffset(None))
+        self.assertEqual(restored.data['name'][1].utcoffset(),
+                         datetime.timedelta(0))
+
+    def test_defaults(self):
+        defaults = {'name': u'Jane', 'country': u'NZ', 'age': 1}
+        form = self._make_form(defaults=defaults)
+        unchanged = form.dump_state()
+        form.data['name'] = u'Jane Doe'
+        form.data['age'] = True
+        del form.data['country']
+        state = form.dump_state()
+        self.assertTrue(len(unchanged) < len(state))
+
+        restored = self._make_form(defaults=defaults)
+        restored.load_state(state)
+        self.assertEqual(restored.data, {'name': u'Jane Doe', 'age': True})
+
+    def test_errors(self):
+        form = self._make_form({'name': '', 'age': 'x'})
+        self.assertFalse(form.validate())
+        restored = self._make_form({'name': 'Jane', 'age': '3'})
+        restored.load_state(form.dump_state())
+        self.assertTrue(restored.is_validated)
+        self.assertFalse(restored.validate())
+        self.assertEqual(restored.errors, form.errors)
+        self.assertEqual(restored.error_codes(), form.error_codes())
+
+        restored = self._make_form()
+        restored.load_state(form.dump_state(errors=False))
+        self.assertEqual(restored.errors, {})
+
+    def test_compress(self):
+        form = self._make_form()
+        form.data = {'name': u'Lorem ipsum ' * 50}
+        compressed = form.dump_state()
+        self.assertTrue(len(compressed) < 100)
+        self.assertEqual(compressed, form.dump_state(compress=True))
+        plain = form.dump_state(compress=False)
+        self.assertTrue(len(plain) > 600)
+        for state in (compressed, plain):
+            restored = self._make_form()
+            restored.load_state(state)
+            self.assertEqual(restored.data, form.data)
+
+    def test_invalid(self):
+        from pyramid_simpleform.formstate import StateError
+
+        form = self._make_form()
+        form.data = {'name': u'Jane'}
+        state = form.dump_state()
+
+        other = _make_form()
+        self.assertRaises(StateError, other.load_state, state)
+        for corrupt in (state[:3], state[:-1], state + b'\x00',
+                        b'\x09' + state[1:], state[:6] + b'\x13'):
+            self.assertRaises(StateError, form.load_state, corrupt)
+
+        form.data = {'name': object()}
+        self.assertRaises(TypeError, form.dump_state)
+
+
+class TestSchemaPlan(unittest.TestCase):
+
+    def _make_model(self):
+        from sqlalchemy import Column, ForeignKey, Integer, String
+        from sqlalchemy.orm import deferred, relationship
+        try:
+            from sqlalchemy.orm import declarative_base
+        except ImportError:
+            # SQLAlchemy < 1.4
+            from sqlalchemy.ext.declarative import declarative_base
+
+        Base = declarative_base()
+
+        class Group(Base):
+            __tablename__ = 'groups'
+            id = Column(Integer, primary_key=True)
+            title = Column(String)
+
+        class User(Base):
+            __tablename__ = 'users'
+            id = Column(Integer, primary_key=True)
+            name = Column(String)
+            bio = deferred(Column(String))
+            notes = Column(String)
+            group_id = Column(Integer, ForeignKey('groups.id'))
+            group = relationship(Group)
+
+        return Base, User, Group
+
+    def test_fields(self):
+        from pyramid_simpleform.plans import SchemaPlan
+
+        plan = SchemaPlan(SimpleFESchema, {'extra': validators.String()})
+        self.assertEqual(sorted(plan.fields), ['extra', 'name', 'names'])
+
+    def test_get_plan_is_cached(self):
+        from pyramid_simpleform.plans import get_plan
+
+        self.assertTrue(get_plan(SimpleFESchema) is get_plan(SimpleFESchema))
+        self.assertTrue(get_plan(SimpleFESchema) is not
+                        get_plan(SimpleFESchema, {'extra': None}))
+
+    def test_instances_share_plan(self):
+        from pyramid_simpleform.plans import get_plan
+
+        plan = get_plan(SimpleFESchema())
+        self.assertTrue(get_plan(SimpleFESchema()) is plan)
+        self.assertTrue(get_plan(SimpleFESchema()).compiled is plan.compiled)
+        self.assertTrue(plan.compiled is not None)
+        self.assertTrue(get_plan(SimpleFESchema(allow_extra_fields=True))
+                        is not plan)
+        self.assertTrue(get_plan(SimpleFESchema) is not plan)
+
+    def test_instance_fields(self):
+        from pyramid_simpleform.plans import get_plan
+
+        schema = SimpleFESchema()
+        other = SimpleFESchema()
+        other.add_field('extra', validators.Int())
+        self.assertTrue(get_plan(other) is not get_plan(schema))
+        self.assertTrue('extra' in get_plan(other).fields)
+
+    def test_getter(self):
+        from pyramid_simpleform.plans import get_plan
+
+        class WithProperty(SimpleObj):
+            @property
+            def names(self):
+                return ['a', 'b']
+
+        getter = get_plan(SimpleFESchema).getter(WithProperty)
+        self.assertTrue(getter is get_plan(SimpleFESchema).getter(WithProperty))
+        self.assertEqual(getter(WithProperty(name='test')),
+                         {'name': 'test', 'names': ['a', 'b']})
+
+    def test_getter_skips_missing_attributes(self):
+        from pyramid_simpleform.plans import get_plan
+
+        class Broken(object):
+            @property
+            def name(self):
+                raise AttributeError('name')
+
+        getter = get_plan(SimpleFESchema).getter(Broken)
+        self.assertEqual(getter(Broken()), {})
+
+    def test_loader_options(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import Session
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.plans import get_plan
+
+        Base, User, Group = self._make_model()
+
+        class UserSchema(Schema):
+            name = validators.String()
+            bio = validators.String()
+            group = validators.Constant(None)
+
+        plan = get_plan(UserSchema)
+        self.assertEqual(sorted(plan.load_only(User)), ['bio', 'name'])
+        self.assertEqual(plan.relationships(User), ('group',))
+
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        queries = []
+
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', 
+                     lambda *args: queries.append(args[2]))
+
+        session = Session(engine)
+        session.add(User(id=1, name='fred', bio='bio', notes='notes',
+                         group=Group(id=1, title='admins')))
+        session.commit()
+        session.expunge_all()
+        del queries[:]
+
+        user = session.query(User).options(
+            *plan.loader_options(User)).filter_by(id=1).one()
+        form = Form(testing.DummyRequest(), UserSchema, obj=user)
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(form.data['name'], 'fred')
+        self.assertEqual(form.data['bio'], 'bio')
+        self.assertEqual(form.data['group'].title, 'admins')
+        self.assertTrue('notes' not in queries[0])
+
+
+class TestErrorStore(unittest.TestCase):
+
+    def _make_store(self):
+        from pyramid_simpleform.errors import ErrorStore
+        return ErrorStore({
+            'name': 'Missing value',
+            'tags': ['Too short', 'Too common'],
+            'people-0.email': 'Invalid email',
+            'people-1.email': 'Missing value',
+            'people-1.name': 'Missing value',
+            'address': {'street': 'Missing value',
+                        'lines': [None, 'Too long']},
+        }, nested=True)
+
+    def test_errors_for(self):
+        store = self._make_store()
+        self.assertEqual(store.errors_for('name'), ['Missing value'])
+        self.assertEqual(store.errors_for('tags'), ['Too short', 'Too common'])
+        self.assertEqual(store.errors_for('people-0.email'), ['Invalid email'])
+        self.assertEqual(store.errors_for('address.lines-1'), ['Too long'])
+        self.assertEqual(store.errors_for('missing'), [])
+
+    def test_errors_for_subtree(self):
+        store = self._make_store()
+        self.assertEqual(len(store.errors_for('people')), 3)
+        self.assertEqual(len(store.errors_for('people-1')), 2)
+        self.assertEqual(len(store.errors_for('address')), 2)
+
+    def test_is_error(self):
+        store = self._make_store()
+        self.assertTrue(store.is_error('people'))
+        self.assertTrue(store.is_error('address.street'))
+        self.assertFalse(store.is_error('address.lines-0'))
+        self.assertFalse(store.is_error('peop'))
+
+    def test_all_errors(self):
+        store = self._make_store()
+        self.assertEqual(len(store.all_errors()), 8)
+        self.assertTrue(store.all_errors() is not store.all_errors())
+
+    def test_index_reset_on_change(self):
+        store = self._make_store()
+        self.assertFalse(store.is_error('other'))
+        store['other'] = 'Bad'
+        self.assertTrue(store.is_error('other'))
+        del store['other']
+        self.assertFalse(store.is_error('other'))
+        store.update({'more': 'Bad'})
+        self.assertEqual(store.errors_for('more'), ['Bad'])
+
+    def test_subtree(self):
+        store = self._make_store()
+        people = store.subtree('people')
+        self.assertTrue(people is store.subtree('people'))
+        self.assertEqual(sorted(people.keys()), 
+                         ['0.email', '1.email', '1.name'])
+        row = people.subtree('1')
+        self.assertEqual(row.errors_for('name'), ['Missing value'])
+        self.assertEqual(store.subtree('name').errors_for(''),
+                         ['Missing value'])
+
+    def test_not_nested(self):
+        from pyramid_simpleform.errors import ErrorStore
+
+        store = ErrorStore({'first-name': 'Missing value',
+                            'last.name': 'Missing value',
+                            'address': {'street-1': 'Missing value'}})
+        self.assertFalse(store.is_error('first'))
+        self.assertEqual(store.errors_for('first'), [])
+        self.assertFalse(store.is_error('last'))
+        self.assertTrue(store.is_error('first-name'))
+        self.assertTrue(store.is_error('address'))
+        self.assertFalse(store.is_error('address.street'))
+
+        address = store.subtree('address')
+        self.assertEqual(address.errors_for('street-1'), ['Missing value'])
+        self.assertFalse(address.is_error('street'))
+
+    def test_form_errors_without_variable_decode(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.renderers import FormRenderer
+
+        class NameSchema(Schema):
+            first = validators.String()
+            last = validators.String()
+
+        request = testing.DummyRequest(post={'first-name': '',
+                                             'last.name': ''})
+        form = Form(request, NameSchema, validators={
+            'first-name': validators.NotEmpty(),
+            'last.name': validators.NotEmpty()})
+        self.assertFalse(form.validate())
+        for errors in (form, FormRenderer(form)):
+            self.assertFalse(errors.is_error('first'))
+            self.assertEqual(errors.errors_for('first'), [])
+            self.assertFalse(errors.is_error('last'))
+            self.assertEqual(errors.errors_for('last.name'),
+                             ['Please enter a value'])
+            self.assertTrue(errors.is_error('first-name'))
+
+    def test_as_error_store(self):
+        from pyramid_simpleform.errors import ErrorStore, as_error_store
+
+        store = ErrorStore()
+        self.assertTrue(as_error_store(store) is store)
+        self.assertEqual(as_error_store('Bad').all_errors(), ['Bad'])
+        self.assertEqual(as_error_store(['Bad']).all_errors(), ['Bad'])
+        self.assertEqual(as_error_store({'a': 'Bad'}).errors_for('a'), ['Bad'])
+
+    def test_form_errors_with_variable_decode(self):
+        from pyramid_simpleform import Form
+
+        class PersonSchema(Schema):
+            email = validators.Email(not_empty=True)
+
+        class PeopleSchema(Schema):
+            people = formencode.ForEach(PersonSchema())
+
+        request = testing.DummyRequest()
+        request.method = "POST"
+        request.POST['people-0.email'] = 'fred@example.com'
+        request.POST['people-1.email'] = 'fred'
+
+        form = Form(request, PeopleSchema, variable_decode=True)
+        self.assertFalse(form.validate())
+        self.assertTrue(form.is_error('people'))
+        self.assertTrue(form.is_error('people-1.email'))
+        self.assertFalse(form.is_error('people-0.email'))
+        self.assertEqual(len(form.errors_for('people')), 1)
+        self.assertEqual(len(form.all_errors()), 1)
+
+    def test_sequence_renderer_errors(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.renderers import FormRenderer
+
+        request = testing.DummyRequest()
+        form = Form(request, SimpleFESchema, variable_decode=True,
+                    defaults={'names': ['a', ''], 
+                              'people': [{'email': 'x'}, {'email': 'y'}]})
+        form.errors['names-1'] = 'Missing value'
+        form.errors['people-0.email'] = 'Invalid email'
+
+        rows = list(FormRenderer(form).get_sequence('names'))
+        self.assertFalse(rows[0].is_error('names'))
+        self.assertEqual(rows[1].errors_for('names'), ['Missing value'])
+
+        rows = list(FormRenderer(form).get_sequence('people'))
+        self.assertEqual(rows[0].errors_for('email'), ['Invalid email'])
+        self.assertFalse(rows[1].is_error('email'))
+
+    def test_mapping_renderer_errors(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.renderers import FormRenderer
+
+        request = testing.DummyRequest()
+        form = Form(request, SimpleFESchema, variable_decode=True,
+                    defaults={'address': {'street': ''}})
+        form.errors['address.street'] = 'Missing value'
+
+        mapping = FormRenderer(form).get_mapping('address')
+        self.assertTrue(mapping.is_error('street'))
+        self.assertEqual(mapping.errorlist(),
+                         '<ul class="error"><li>Missing value</li></ul>')
+
+
+class TestLazyErrors(unittest.TestCase):
+
+    def _make_form(self, **kw):
+
+        class LimitsSchema(Schema):
+            allow_extra_fields = True
+            name = validators.NotEmpty()
+            title = validators.String(max=3)
+            age = validators.Int()
+
+        return _make_form(LimitsSchema, {'title': 'too long', 'age': 'x'},
+                          **kw)
+
+    def test_errors_unpacked_on_access(self):
+        form = self._make_form()
+        self.assertFalse(form.validate())
+        self.assertTrue(form._invalid is not None)
+        self.assertTrue(form.is_error('name'))
+        self.assertTrue(form._invalid is None)
+        self.assertEqual(len(form.all_errors()), 3)
+
+    def test_error_count_and_first_error(self):
+        form = self._make_form()
+        form.validate()
+        self.assertEqual(form.error_count(), 3)
+        self.assertTrue(form.first_error() in form.all_errors())
+        self.assertTrue(form._invalid is None)
+        self.assertEqual(form.error_count(), 3)
+
+    def test_validators_errors_stay_packed(self):
+        form = self._make_form(validators={'email': validators.Email(),
+                                           'age': validators.NotEmpty()})
+        form.request.POST.update(email='fred', age='')
+        self.assertFalse(form.validate())
+        self.assertTrue(form._invalid is not None)
+        self.assertEqual(form.error_count(), 4)
+        self.assertTrue(form._invalid is not None)
+        self.assertEqual(form.errors_for('email'),
+                         ['An email address must contain a single @'])
+        self.assertEqual(form.errors_for('age'), ['Please enter a value'])
+        self.assertTrue(form.is_error('name'))
+        self.assertEqual(form.error_count(), 4)
+
+    def test_error_count_without_errors(self):
+        form = self._make_form()
+        self.assertEqual(form.error_count(), 0)
+        self.assertTrue(form.first_error() is None)
+
+    def test_error_codes(self):
+        form = self._make_form(validators={'email': validators.Email()})
+        form.request.POST['email'] = 'fred'
+        form.validate()
+        self.assertEqual(form.error_codes(), {
+            'name': ['missingValue'],
+            'title': ['tooLong'],
+            'age': ['integer'],
+            'email': ['noAt'],
+        })
+
+    def test_error_codes_with_custom_localizer(self):
+        from pyramid_simpleform import State
+
+        form = self._make_form(state=State(_=lambda s: '! ' + s))
+        form.validate()
+        self.assertEqual(form.errors_for('name'), ['! Missing value'])
+        self.assertEqual(form.error_codes()['name'], [None])
+
+    def test_localizer_only_used_for_errors(self):
+        from pyramid.i18n import Localizer
+
+        calls = []
+
+        class CountingLocalizer(Localizer):
+            def translate(self, *args, **kw):
+                calls.append(args)
+                return Localizer.translate(self, *args, **kw)
+
+        form = self._make_form()
+        form.request.POST.update(name='fred', title='ok', age='1')
+        form.request.localizer = CountingLocalizer('en', None)
+        self.assertTrue(form.validate())
+        self.assertEqual(calls, [])
+
+    def test_translations_are_memoized(self):
+        from pyramid_simpleform import get_default_translate_fn
+        from pyramid_simpleform.errors import ErrorMessage
+
+        translate = get_default_translate_fn(testing.DummyRequest())
+        message = translate('Missing %(name)s')
+        self.assertTrue(translate('Missing %(name)s') is message)
+        self.assertTrue(isinstance(message % {'name': 'x'}, ErrorMessage))
+        self.assertEqual((message % {'name': 'x'}).template, 
+                         'Missing %(name)s')
+
+    def test_assign_errors(self):
+        form = self._make_form()
+        form.validate()
+        form.errors = {'other': 'Bad'}
+        self.assertEqual(form.all_errors(), ['Bad'])
+
+
+class TestErrorBudget(unittest.TestCase):
+
+    def _make_form(self, calls, post=None, **kw):
+
+        class Counted(validators.Int):
+            def _convert_to_python(self, value, state):
+                calls.append(value)
+                return validators.Int._convert_to_python(self, value, state)
+
+        class IntSchema(Schema):
+            a = Counted()
+            b = Counted()
+            c = Counted()
+
+        if post is None:
+            post = {'a': 'x', 'b': 'y', 'c': 'z'}
+        return _make_form(IntSchema, post, **kw)
+
+    def test_without_budget(self):
+        calls = []
+        form = self._make_form(calls)
+        self.assertFalse(form.validate())
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(form.error_count(), 3)
+        self.assertFalse(form.errors_truncated)
+
+    def test_max_errors(self):
+        calls = []
+        form = self._make_form(calls, max_errors=2)
+        self.assertFalse(form.validate())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(form.error_count(), 2)
+        self.assertEqual(len(form.errors), 2)
+        self.assertTrue(form.errors_truncated)
+
+    def test_fail_fast(self):
+        calls = []
+        form = self._make_form(calls, fail_fast=True,
+                               validators={'d': validators.NotEmpty()})
+        self.assertFalse(form.validate())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(form.error_count(), 1)
+        self.assertFalse(form.is_error('d'))
+        self.assertTrue(form.errors_truncated)
+
+    def test_budget_not_reached(self):
+        calls = []
+        form = self._make_form(calls, {'a': '1', 'b': '2', 'c': 'z'},
+                               max_errors=2)
+        self.assertFalse(form.validate())
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(form.errors_for('c'), ['Please enter an integer value'])
+        self.assertFalse(form.errors_truncated)
+
+    def test_valid_with_budget(self):
+        form = self._make_form([], {'a': '1', 'b': '2', 'c': '3'},
+                               fail_fast=True)
+        self.assertTrue(form.validate())
+        self.assertEqual(form.data, {'a': 1, 'b': 2, 'c': 3})
+        self.assertFalse(hasattr(form.state, '_error_budget'))
+
+    def test_missing_fields_with_budget(self):
+        form = _make_form(SimpleFESchema, {}, max_errors=5)
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors_for('name'), ['Missing value'])
+
+    def test_missing_and_invalid_fields(self):
+        calls = []
+        form = self._make_form(calls, {'a': 'x', 'b': 'y'}, max_errors=2)
+        self.assertFalse(form.validate())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(form.error_count(), 2)
+        self.assertEqual(form.errors_for('c'), ['Missing value'])
+        self.assertTrue(form.errors_truncated)
+
+        calls = []
+        form = self._make_form(calls, {'a': 'x'}, max_errors=2)
+        self.assertFalse(form.validate())
+        self.assertEqual(calls, [])
+        self.assertEqual(form.error_count(), 2)
+        self.assertEqual(form.all_errors(), ['Missing value'] * 2)
+
+        form = self._make_form([], {'a': 'x'}, max_errors=5)
+        self.assertFalse(form.validate())
+        self.assertEqual(sorted(form.errors), ['a', 'b', 'c'])
+        self.assertFalse(form.errors_truncated)
+
+    def test_extra_fields_with_budget(self):
+        form = self._make_form([], {'a': 'x', 'b': 'y', 'c': 'z', 'd': 'x'},
+                               fail_fast=True)
+        self.assertFalse(form.validate())
+        self.assertEqual(form.error_count(), 1)
+        self.assertTrue('d' in form.first_error())
+
+    def test_cheap_fields_first(self):
+        calls = []
+
+        class Expensive(validators.Int):
+            validation_cost = 100
+
+            def _convert_to_python(self, value, state):
+                calls.append(value)
+                return validators.Int._convert_to_python(self, value, state)
+
+        class OrderedSchema(Schema):
+            allow_extra_fields = True
+            a = Expensive()
+            b = validators.Int()
+
+        form = _make_form(OrderedSchema, {'a': 'x', 'b': 'y', 'c': 'z'},
+                          fail_fast=True)
+        self.assertFalse(form.validate())
+        self.assertEqual(calls, [])
+        self.assertEqual(list(form.errors.keys()), ['b'])
+
+    def test_validation_cost(self):
+        from pyramid_simpleform.plans import validation_cost
+
+        self.assertEqual(validation_cost(validators.Int()), 1)
+        self.assertEqual(validation_cost(SimpleFESchema), 10)
+        self.assertEqual(validation_cost(formencode.ForEach()), 10)
+
+
+class TestInputLimits(unittest.TestCase):
+
+    def _check(self, params, structured=False, nested=True, **kw):
+        from pyramid_simpleform.limits import InputLimits, PayloadRejected
+
+        try:
+            InputLimits(**kw).check(params, structured=structured,
+                                    nested=nested)
+        except PayloadRejected as e:
+            return e.code
+
+    def test_no_limits(self):
+        from pyramid_simpleform.limits import InputLimits
+
+        self.assertFalse(InputLimits())
+        self.assertTrue(InputLimits(max_fields=1))
+
+    def test_max_fields(self):
+        from webob.multidict import MultiDict
+
+        params = MultiDict([('a', '1'), ('a', '2')])
+        self.assertEqual(self._check(params, max_fields=1), 'tooManyFields')
+        self.assertEqual(self._check(params, max_fields=2), None)
+
+    def test_max_key_length(self):
+        self.assertEqual(self._check({'abc': ''}, max_key_length=2),
+                         'keyTooLong')
+        self.assertEqual(self._check({'abc': ''}, max_key_length=3), None)
+
+    def test_max_depth(self):
+        params = {'a.b-0.c': ''}
+        self.assertEqual(self._check(params, max_depth=3), 'tooDeep')
+        self.assertEqual(self._check(params, max_depth=4), None)
+
+    def test_max_list_index(self):
+        params = {'a-10.b': '', 'a-2': ''}
+        self.assertEqual(self._check(params, max_list_index=9), 
+                         'indexTooLarge')
+        self.assertEqual(self._check(params, max_list_index=10), None)
+        self.assertEqual(self._check({'a-' + '9' * 100: ''}, 
+                                     max_list_index=10), 'indexTooLarge')
+
+    def test_not_nested(self):
+        params = {'first-name': '', 'foo-123456': '', 'a.b-0.c': ''}
+        self.assertEqual(self._check(params, nested=False, max_depth=1,
+                                     max_list_index=10), None)
+        self.assertEqual(self._check(params, max_depth=1), 'tooDeep')
+
+    def test_max_value_bytes(self):
+        params = {'a': 'xx', 'b': b'xx', 'c': object()}
+        self.assertEqual(self._check(params, max_value_bytes=3), 'tooLarge')
+        self.assertEqual(self._check(params, max_value_bytes=4), None)
+        params = {'a': u'\xe9\u20ac'}
+        self.assertEqual(self._check(params, max_value_bytes=4), 'tooLarge')
+        self.assertEqual(self._check(params, max_value_bytes=5), None)
+
+    def test_structured(self):
+        body = {'a': {'b': [{'c': 'xx'}, {'c': 'yy'}]}}
+        self.assertEqual(self._check(body, True, max_depth=3), 'tooDeep')
+        self.assertEqual(self._check(body, True, max_depth=4), None)
+        self.assertEqual(self._check(body, True, max_list_index=0),
+                         'indexTooLarge')
+        self.assertEqual(self._check(body, True, max_fields=1),
+                         'tooManyFields')
+        self.assertEqual(self._check(body, True, max_value_bytes=3),
+                         'tooLarge')
+        self.assertEqual(self._check(body, True, max_key_length=0),
+                         'keyTooLong')
+
+    def test_from_settings(self):
+        from pyramid_simpleform.limits import InputLimits
+
+        limits = InputLimits.from_settings({'simpleform.max_fields': '10',
+                                            'simpleform.max_depth': ''})
+        self.assertEqual(limits.max_fields, 10)
+        self.assertEqual(limits.max_depth, None)
+
+    def test_form_rejects_payload(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.limits import InputLimits
+
+        calls = []
+
+        class Counted(validators.String):
+            def _convert_to_python(self, value, state):
+                calls.append(value)
+                return value
+
+        request = testing.DummyRequest()
+        request.method = "POST"
+        request.POST['name'] = 'x' * 100
+
+        form = Form(request, validators={'name': Counted()},
+                    limits=InputLimits(max_value_bytes=10))
+        self.assertFalse(form.validate())
+        self.assertTrue(form.payload_rejected)
+        self.assertEqual(calls, [])
+        self.assertEqual(form.all_errors(), ['The form data is too large'])
+        self.assertEqual(form.error_codes(), {'': ['tooLarge']})
+
+    def test_form_limits_from_settings(self):
+        from pyramid_simpleform import Form
+
+        config = testing.setUp(settings={'simpleform.max_fields': '1'})
+        try:
+            request = testing.DummyRequest()
+            request.method = "POST"
+            request.POST.update(name='fred', other='x')
+            form = Form(request, SimpleFESchema)
+            self.assertFalse(form.validate())
+            self.assertTrue(form.payload_rejected)
+            limits = config.registry.simpleform_limits
+            self.assertEqual(limits.max_fields, 1)
+
+            form = Form(request, SimpleFESchema)
+            self.assertFalse(form.validate())
+            self.assertTrue(config.registry.simpleform_limits is limits)
+        finally:
+            testing.tearDown()
+
+    def test_form_without_variable_decode(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.limits import InputLimits
+
+        request = testing.DummyRequest(post={'first-name': 'Fred',
+                                             'rows-123456': 'x'})
+        limits = InputLimits(max_depth=1, max_list_index=10)
+        form = Form(request, validators={'first-name': validators.String()},
+                    limits=limits)
+        self.assertTrue(form.validate())
+        form = Form(request, validators={'first-name': validators.String()},
+                    limits=limits, variable_decode=True)
+        self.assertFalse(form.validate())
+        self.assertTrue(form.payload_rejected)
+
+
+class TestJSONBody(unittest.TestCase):
+
+    def _make_request(self, body, content_type='application/json'):
+        request = testing.DummyRequest()
+        request.method = "POST"
+        request.body = body
+        request.content_type = content_type
+        return request
+
+    def test_decodes_body_bytes(self):
+        from pyramid_simpleform.jsonbody import get_json_body
+
+        decoded = []
+
+        def decoder(body):
+            decoded.append(body)
+            return {'name': 'ok'}
+
+        request = self._make_request(b'{"name": "ok"}')
+        self.assertEqual(get_json_body(request, decoder), {'name': 'ok'})
+        self.assertEqual(get_json_body(request, decoder), {'name': 'ok'})
+        self.assertEqual(decoded, [b'{"name": "ok"}'])
+
+    def test_text_decoder(self):
+        from pyramid_simpleform.jsonbody import get_json_body
+
+        def decoder(body):
+            if not isinstance(body, type(u'')):
+                raise TypeError('the JSON object must be str, not bytes')
+            return {'name': body}
+
+        request = self._make_request(u'{"\xe9"}'.encode('utf-8'))
+        self.assertEqual(get_json_body(request, decoder),
+                         {'name': u'{"\xe9"}'})
+
+    def test_invalid_body(self):
+        from pyramid_simpleform.jsonbody import get_json_body
+
+        request = self._make_request(b'name=ok')
+        self.assertTrue(get_json_body(request) is None)
+
+    def test_form_body_not_decoded(self):
+        from pyramid_simpleform.jsonbody import get_json_body
+
+        def decoder(body):
+            raise AssertionError('should not be called')
+
+        request = self._make_request(b'{}', 
+                                     'application/x-www-form-urlencoded')
+        self.assertTrue(get_json_body(request, decoder) is None)
+
+    def test_resolve_json_decoder(self):
+        import json
+        from pyramid_simpleform.jsonbody import (
+            default_json_decoder, resolve_json_decoder)
+
+        self.assertTrue(resolve_json_decoder('json.loads') is json.loads)
+        self.assertTrue(resolve_json_decoder(json.loads) is json.loads)
+        self.assertTrue(resolve_json_decoder(None) is default_json_decoder())
+
+    def test_form_json_decoder(self):
+        from pyramid_simpleform import Form
+
+        decoded = []
+
+        def decoder(body):
+            decoded.append(body)
+            return {'name': 'ok'}
+
+        class MyForm(Form):
+            json_decoder = decoder
+
+        request = self._make_request(b'{"name": "ok"}')
+        self.assertTrue(MyForm(request, SimpleFESchema).validate())
+        self.assertTrue(MyForm(request, SimpleFESchema).validate())
+        self.assertEqual(len(decoded), 1)
+
+    def test_form_json_decoder_setting(self):
+        from pyramid_simpleform import Form
+
+        testing.setUp(settings={'simpleform.json_decoder': 'json.loads'})
+        try:
+            request = self._make_request(b'{"name": "ok"}')
+            form = Form(request, SimpleFESchema)
+            self.assertTrue(form.validate())
+            self.assertEqual(form.data['name'], 'ok')
+        finally:
+            testing.tearDown()
+
+
+class TestFileUpload(unittest.TestCase):
+
+    PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+
+    def _make_request(self, content, filename='test.png', 
+                      content_type='image/png'):
+        from pyramid.request import Request
+
+        boundary = 'xxBOUNDARYxx'
+        body = (
+            '--%s\r\n'
+            'Content-Disposition: form-data; name="upload"; '
+            'filename="%s"\r\n'
+            'Content-Type: %s\r\n\r\n' % (boundary, filename, content_type)
+        ).encode('ascii') + content + ('\r\n--%s--\r\n' % boundary).encode()
+
+        request = Request.blank('/', method='POST', body=body)
+        request.content_type = 'multipart/form-data; boundary=%s' % boundary
+        request.registry = testing.DummyRequest().registry
+        return request
+
+    def _validate(self, request, **kw):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.validators import FileUpload
+
+        class UploadSchema(Schema):
+            upload = FileUpload(**kw)
+
+        form = Form(request, UploadSchema, multipart=True)
+        form.validate()
+        return form
+
+    def test_upload(self):
+        import hashlib
+
+        form = self._validate(self._make_request(self.PNG))
+        self.assertEqual(form.errors, {})
+        upload = form.data['upload']
+        self.assertEqual(upload.filename, 'test.png')
+        self.assertEqual(upload.content_type, 'image/png')
+        self.assertEqual(upload.size, len(self.PNG))
+        self.assertEqual(upload.digest, hashlib.sha256(self.PNG).hexdigest())
+        self.assertEqual(upload.file.read(), self.PNG)
+
+    def test_too_large(self):
+        form = self._validate(self._make_request(b'x' * 1000),
+                              max_size=100, chunk_size=10)
+        self.assertEqual(form.error_codes(), {'upload': ['tooLarge']})
+
+    def test_too_large_stops_reading(self):
+        from pyramid_simpleform.validators import FileUpload
+
+        class Source(object):
+            reads = 0
+
+            def read(self, size):
+                self.reads += 1
+                return b'x' * size
+
+        class Field(object):
+            file = Source()
+
+        validator = FileUpload(max_size=100, chunk_size=10)
+        self.assertRaises(formencode.Invalid, validator.to_python, Field())
+        self.assertEqual(Field.file.reads, 11)
+
+    def test_bad_type(self):
+        form = self._validate(self._make_request(b'MZ' + b'\x00' * 100),
+                              allowed_types=['image/png', 'image/jpeg'])
+        self.assertEqual(form.error_codes(), {'upload': ['badType']})
+
+    def test_short_file_type(self):
+        form = self._validate(self._make_request(b'GIF89a'),
+                              allowed_types=['image/gif'])
+        self.assertEqual(form.errors, {})
+        self.assertEqual(form.data['upload'].content_type, 'image/gif')
+
+    def test_unknown_type_uses_declared_type(self):
+        form = self._validate(self._make_request(b'hello', 'a.txt',
+                                                 'text/plain'),
+                              hash_name=None)
+        upload = form.data['upload']
+        self.assertEqual(upload.content_type, 'text/plain')
+        self.assertTrue(upload.digest is None)
+
+    def test_no_file(self):
+        from pyramid_simpleform.validators import FileUpload
+
+        self.assertRaises(formencode.Invalid, 
+                          FileUpload().to_python, 'not a file')
+
+    def test_sniff_type(self):
+        from pyramid_simpleform.validators import sniff_type
+
+        self.assertEqual(sniff_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '),
+                         'image/webp')
+        self.assertEqual(sniff_type(b'RIFF\x00\x00\x00\x00WAVE'), None)
+        self.assertEqual(sniff_type(b''), None)
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        from pyramid_simpleform.plans import _plans
+        _plans.clear()
+
+    def tearDown(self):
+        from pyramid_simpleform.plans import set_plan_cache_size
+        set_plan_cache_size(512)
+        testing.tearDown()
+
+    def _make_config(self, **settings):
+        settings.setdefault('mako.directories',
+                            'pyramid_simpleform:templates')
+        config = testing.setUp(settings=settings, autocommit=False)
+        config.include('pyramid_mako')
+        config.include('pyramid_simpleform')
+        return config
+
+    def test_add_form_schema(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.config import get_form_schema
+
+        config = self._make_config()
+        config.add_form_schema('simple', SimpleFESchema,
+                               validators={'extra': validators.String()})
+        config.commit()
+
+        form_schema = get_form_schema(config.registry, 'simple')
+        self.assertTrue(form_schema.schema is SimpleFESchema)
+
+        request = testing.DummyRequest(post={'name': 'fred'})
+        request.method = "POST"
+        request.registry = config.registry
+        form = Form(request, 'simple')
+        self.assertTrue(form.schema is SimpleFESchema)
+        self.assertTrue('extra' in form.validators)
+        self.assertTrue(form.validate())
+
+    def test_add_form_schema_dotted_name(self):
+        from pyramid_simpleform.config import get_form_schema
+
+        config = self._make_config()
+        config.add_form_schema('simple',
+                               'pyramid_simpleform.tests.SimpleFESchema')
+        config.commit()
+        self.assertTrue(
+            get_form_schema(config.registry, 'simple').schema is 
+            SimpleFESchema)
+
+    def test_add_form_schema_conflict(self):
+        from pyramid.exceptions import ConfigurationConflictError
+
+        config = self._make_config()
+        config.add_form_schema('simple', SimpleFESchema)
+        config.add_form_schema('simple', SimpleFESchema)
+        self.assertRaises(ConfigurationConflictError, config.commit)
+
+    def test_warm_up(self):
+        from pyramid_simpleform.plans import _plans, get_plan
+
+        config = self._make_config()
+        config.add_form_schema('simple', SimpleFESchema, 
+                               templates='test_form.mako')
+        config.commit()
+
+        plan = get_plan(SimpleFESchema)
+        self.assertEqual(len(_plans), 1)
+        self.assertTrue(plan._message_codes is not None)
+        self.assertTrue(plan._validation_order is not None)
+        self.assertTrue(plan._budgeted_schema is not None)
+
+    def test_warm_up_disabled(self):
+        from pyramid_simpleform.plans import _plans
+
+        config = self._make_config(**{'simpleform.warmup': 'false'})
+        config.add_form_schema('simple', SimpleFESchema)
+        config.commit()
+        self.assertEqual(len(_plans), 0)
+
+    def test_warm_template(self):
+        from pyramid_simpleform.config import warm_template
+
+        config = self._make_config()
+        config.commit()
+        renderer = warm_template(config.registry, 'test_form.mako')
+        self.assertTrue(renderer.template is not None)
+
+    def test_plan_cache_size(self):
+        from pyramid_simpleform.plans import _plans, get_plan
+
+        self._make_config(**{'simpleform.plan_cache_size': '1'})
+        get_plan(SimpleFESchema)
+        get_plan(SimpleFESchema, {'extra': None})
+        self.assertEqual(len(_plans), 1)
+
+
+    def _make_request(self, config, post=None):
+        from pyramid.interfaces import IRequestExtensions
+        from pyramid.request import apply_request_extensions
+
+        request = testing.DummyRequest(post=post)
+        request.registry = config.registry
+        apply_request_extensions(
+            request, config.registry.queryUtility(IRequestExtensions))
+        return request
+
+    def test_request_forms(self):
+        from pyramid_simpleform import Form
+
+        class SignupForm(Form):
+            pass
+
+        config = self._make_config()
+        config.add_form_schema('simple', SimpleFESchema)
+        config.commit()
+        request = self._make_request(config, {'name': 'fred'})
+        self.assertTrue(request.simpleform is request.simpleform)
+
+        form = request.simpleform('simple', form_class=SignupForm)
+        self.assertTrue(form.is_validated)
+        self.assertEqual(form.data['name'], 'fred')
+        again = request.simpleform('simple', form_class=SignupForm)
+        self.assertTrue(again is form)
+        self.assertTrue(again.validate())
+        self.assertEqual(len(request.simpleform), 1)
+
+        other = request.simpleform(SimpleFESchema)
+        self.assertFalse(other is form)
+        self.assertTrue(type(other) is Form)
+
+        other_request = self._make_request(config, {'name': 'fred'})
+        self.assertFalse(
+            other_request.simpleform('simple', form_class=SignupForm)
+            is form)
+
+    def test_request_forms_arguments(self):
+        config = self._make_config()
+        config.commit()
+        request = self._make_request(config)
+
+        form = request.simpleform(SimpleFESchema, defaults={'name': ['a']})
+        self.assertTrue(
+            request.simpleform(SimpleFESchema, defaults={'name': ['a']})
+            is form)
+        self.assertFalse(
+            request.simpleform(SimpleFESchema, defaults={'name': ['b']})
+            is form)
+        self.assertFalse(request.simpleform(SimpleFESchema) is form)
+
+        obj = testing.DummyResource(name='fred')
+        form = request.simpleform(SimpleFESchema, obj=obj, validate=False)
+        self.assertFalse(form.is_validated)
+        self.assertTrue(request.simpleform(SimpleFESchema, obj=obj,
+                                           validate=False) is form)
+        self.assertFalse(request.simpleform(
+            SimpleFESchema, obj=testing.DummyResource(name='fred'),
+            validate=False) is form)
+
+    def test_request_forms_validated_later(self):
+        config = self._make_config()
+        config.commit()
+        request = self._make_request(config, {'name': 'fred'})
+
+        form = request.simpleform(SimpleFESchema, validate=False)
+        self.assertFalse(form.is_validated)
+        self.assertTrue(request.simpleform(SimpleFESchema) is form)
+        self.assertTrue(form.is_validated)
+        self.assertEqual(form.data['name'], 'fred')
+        self.assertTrue(
+            request.simpleform(SimpleFESchema, validate=False) is form)
+        self.assertTrue(form.is_validated)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_lru(self):
+        from pyramid_simpleform.cache import LRUCache
+
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'b')
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache['c'], 3)
+        del cache['c']
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl(self):
+        from pyramid_simpleform.cache import LRUCache
+
+        now = [0]
+        cache = LRUCache(10, ttl=5, timer=lambda: now[0])
+        cache['a'] = 1
+        now[0] = 3
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        now[0] = 5
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.get('b'), 2)
+        now[0] = 8
+        cache.expire()
+        self.assertEqual(len(cache), 0)
+
+    def test_payload_hash(self):
+        from webob.multidict import MultiDict
+        from pyramid_simpleform.cache import payload_hash
+
+        self.assertEqual(payload_hash({'a': 1, 'b': [1, 2]}),
+                         payload_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(payload_hash({'b': [1, 2]}),
+                            payload_hash({'b': [2, 1]}))
+        self.assertEqual(
+            payload_hash(MultiDict([('a', '1'), ('b', '2'), ('a', '3')])),
+            payload_hash(MultiDict([('b', '2'), ('a', '1'), ('a', '3')])))
+        self.assertNotEqual(
+            payload_hash(MultiDict([('a', '1'), ('a', '3')])),
+            payload_hash(MultiDict([('a', '3'), ('a', '1')])))
+
+
+class TestLazyImports(unittest.TestCase):
+
+    HEAVY = ('formencode.htmlfill', 'pyramid.i18n', 'pyramid.renderers',
+             'pyramid.config', 'webhelpers2', 'webhelpers')
+
+    def _loaded_after(self, code):
+        import subprocess
+        import sys
+
+        script = (
+            "import sys\n"
+            "%s\n"
+            "print(' '.join(m for m in %r if m in sys.modules))\n"
+        ) % (code, self.HEAVY)
+        output = subprocess.check_output([sys.executable, '-c', script])
+        return output.decode('ascii').split()
+
+    def test_import(self):
+        import sys
+
+        loaded = self._loaded_after(
+            "import pyramid_simpleform\n"
+            "import pyramid_simpleform.renderers")
+        if sys.version_info < (3, 7):
+            # no module __getattr__, so renderers imports WebHelpers
+            loaded = [name for name in loaded if 'webhelpers' not in name]
+        self.assertEqual(loaded, [])
+
+    def test_validate(self):
+        self.assertEqual(self._loaded_after(
+            "from pyramid_simpleform import Form\n"
+            "from formencode import validators\n"
+            "class Request(object):\n"
+            "    method = 'POST'\n"
+            "    POST = {'name': 'fred'}\n"
+            "form = Form(Request(), validators={'name': validators.String()})\n"
+            "assert form.validate()"), [])
+
+    def test_webhelpers_loaded_on_use(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform import renderers
+
+        form = Form(testing.DummyRequest(), SimpleFESchema)
+        renderers.FormRenderer(form).text('name')
+        self.assertFalse(isinstance(renderers.tags, renderers._LazyWebHelper))
+        self.assertTrue(renderers.Option is Option)
+        self.assertTrue(renderers.OLD_WEBHELPERS in (True, False))
+
+
+class TestClientRules(unittest.TestCase):
+
+    def _make_schema(self):
+
+        class AddressSchema(Schema):
+            street = validators.String(not_empty=True)
+
+        class RulesSchema(Schema):
+            name = validators.NotEmpty()
+            title = validators.UnicodeString(min=2, max=20)
+            code = validators.MaxLength(5)
+            nick = validators.MinLength(3)
+            age = validators.Int(min=18, max=130)
+            price = validators.Number(min=0)
+            email = validators.Email(not_empty=True)
+            color = validators.OneOf(['red', 'green'])
+            slug = validators.Regex(r'^[a-z]+$')
+            word = formencode.All(validators.PlainText(),
+                                  validators.MaxLength(10))
+            free = validators.String()
+            address = AddressSchema()
+
+        return RulesSchema
+
+    def test_schema_rules(self):
+        from pyramid_simpleform.clientside import schema_rules
+
+        self.assertEqual(schema_rules(self._make_schema()), {'fields': {
+            'name': {'required': True},
+            'title': {'required': True, 'min_length': 2, 'max_length': 20},
+            'code': {'max_length': 5},
+            'nick': {'min_length': 3},
+            'age': {'type': 'integer', 'min': 18, 'max': 130},
+            'price': {'type': 'number', 'min': 0},
+            'email': {'required': True, 'type': 'email'},
+            'color': {'one_of': ['red', 'green']},
+            'slug': {'pattern': '^[a-z]+$'},
+            'word': {'pattern': '^[a-zA-Z_\\-0-9]*$', 'max_length': 10},
+            'address': {'fields': {'street': {'required': True}}},
+        }})
+
+    def test_regex_flags(self):
+        import re
+        from pyramid_simpleform.clientside import validator_rules
+
+        rules = validator_rules(validators.Regex(r'^a$', 
+                                                 regexOps=('I', re.M)))
+        self.assertEqual(rules['flags'], 'im')
+
+    def test_regex_not_stricter(self):
+        import re
+        from pyramid_simpleform.clientside import validator_rules
+
+        for regex in [re.compile(r'^ [A-Z]{2} \d{4} $', re.X),
+                      r'^(?P<code>[a-z]+)$', r'\A[a-z]+\Z', r'(?i)^a$',
+                      r'^[a-z]+(?#comment)$', r'^(a)?(?(1)b|c)$']:
+            rules = validator_rules(validators.Regex(regex))
+            self.assertFalse('pattern' in rules, regex)
+        rules = validator_rules(validators.Regex(re.compile(u'^\\w+$')))
+        self.assertEqual('pattern' in rules, not re.compile(u'').flags)
+        if hasattr(re, 'ASCII'):
+            rules = validator_rules(validators.Regex(r'^\w+$', regexOps=('A',)))
+            self.assertEqual(rules['pattern'], r'^\w+$')
+
+    def test_strip(self):
+        from pyramid_simpleform.clientside import validator_rules
+
+        self.assertEqual(
+            validator_rules(validators.Regex(r'^[a-z]+$', strip=True)),
+            {'pattern': '^[a-z]+$', 'strip': True})
+        self.assertEqual(validator_rules(validators.String(max=3, strip=True)),
+                         {'max_length': 3, 'strip': True})
+
+    def test_client_rules_cached(self):
+        import json
+        from pyramid_simpleform.clientside import get_client_rules
+
+        schema = self._make_schema()
+        rules = get_client_rules(schema)
+        self.assertTrue(get_client_rules(schema) is rules)
+        self.assertEqual(json.loads(rules.body.decode('utf-8')), rules.rules)
+        self.assertEqual(len(rules.etag), 40)
+
+    def test_client_rules_response(self):
+        from pyramid.request import Request
+        from pyramid_simpleform.clientside import (
+            client_rules_response, get_client_rules)
+
+        schema = self._make_schema()
+        etag = get_client_rules(schema).etag
+
+        response = client_rules_response(Request.blank('/'), schema)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.content_type, 'application/json')
+        self.assertEqual(response.etag, etag)
+        self.assertEqual(response.body, get_client_rules(schema).body)
+
+        request = Request.blank('/', headers={'If-None-Match': '"%s"' % etag})
+        response = client_rules_response(request, schema)
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.body, b'')
+
+
+class TestJSONResponse(unittest.TestCase):
+
+    def _make_form(self, params, **kwargs):
+
+        class PersonSchema(Schema):
+            name = validators.NotEmpty()
+            age = validators.Int()
+
+        class PeopleSchema(Schema):
+            people = formencode.ForEach(PersonSchema())
+
+        return _make_form(PeopleSchema, params, variable_decode=True,
+                          **kwargs)
+
+    def test_json_default(self):
+        import datetime
+        import decimal
+        from pyramid_simpleform.jsonbody import json_default
+
+        class Obj(object):
+            def __json__(self):
+                return {'a': 1}
+
+        self.assertEqual(json_default(datetime.date(2020, 1, 2)),
+                         '2020-01-02')
+        self.assertEqual(json_default(decimal.Decimal('1.50')), '1.50')
+        self.assertEqual(json_default(set([1])), [1])
+        self.assertEqual(json_default(Obj()), {'a': 1})
+
+    def test_stdlib_json_encoder(self):
+        import datetime
+        from pyramid_simpleform.jsonbody import stdlib_json_encoder
+
+        self.assertEqual(
+            stdlib_json_encoder({'d': datetime.date(2020, 1, 2)}),
+            b'{"d":"2020-01-02"}')
+
+    def test_resolve_json_encoder(self):
+        from pyramid_simpleform.jsonbody import (
+            default_json_encoder, resolve_json_encoder, stdlib_json_encoder)
+
+        self.assertTrue(resolve_json_encoder(
+            'pyramid_simpleform.jsonbody.stdlib_json_encoder')
+            is stdlib_json_encoder)
+        encoder = resolve_json_encoder(None)
+        self.assertTrue(resolve_json_encoder(None) is encoder)
+        self.assertEqual(encoder({'a': [1]}),
+                         default_json_encoder()({'a': [1]}))
+
+    def test_nested_errors(self):
+        form = self._make_form({'people-0.name': '',
+                                'people-0.age': 'x',
+                                'people-1.name': 'Bob',
+                                'people-1.age': '3'})
+        self.assertFalse(form.validate())
+
+        errors = form.nested_errors()
+        self.assertEqual(sorted(errors['people'][0].keys()), ['age', 'name'])
+        self.assertTrue(errors['people'][1] is None)
+        # the Invalid tree wasn't flattened
+        self.assertTrue(form._invalid is not None)
+
+        # same shape once the errors have been unpacked
+        form.errors
+        self.assertEqual(form.nested_errors()['people'][0], errors['people'][0])
+
+    def test_nested_errors_keep_positions(self):
+        params = {'people-0.name': 'Ann', 'people-0.age': '1',
+                  'people-1.name': 'Bob', 'people-1.age': '2',
+                  'people-2.name': '', 'people-2.age': '3'}
+        expected = {'people': [None, None, {'name': 'Please enter a value'}]}
+
+        form = self._make_form(params)
+        self.assertFalse(form.validate())
+        self.assertEqual(form.nested_errors(), expected)
+
+        form = self._make_form(params)
+        self.assertFalse(form.validate())
+        self.assertTrue(form.is_error('people-2.name'))
+        self.assertEqual(form.nested_errors(), expected)
+        self.assertEqual(form.as_dict()['errors'], expected)
+
+    def test_nested_errors_with_validators(self):
+        form = self._make_form({'people-0.name': '', 'people-0.age': '1'},
+                               validators={'other': validators.NotEmpty()})
+        self.assertFalse(form.validate())
+        expected = {'people': [{'name': 'Please enter a value'}],
+                    'other': 'Please enter a value'}
+        self.assertEqual(form.nested_errors(), expected)
+        form.errors
+        self.assertEqual(form.nested_errors(), expected)
+
+    def test_nest_errors(self):
+        from pyramid_simpleform.errors import nest_errors
+
+        self.assertEqual(nest_errors({
+            '': 'Bad form',
+            'a-1.b-2': 'x',
+            'a-1.c': 'y',
+            'first-name': 'z',
+            'd.e': ['u', 'v'],
+        }), {
+            '': 'Bad form',
+            'a': [None, {'b': [None, None, 'x'], 'c': 'y'}],
+            'first-name': 'z',
+            'd': {'e': ['u', 'v']},
+        })
+
+    def test_as_dict(self):
+        form = self._make_form({'people-0.name': 'Bob',
+                                'people-0.age': '3'})
+        self.assertTrue(form.validate())
+        self.assertEqual(form.as_dict(), {
+            'valid': True,
+            'data': {'people': [{'name': 'Bob', 'age': 3}]},
+            'errors': {},
+        })
+
+    def test_as_dict_codes(self):
+        form = self._make_form({'people-0.name': '', 'people-0.age': '3'})
+        self.assertFalse(form.validate())
+        result = form.as_dict(codes=True)
+        self.assertFalse(result['valid'])
+        self.assertEqual(result['codes'], {'people-0.name': ['empty']})
+
+    def test_json_response(self):
+        import json
+
+        form = self._make_form({'people-0.name': '', 'people-0.age': '3'})
+        form.validate()
+        response = form.json_response()
+        self.assertEqual(response.status_int, 400)
+        self.assertEqual(response.content_type, 'application/json')
+        result = json.loads(response.body.decode('utf-8'))
+        self.assertEqual(list(result['errors']['people'][0].keys()),
+                         ['name'])
+
+        form = self._make_form({'people-0.name': 'Bob', 'people-0.age': '3'})
+        form.validate()
+        self.assertEqual(form.json_response().status_int, 200)
+        self.assertEqual(form.json_response(status=201).status_int, 201)
+
+    def test_json_encoder(self):
+        from pyramid_simpleform import Form
+
+        encoded = []
+
+        def encoder(obj):
+            encoded.append(obj)
+            return b'{}'
+
+        class MyForm(Form):
+            json_encoder = encoder
+
+        request = testing.DummyRequest()
+        form = MyForm(request, SimpleFESchema)
+        self.assertEqual(form.json_response().body, b'{}')
+        self.assertEqual(encoded[0]['valid'], False)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.cache import LRUCache
+
+        class CachedForm(Form):
+            result_cache = LRUCache(10, ttl=60)
+
+        self.form_class = CachedForm
+
+    def _make_form(self, schema=SimpleFESchema, params=None, **kwargs):
+        if params is None:
+            params = {'name': 'ok'}
+        return _make_form(schema, params, self.form_class, **kwargs)
+
+    def test_cached(self):
+        form = self._make_form()
+        self.assertTrue(form.validate())
+        self.assertFalse(form.result_from_cache)
+
+        form = self._make_form()
+        self.assertTrue(form.validate())
+        self.assertTrue(form.result_from_cache)
+        self.assertEqual(form.data['name'], 'ok')
+
+        # the cached data isn't shared with the form
+        form.data['name'] = 'changed'
+        form = self._make_form()
+        form.validate()
+        self.assertEqual(form.data['name'], 'ok')
+
+    def test_cached_errors(self):
+        form = self._make_form(params={'name': ''})
+        self.assertFalse(form.validate())
+        form = self._make_form(params={'name': ''})
+        self.assertFalse(form.validate())
+        self.assertTrue(form.result_from_cache)
+        self.assertTrue(form.is_error('name'))
+        form.errors['other'] = 'changed'
+        form = self._make_form(params={'name': ''})
+        form.validate()
+        self.assertFalse(form.is_error('other'))
+
+    def test_nested_data_not_shared(self):
+        form = self._make_form(params={'name': 'ok', 'names': ['a', 'b']})
+        self.assertTrue(form.validate())
+        form.data['names'].append('changed')
+
+        form = self._make_form(params={'name': 'ok', 'names': ['a', 'b']})
+        self.assertTrue(form.validate())
+        self.assertTrue(form.result_from_cache)
+        self.assertEqual(form.data['names'], ['a', 'b'])
+        form.data['names'][0] = 'changed'
+
+        form = self._make_form(params={'name': 'ok', 'names': ['a', 'b']})
+        form.validate()
+        self.assertEqual(form.data['names'], ['a', 'b'])
+
+    def test_objects_not_cached(self):
+        class Thing(object):
+            pass
+
+        class ThingSchema(Schema):
+            name = validators.Wrapper(to_python=lambda value: Thing())
+
+        for i in range(2):
+            form = self._make_form(ThingSchema)
+            self.assertTrue(form.validate())
+            self.assertFalse(form.result_from_cache)
+
+    def test_request_not_kept(self):
+        import gc
+        import weakref
+
+        form = self._make_form(params={'name': ''})
+        self.assertFalse(form.validate())
+        request = weakref.ref(form.request)
+        self.assertTrue(form.errors['name'])
+        del form
+        gc.collect()
+        self.assertTrue(request() is None)
+
+        form = self._make_form(params={'name': ''})
+        self.assertFalse(form.validate())
+        self.assertTrue(form.result_from_cache)
+        self.assertTrue(form._invalid.state is form.state)
+        self.assertTrue(form.is_error('name'))
+
+    def test_key(self):
+        self._make_form().validate()
+        form = self._make_form(params={'name': 'other'})
+        form.validate()
+        self.assertFalse(form.result_from_cache)
+        form = self._make_form(defaults={'extra': 1})
+        form.validate()
+        self.assertFalse(form.result_from_cache)
+        from pyramid_simpleform import State
+        form = self._make_form(state=State(cache_key=1))
+        form.validate()
+        self.assertFalse(form.result_from_cache)
+
+    def test_validators_in_key(self):
+        form = self._make_form(None, params={'a': 'abc'},
+                               validators={'a': validators.UnicodeString()})
+        self.assertTrue(form.validate())
+        form = self._make_form(None, params={'a': 'abc'},
+                               validators={'a': validators.Int()})
+        self.assertFalse(form.validate())
+        self.assertFalse(form.result_from_cache)
+        self.assertTrue(form.is_error('a'))
+
+        validator = validators.Int()
+        self._make_form(None, params={'a': '1'},
+                        validators={'a': validator}).validate()
+        form = self._make_form(None, params={'a': '1'},
+                               validators={'a': validator})
+        self.assertTrue(form.validate())
+        self.assertTrue(form.result_from_cache)
+
+    def test_excluded(self):
+        class SideEffect(validators.UnicodeString):
+            cacheable = False
+
+        class SideEffectSchema(Schema):
+            name = SideEffect()
+
+        for i in range(2):
+            form = self._make_form(SideEffectSchema)
+            form.validate()
+            self.assertFalse(form.result_from_cache)
+
+        for i in range(2):
+            form = self._make_form(cache=False)
+            form.validate()
+            self.assertFalse(form.result_from_cache)
+
+    def test_is_cacheable(self):
+        from pyramid_simpleform.plans import is_cacheable
+
+        self.assertTrue(is_cacheable(SimpleFESchema))
+        self.assertFalse(is_cacheable(
+            formencode.All(validators.NotEmpty(),
+                           validators.DateValidator(after_now=True))))
+
+    def test_settings(self):
+        config = testing.setUp(settings={'simpleform.result_cache_ttl': '30'})
+        try:
+            config.include('pyramid_simpleform')
+            cache = config.registry.simpleform_result_cache
+            self.assertEqual(cache.ttl, 30)
+
+            _make_form(post={'name': 'ok'}).validate()
+            self.assertEqual(len(cache), 1)
+        finally:
+            testing.tearDown()
+
+
+class TestMemoized(unittest.TestCase):
+
+    def _make_validator(self, **kwargs):
+        from pyramid_simpleform.validators import Memoized
+
+        calls = []
+
+        class Slow(validators.Int):
+            def _convert_to_python(self, value, state):
+                calls.append(value)
+                return validators.Int._convert_to_python(self, value, state)
+
+        return Memoized(Slow(), **kwargs), calls
+
+    def test_memoized(self):
+        validator, calls = self._make_validator()
+        self.assertEqual(validator.to_python('1'), 1)
+        self.assertEqual(validator.to_python('1'), 1)
+        self.assertEqual(calls, ['1'])
+        self.assertEqual(validator.stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1})
+
+        validator.clear()
+        self.assertEqual(validator.stats(),
+                         {'hits': 0, 'misses': 0, 'size': 0})
+
+    def test_memoized_invalid(self):
+        validator, calls = self._make_validator()
+        self.assertRaises(formencode.Invalid, validator.to_python, 'x')
+        try:
+            validator.to_python('x')
+        except formencode.Invalid as e:
+            self.assertEqual(str(e), 'Please enter an integer value')
+        self.assertEqual(calls, ['x'])
+
+    def test_request_not_kept(self):
+        import gc
+        import weakref
+        from pyramid_simpleform import Form
+
+        validator, calls = self._make_validator()
+
+        class MemoSchema(Schema):
+            age = validator
+
+        form = Form(testing.DummyRequest(post={'age': 'x'}), MemoSchema)
+        self.assertFalse(form.validate())
+        request = weakref.ref(form.request)
+        del form
+        gc.collect()
+        self.assertTrue(request() is None)
+
+        for i in range(2):
+            state = object()
+            try:
+                validator.to_python('y', state)
+            except formencode.Invalid as e:
+                self.assertTrue(e.state is state)
+        self.assertEqual(calls, ['x', 'y'])
+
+    def test_unhashable(self):
+        from pyramid_simpleform.validators import Memoized
+
+        validator = Memoized(formencode.ForEach(validators.Int()))
+        self.assertEqual(validator.to_python(['1', '2']), [1, 2])
+        self.assertEqual(validator.stats()['size'], 0)
+
+    def test_ttl(self):
+        validator, calls = self._make_validator(ttl=60)
+        now = [0]
+        validator.cache.timer = lambda: now[0]
+        validator.to_python('1')
+        now[0] = 61
+        validator.to_python('1')
+        self.assertEqual(calls, ['1', '1'])
+
+    def test_per_request(self):
+        from pyramid_simpleform import Form
+
+        validator, calls = self._make_validator(per_request=True)
+
+        class MemoSchema(Schema):
+            age = validator
+            ages = formencode.ForEach(validator)
+
+        request = testing.DummyRequest(post={'age': '1', 'ages': ['1', '2']})
+        form = Form(request, MemoSchema)
+        self.assertTrue(form.validate())
+        self.assertEqual(form.data['ages'], [1, 2])
+        self.assertEqual(sorted(calls), ['1', '2'])
+
+        # a new request doesn't see the results of the first one
+        request = testing.DummyRequest(post={'age': '1'})
+        Form(request, MemoSchema).validate()
+        self.assertEqual(sorted(calls), ['1', '1', '2'])
+        self.assertEqual(validator.stats()['size'], 0)
+
+    def test_in_schema(self):
+        from pyramid_simpleform import Form
+
+        validator, calls = self._make_validator()
+
+        class MemoSchema(Schema):
+            age = validator
+
+        for i in range(3):
+            request = testing.DummyRequest(post={'age': 'x'})
+            form = Form(request, MemoSchema)
+            self.assertFalse(form.validate())
+            self.assertEqual(form.errors_for('age'),
+                             ['Please enter an integer value'])
+        self.assertEqual(calls, ['x'])
+
+
+class TestBatched(unittest.TestCase):
+
+    def _make_validator(self):
+        from pyramid_simpleform.batching import Batched
+
+        loads = []
+
+        class Unique(Batched):
+
+            messages = dict(taken='Already taken')
+            taken = ('a@example.com', 'c@example.com')
+
+            def load(self, keys, state):
+                loads.append(keys)
+                return dict((key, True) for key in keys if key in self.taken)
+
+            def check(self, value, loaded, state):
+                if loaded:
+                    raise formencode.Invalid(self.message('taken', state),
+                                             value, state)
+                return value.upper()
+
+        return Unique(), loads
+
+    def _make_schema(self, validator):
+
+        class RowSchema(Schema):
+            email = validator
+            name = validators.String(if_missing=None)
+
+        class BulkSchema(Schema):
+            rows = formencode.ForEach(RowSchema())
+            owner = validator
+
+        return BulkSchema
+
+    def test_one_load(self):
+        validator, loads = self._make_validator()
+        post = {'owner': 'o@example.com'}
+        for i in range(50):
+            post['rows-%d.email' % i] = '%d@example.com' % (i % 10)
+        form = _make_form(self._make_schema(validator), post,
+                          variable_decode=True)
+        self.assertTrue(form.validate())
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len(loads[0]), 11)
+        self.assertEqual(form.data['rows'][12]['email'], '2@EXAMPLE.COM')
+        self.assertEqual(form.data['owner'], 'O@EXAMPLE.COM')
+
+    def test_errors(self):
+        validator, loads = self._make_validator()
+        form = _make_form(self._make_schema(validator), {
+            'owner': 'c@example.com',
+            'rows-0.email': 'b@example.com',
+            'rows-1.email': 'a@example.com',
+        }, variable_decode=True)
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors, {'owner': 'Already taken',
+                                       'rows-1.email': 'Already taken'})
+        self.assertEqual(form.data['rows'][1]['email'], 'a@example.com')
+
+    def test_not_loaded_if_invalid(self):
+        from pyramid_simpleform.batching import Pending
+
+        validator, loads = self._make_validator()
+        schema = self._make_schema(validator)
+        schema.fields['extra'] = validators.Int()
+        form = _make_form(schema, {'owner': 'o@example.com', 'extra': 'x'},
+                          variable_decode=True)
+        self.assertFalse(form.validate())
+        self.assertEqual(loads, [])
+        self.assertFalse(isinstance(form.data['owner'], Pending))
+
+    def test_form_validators(self):
+        validator, loads = self._make_validator()
+        form = _make_form(None, {'email': 'a@example.com'},
+                          validators={'email': validator})
+        self.assertFalse(form.validate())
+        self.assertEqual(form.errors_for('email'), ['Already taken'])
+
+    def test_standalone(self):
+        validator, loads = self._make_validator()
+        self.assertEqual(validator.to_python('b@example.com'),
+                         'B@EXAMPLE.COM')
+        self.assertRaises(formencode.Invalid,
+                          validator.to_python, 'a@example.com')
+        self.assertEqual(len(loads), 2)
+
+
+class TestCompiler(unittest.TestCase):
+
+    values = ['', '  ', ' ab ', 'abc', 'abcdefg', '5', '-4', '11', '1.5',
+              '1e400', 'nan', ' 3 ', 'x', 'y', 'jane@example.com',
+              ' jane@Example.COM ', 'jane@example', 'jane@@example.com',
+              'jane@.example.com', u'jane@\xfcn\xefcode.com',
+              'jane@' + 'a' * 64 + '.com', 'a\n', None, 0, 3.0, [],
+              ['1', '2'], ['1', 'x'], ('3',), {}, {'a': '1'}, True,
+              '12/31/2020', 'Some_Text']
+
+    def _make_schema(self):
+
+        class RowSchema(Schema):
+            email = validators.Email(not_empty=True)
+            name = validators.String(max=5)
+            quantity = validators.Int(min=1, not_empty=True)
+
+        class MixedSchema(Schema):
+            allow_extra_fields = True
+            chained_validators = [validators.FieldsMatch('a', 'h')]
+
+            a = validators.String(strip=True, min=2, max=5)
+            b = validators.Int(if_empty=7, min=-3, max=10)
+            c = validators.Number(max=100)
+            d = validators.Bool()
+            e = validators.OneOf(['x', 'y', 1])
+            f = validators.OneOf(['x', 'y'], hideList=True, if_missing='x')
+            g = validators.Regex(r'^\d+$', strip=True)
+            h = validators.PlainText()
+            i = validators.NotEmpty()
+            j = formencode.ForEach(validators.Int())
+            k = validators.Email(if_missing=None)
+            m = validators.DateConverter()
+            rows = formencode.ForEach(RowSchema())
+
+        return MixedSchema
+
+    def _result(self, validate, value):
+        import sys
+        from pyramid_simpleform import State
+
+        state = State(key='previous')
+        try:
+            result = ('ok', validate(value, state))
+        except formencode.Invalid as e:
+            result = ('invalid', str(e), e.unpack_errors(),
+                      list(e.error_dict or ()))
+            if sys.version_info < (3, 6):
+                # dicts have no order to compare, and neither has their repr
+                result = ('invalid', str(e), self._sorted(result[2]),
+                          sorted(result[3]))
+        except Exception as e:
+            # some validators fail on unexpected types
+            result = ('error', type(e), str(e))
+        self.assertEqual(state.key, 'previous')
+        return repr(result)
+
+    def _sorted(self, errors):
+        if isinstance(errors, dict):
+            return sorted((key, self._sorted(value))
+                          for key, value in errors.items())
+        if isinstance(errors, list):
+            return [self._sorted(value) for value in errors]
+        return errors
+
+    def _assert_same(self, schema, value):
+        from pyramid_simpleform.compiler import compile_schema
+
+        self.assertEqual(self._result(compile_schema(schema), value),
+                         self._result(schema().to_python, value))
+
+    def test_inlined(self):
+        from pyramid_simpleform.compiler import compile_schema
+
+        validate = compile_schema(self._make_schema())
+        # DateConverter isn't inlined
+        self.assertEqual(validate.inlined, 12)
+        self.assertTrue('def validate(' in validate.source)
+
+    def test_same_results(self):
+        schema = self._make_schema()
+        for value in self.values:
+            for name in schema.fields:
+                self._assert_same(schema, {name: value})
+            self._assert_same(schema, dict(
+                (name, value) for name in schema.fields))
+
+    def test_valid(self):
+        schema = self._make_schema()
+        value = {'a': 'abc', 'b': '', 'c': '1.5', 'd': 'on', 'e': 'x',
+                 'g': ' 42', 'h': 'abc', 'i': '0', 'j': ['1', '2'],
+                 'k': 'jane@example.com', 'm': '12/31/2020', 'extra': 'x',
+                 'rows': [{'email': 'jane@example.com', 'name': 'Jane',
+                           'quantity': '2'}]}
+        self._assert_same(schema, value)
+        self.assertEqual(self._result(schema().to_python, value)[:5],
+                         "('ok'")
+
+    def test_nested(self):
+        schema = self._make_schema()
+        for rows in ([], None, '', 'x', [{}], [{'email': 'a@b.com',
+                                                'quantity': '1'}],
+                     [{'email': 'a@b.com', 'quantity': '0'}],
+                     [{'email': 'a@b.com', 'quantity': '1', 'other': 1}],
+                     ({'email': 'a@b.com', 'quantity': '1'}, 5)):
+            self._assert_same(schema, {'a': 'abc', 'h': 'abc', 'i': 'x',
+                                       'rows': rows})
+
+    def test_multidict(self):
+        from webob.multidict import MultiDict
+
+        schema = self._make_schema()
+        self._assert_same(schema, MultiDict([('a', 'abc'), ('h', 'abc'),
+                                             ('i', 'x'), ('b', '1')]))
+        self._assert_same(schema, MultiDict([('a', 'abc'), ('h', 'abc'),
+                                             ('i', 'x'), ('i', 'y')]))
+
+    def test_extra_fields(self):
+
+        class StrictSchema(Schema):
+            name = validators.String()
+
+        class FilteringSchema(Schema):
+            allow_extra_fields = True
+            filter_extra_fields = True
+            ignore_key_missing = True
+            name = validators.String()
+
+        class KeyMissingSchema(Schema):
+            if_key_missing = ''
+            name = validators.String(not_empty=True)
+            age = validators.Int()
+
+        for schema in (StrictSchema, FilteringSchema, KeyMissingSchema):
+            for value in ({}, {'name': 'Jane'}, {'other': 'x'},
+                          {'name': 'Jane', 'other': 'x'}):
+                self._assert_same(schema, value)
+
+    def test_overridden_validator(self):
+        from pyramid_simpleform.compiler import compile_schema
+
+        class Upper(validators.String):
+
+            def _convert_to_python(self, value, state):
+                return value.upper()
+
+        class UpperSchema(Schema):
+            name = Upper()
+
+        validate = compile_schema(UpperSchema)
+        self.assertEqual(validate.inlined, 0)
+        self.assertEqual(validate({'name': 'jane'}), {'name': 'JANE'})
+
+    def test_not_compilable(self):
+        from pyramid_simpleform.compiler import compile_schema
+
+        class PreSchema(Schema):
+            pre_validators = [formencode.NestedVariables()]
+            name = validators.String()
+
+        self.assertEqual(compile_schema(PreSchema), None)
+
+    def test_form(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.plans import get_plan
+
+        class UncompiledForm(Form):
+            compiled = False
+
+        schema = self._make_schema()
+        post = {'a': 'abc', 'b': 'x', 'h': 'abd', 'rows-0.email': 'jane'}
+        results = []
+        for cls in (Form, UncompiledForm):
+            form = cls(testing.DummyRequest(post=post), schema,
+                       variable_decode=True, cache=False)
+            self.assertFalse(form.validate())
+            results.append((form.data, form.errors))
+        self.assertEqual(results[0], results[1])
+        self.assertNotEqual(get_plan(schema).compiled, None)
+
+
+class TestCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'simpleform.cache')
+
+    def tearDown(self):
+        import shutil
+        from pyramid_simpleform.compiler import set_code_cache
+        set_code_cache(None)
+        shutil.rmtree(self.directory)
+
+    def _make_schema(self):
+
+        class CachedSchema(Schema):
+            name = validators.String(not_empty=True)
+            age = validators.Int(min=0)
+
+        return CachedSchema
+
+    def test_round_trip(self):
+        from pyramid_simpleform import State
+        from pyramid_simpleform.codecache import CodeCache, schema_codes
+        from pyramid_simpleform.codecache import write_code_cache
+        from pyramid_simpleform.compiler import compile_schema
+        from pyramid_simpleform.compiler import set_code_cache
+
+        schema = self._make_schema()
+        codes = schema_codes([schema], fields=True)
+        self.assertEqual(len(codes), 3)
+        self.assertEqual(write_code_cache(self.path, codes), 3)
+
+        cache = CodeCache(self.path)
+        self.assertEqual(len(cache), 3)
+        set_code_cache(cache)
+        validate = compile_schema(schema)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(validate({'name': 'Jane', 'age': '3'}, State()),
+                         {'name': 'Jane', 'age': 3})
+
+        class OtherSchema(Schema):
+            name = validators.String(max=3)
+
+        compile_schema(OtherSchema)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+
+    def test_stale(self):
+        import struct
+        import warnings
+        from pyramid_simpleform.codecache import CodeCache, StaleCache
+        from pyramid_simpleform.codecache import load_code_cache
+        from pyramid_simpleform.codecache import write_code_cache
+
+        write_code_cache(self.path, {})
+        with open(self.path, 'r+b') as f:
+            f.seek(4)
+            f.write(struct.pack('<H', 999))
+        self.assertRaises(StaleCache, CodeCache, self.path)
+
+        with open(self.path, 'wb') as f:
+            f.write(b'not a cache')
+        self.assertRaises(StaleCache, CodeCache, self.path)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(load_code_cache(self.path + '.missing'), None)
+        self.assertEqual(len(caught), 1)
+
+    def test_setting(self):
+        from pyramid_simpleform import compiler
+        from pyramid_simpleform.codecache import CodeCache, write_code_cache
+
+        write_code_cache(self.path, {})
+        config = testing.setUp(settings={
+            'simpleform.code_cache': self.path})
+        try:
+            config.include('pyramid_simpleform')
+            self.assertTrue(isinstance(compiler._code_cache, CodeCache))
+        finally:
+            testing.tearDown()
+
+    def test_main(self):
+        from pyramid_simpleform.codecache import CodeCache, main
+
+        out = self._capture(main, ['simpleform-compile', '-o', self.path,
+                                   'pyramid_simpleform.tests:SimpleFESchema',
+                                   'pyramid_simpleform.tests'])
+        # the module only defines SimpleFESchema
+        self.assertTrue(out.startswith('wrote 1 modules for 2 schemas'))
+        cache = CodeCache(self.path)
+        self.assertEqual(len(cache), 1)
+        cache.close()
+
+    def _capture(self, function, argv):
+        import sys
+        try:
+            # io.StringIO only takes unicode on Python 2
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.assertEqual(function(argv), 0)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def _make_form(self, sampler, post):
+        from pyramid_simpleform import Form
+
+        class SampledForm(Form):
+            instruments = [sampler]
+
+        return _make_form(SimpleFESchema, post, SampledForm)
+
+    def test_payload_shape(self):
+        from webob.multidict import MultiDict
+        from pyramid_simpleform.instrumentation import payload_shape
+
+        self.assertEqual(
+            payload_shape(MultiDict([('a', 'xy'), ('b-0.c', u'\xe9')])),
+            {'fields': 2, 'depth': 3, 'bytes': 10})
+        self.assertEqual(
+            payload_shape({'a': [{'b': 'xy'}, 1]}),
+            {'fields': 2, 'depth': 3, 'bytes': 4})
+
+    def test_dump(self):
+        import json
+        import pstats
+        from pyramid_simpleform.instrumentation import Sampler
+
+        sampler = Sampler(self.directory, threshold=0)
+        form = self._make_form(sampler, {'name': 'secret value'})
+        form.validate()
+
+        dumps = sampler.dumps()
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(pstats.Stats(dumps[0]).total_calls > 0)
+        with open(dumps[0][:-len('.prof')] + '.json') as f:
+            info = json.load(f)
+        self.assertEqual(info['phase'], 'validate')
+        self.assertEqual(info['schema'],
+                         'pyramid_simpleform.tests.SimpleFESchema')
+        self.assertEqual(info['fields'], 1)
+        self.assertEqual(info['bytes'], len('name') + len('secret value'))
+        self.assertFalse('secret' in json.dumps(info))
+
+    def test_threshold_and_every(self):
+        from pyramid_simpleform.instrumentation import Sampler
+
+        sampler = Sampler(self.directory, threshold=60)
+        self._make_form(sampler, {'name': 'ok'}).validate()
+        self.assertEqual(sampler.dumps(), [])
+
+        sampler = Sampler(self.directory, threshold=0, every=3)
+        for i in range(6):
+            self._make_form(sampler, {'name': 'ok'}).validate()
+        self.assertEqual(len(sampler.dumps()), 2)
+
+    def test_max_bytes(self):
+        import os
+        from pyramid_simpleform.instrumentation import Sampler
+
+        sampler = Sampler(self.directory, threshold=0)
+        self._make_form(sampler, {'name': 'ok'}).validate()
+        first = sampler.dumps()[0]
+        size = os.path.getsize(first) + \
+            os.path.getsize(first[:-len('.prof')] + '.json')
+
+        sampler.max_bytes = size * 2.5
+        for i in range(4):
+            self._make_form(sampler, {'name': 'ok'}).validate()
+        dumps = sampler.dumps()
+        self.assertTrue(len(dumps) <= 3)
+        self.assertFalse(first in dumps)
+        self.assertEqual(len(os.listdir(self.directory)), len(dumps) * 2)
+
+    def test_settings(self):
+        config = testing.setUp(settings={
+            'simpleform.profile_dir': self.directory,
+            'simpleform.profile_threshold': '0'})
+        try:
+            config.include('pyramid_simpleform')
+            sampler, = config.registry.simpleform_instruments
+            _make_form(post={'name': 'ok'}).validate()
+            self.assertEqual(len(sampler.dumps()), 1)
+        finally:
+            testing.tearDown()
+
+
+class TestTracing(unittest.TestCase):
+
+    def _make_form(self, tracer, post, **kwargs):
+        from pyramid_simpleform import Form
+
+        class TracedForm(Form):
+            pass
+        TracedForm.tracer = tracer
+
+        return _make_form(SimpleFESchema, post, TracedForm, **kwargs)
+
+    def test_noop(self):
+        from pyramid_simpleform.instrumentation import NOOP_TRACER
+
+        form = _make_form()
+        self.assertTrue(form.tracer is NOOP_TRACER)
+        with form.tracer.start_span('x', a=1) as span:
+            self.assertFalse(span.recording)
+            span.set_attribute('b', 2)
+
+    def test_memory_tracer(self):
+        from pyramid_simpleform.instrumentation import MemoryTracer
+
+        tracer = MemoryTracer()
+        with tracer.start_span('outer', a=1) as outer:
+            with tracer.start_span('inner'):
+                pass
+            span = tracer.start_span('manual')
+            span.end()
+        self.assertEqual([s.name for s in tracer.spans],
+                         ['inner', 'manual', 'outer'])
+        self.assertEqual([s.name for s in outer.children],
+                         ['inner', 'manual'])
+        self.assertEqual(tracer.roots(), [outer])
+        self.assertTrue(outer.duration >= 0)
+
+        try:
+            with tracer.start_span('failed'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(tracer.find('failed')[0].attributes['error'],
+                         'ValueError')
+
+    def test_validate(self):
+        from pyramid_simpleform.instrumentation import MemoryTracer
+
+        tracer = MemoryTracer()
+        form = self._make_form(tracer, {'name': '', 'age': '1'},
+                               validators={'age': validators.Int()})
+        form.validate()
+        self.assertEqual(tracer.find('form.init')[0].attributes['schema'],
+                         'pyramid_simpleform.tests.SimpleFESchema')
+
+        span, = tracer.find('form.validate')
+        self.assertEqual([s.name for s in span.children],
+                         ['form.params', 'form.decode', 'form.schema',
+                          'form.validator'])
+        self.assertEqual(span.children[-1].attributes, {'field': 'age'})
+        self.assertEqual(span.attributes['fields'], 3)
+        self.assertEqual(span.attributes['errors'], 1)
+        self.assertEqual(span.attributes['valid'], False)
+
+    def test_bind(self):
+        from pyramid_simpleform.instrumentation import MemoryTracer
+
+        tracer = MemoryTracer()
+        form = self._make_form(tracer, {'name': 'ok'})
+        form.validate()
+        form.bind(SimpleObj())
+        self.assertEqual(len(tracer.find('form.bind')), 1)
+
+    def test_render(self):
+        from pyramid_simpleform.instrumentation import MemoryTracer
+        from pyramid_simpleform.renderers import FormRenderer
+
+        config = testing.setUp()
+        try:
+            tracer = MemoryTracer()
+            form = self._make_form(tracer, {'name': 'ok'})
+            config.testing_add_renderer('form.mako').string_response = \
+                '<form><input name="name"></form>'
+            form.render('form.mako')
+        finally:
+            testing.tearDown()
+
+        span, = tracer.find('form.render')
+        self.assertEqual(span.attributes['template'], 'form.mako')
+        self.assertEqual([s.name for s in span.children],
+                         ['form.template', 'form.htmlfill'])
+
+        renderer = FormRenderer(form)
+        renderer.begin('/')
+        renderer.text('name')
+        renderer.end()
+        self.assertEqual(len(tracer.find('renderer.form')), 1)
+
+    def test_settings(self):
+        from pyramid_simpleform.instrumentation import MemoryTracer
+
+        config = testing.setUp(settings={
+            'simpleform.tracer':
+                'pyramid_simpleform.instrumentation.MemoryTracer'})
+        try:
+            config.include('pyramid_simpleform')
+            tracer = config.registry.simpleform_tracer
+            self.assertTrue(isinstance(tracer, MemoryTracer))
+            _make_form(post={'name': 'ok'}).validate()
+            self.assertEqual(len(tracer.find('form.validate')), 1)
+        finally:
+            testing.tearDown()
+
+
+@unittest.skipUnless(_has_tracemalloc, 'needs tracemalloc')
+class TestMemoryAccounting(unittest.TestCase):
+
+    def setUp(self):
+        from pyramid_simpleform.instrumentation import MemoryAccounting
+        self.accounting = MemoryAccounting()
+
+    def tearDown(self):
+        self.accounting.stop()
+
+    def test_measure(self):
+        form = SimpleObj()
+        form.schema = SimpleFESchema
+
+        with self.accounting.measure('render', form):
+            with self.accounting.measure('htmlfill', form):
+                data = [bytearray(1000) for i in range(100)]
+                del data
+            kept = bytearray(50000)
+
+        htmlfill = self.accounting.stats(SimpleFESchema, 'htmlfill')
+        render = self.accounting.stats(
+            'pyramid_simpleform.tests.SimpleFESchema', 'render')
+        self.assertEqual(htmlfill.calls, 1)
+        if self.accounting._reset_peak is not None:
+            self.assertTrue(htmlfill.peak >= 100000)
+        self.assertTrue(htmlfill.net < 10000)
+        self.assertTrue(render.peak >= htmlfill.peak)
+        self.assertTrue(render.net >= 50000)
+        self.assertEqual(sorted(self.accounting.stats()),
+                         [('pyramid_simpleform.tests.SimpleFESchema',
+                           'htmlfill'),
+                          ('pyramid_simpleform.tests.SimpleFESchema',
+                           'render')])
+
+        self.assertTrue(self.accounting.stats(SimpleFESchema,
+                                              'validate') is None)
+        with self.accounting.measure('other', form):
+            pass
+        self.accounting.clear()
+        self.assertEqual(self.accounting.stats(), {})
+
+    def test_strip_tracebacks(self):
+        from pyramid_simpleform.errors import strip_tracebacks
+
+        try:
+            formencode.ForEach(validators.Int()).to_python(['1', 'x'])
+        except formencode.Invalid as e:
+            error = e
+        self.assertTrue(error.error_list[1].__traceback__ is not None)
+        self.assertTrue(strip_tracebacks(error) is error)
+        self.assertTrue(error.__traceback__ is None)
+        self.assertTrue(error.error_list[1].__traceback__ is None)
+
+
+@unittest.skipUnless(_has_tracemalloc, 'needs tracemalloc')
+class TestMemoryCeilings(unittest.TestCase):
+    """
+    Allocation ceilings for a bulk form of 500 rows. If one of these
+    fails, something allocates much more than it used to.
+    """
+
+    ROWS = 500
+
+    def setUp(self):
+        from pyramid_simpleform import Form
+        from pyramid_simpleform.instrumentation import MemoryAccounting
+
+        class RowSchema(Schema):
+            email = validators.Email()
+            name = validators.String(max=50)
+            age = validators.Int()
+
+        class BulkSchema(Schema):
+            rows = formencode.ForEach(RowSchema())
+
+        self.schema = BulkSchema
+        self.accounting = MemoryAccounting()
+
+        class AccountedForm(Form):
+            instruments = [self.accounting]
+
+        self.form_class = AccountedForm
+        self.config = testing.setUp()
+        self.config.testing_add_renderer('bulk.mako').string_response = \
+            '<form>%s</form>' % ''.join(
+                '<input name="rows-%d.email"><input name="rows-%d.name">'
+                '<input name="rows-%d.age">' % (i, i, i)
+                for i in range(self.ROWS))
+
+    def tearDown(self):
+        self.accounting.stop()
+        testing.tearDown()
+
+    def _post(self, age):
+        post = {}
+        for i in range(self.ROWS):
+            post['rows-%d.email' % i] = 'user%d@example.com' % i
+            post['rows-%d.name' % i] = 'Name %d' % i
+            post['rows-%d.age' % i] = age
+        return post
+
+    def _measure(self, phase, make_request, render=False):
+        import gc
+
+        # the first form pays for plans, translations etc.
+        for i in range(2):
+            gc.collect()
+            form = self.form_class(make_request(), self.schema,
+                                   variable_decode=True)
+            form.validate()
+            if render:
+                form.render('bulk.mako')
+        return self.accounting.stats(self.schema, phase)
+
+    def test_validate(self):
+        stats = self._measure(
+            'validate', lambda: testing.DummyRequest(post=self._post('1')))
+        self.assertTrue(stats.peak < 1024 * 1024, stats)
+
+    def test_validate_errors(self):
+        stats = self._measure(
+            'validate', lambda: testing.DummyRequest(post=self._post('x')))
+        self.assertTrue(stats.peak < 4 * 1024 * 1024, stats)
+        # errors are kept without the validators' frames
+        self.assertTrue(stats.net < 1.6 * 1024 * 1024, stats)
+
+    def test_validate_json(self):
+        import json
+
+        body = json.dumps({'rows': [
+            {'email': 'user%d@example.com' % i, 'name': 'N%d' % i, 'age': i}
+            for i in range(self.ROWS)]}).encode('utf-8')
+
+        def make_request():
+            request = testing.DummyRequest()
+            request.method = 'POST'
+            request.body = body
+            request.content_type = 'application/json'
+            return request
+
+        stats = self._measure('validate', make_request)
+        self.assertTrue(stats.peak < 1024 * 1024, stats)
+
+    def test_render(self):
+        make_request = lambda: testing.DummyRequest(post=self._post('x'))
+        render = self._measure('render', make_request, render=True)
+        htmlfill = self.accounting.stats(self.schema, 'htmlfill')
+        self.assertTrue(render.peak < 2 * 1024 * 1024, render)
+        self.assertTrue(htmlfill.peak < 1.5 * 1024 * 1024, htmlfill)
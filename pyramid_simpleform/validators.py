@@ -0,0 +1,290 @@
+"""
+FormEncode validators for use with :class:`pyramid_simpleform.Form`.
+"""
+import hashlib
+import tempfile
+import threading
+
+from formencode import FancyValidator, Invalid, NoDefault, Validator
+
+from pyramid_simpleform.cache import LRUCache
+from pyramid_simpleform.errors import detach_state
+
+_ = lambda s: s
+
+MEMO_ENVIRON_KEY = 'pyramid_simpleform.memo'
+
+#: File signatures used by :func:`sniff_type`: a list of
+#: ``(content type, ((offset, bytes), ...))``.
+MAGIC = [
+    ('image/png', ((0, b'\x89PNG\r\n\x1a\n'),)),
+    ('image/jpeg', ((0, b'\xff\xd8\xff'),)),
+    ('image/gif', ((0, b'GIF87a'),)),
+    ('image/gif', ((0, b'GIF89a'),)),
+    ('image/webp', ((0, b'RIFF'), (8, b'WEBP'))),
+    ('application/pdf', ((0, b'%PDF-'),)),
+    ('application/zip', ((0, b'PK\x03\x04'),)),
+    ('application/gzip', ((0, b'\x1f\x8b'),)),
+]
+
+SNIFF_LENGTH = max(offset + len(sig)
+                   for content_type, sigs in MAGIC
+                   for offset, sig in sigs)
+
+
+def sniff_type(head):
+    """
+    Returns the content type of a file starting with the bytes `head`,
+    going by the signatures in :data:`MAGIC`, or **None** if unknown.
+    """
+    for content_type, sigs in MAGIC:
+        for offset, sig in sigs:
+            if head[offset:offset + len(sig)] != sig:
+                break
+        else:
+            return content_type
+    return None
+
+
+class UploadedFile(object):
+    """
+    An uploaded file that passed :class:`FileUpload`.
+
+    `filename` : the name of the file given by the client
+
+    `content_type` : the type found from the file contents, or the type
+    given by the client if it couldn't be found
+
+    `size` : size in bytes
+
+    `digest` : hex digest of the contents, or **None**
+
+    `file` : the contents, in a temporary file (in memory while small)
+    positioned at the start
+    """
+
+    def __init__(self, filename, content_type, size, digest, file):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.digest = digest
+        self.file = file
+
+    def __repr__(self):
+        return '<UploadedFile %r %s %d bytes>' % (
+            self.filename, self.content_type, self.size)
+
+
+class FileUpload(FancyValidator):
+    """
+    Validates an uploaded file (a field of a multipart request, with
+    ``file`` and ``filename`` attributes) without reading it into memory.
+
+    The file is read in chunks of ``chunk_size`` bytes, which are hashed and
+    copied into a spooled temporary file. Reading stops as soon as the file
+    turns out to be larger than ``max_size`` or, going by its first bytes,
+    not of one of the ``allowed_types``. The result is an
+    :class:`UploadedFile`.
+
+    `max_size` : maximum size in bytes, or **None**
+
+    `allowed_types` : list of allowed content types, as found by
+    :func:`sniff_type`, or **None** to allow any file
+
+    `hash_name` : name of the ``hashlib`` hash to compute, or **None**
+
+    `chunk_size` : bytes read at a time
+
+    `spool_size` : files larger than this are spooled to disk
+    """
+
+    max_size = None
+    allowed_types = None
+    hash_name = 'sha256'
+    chunk_size = 64 * 1024
+    spool_size = 1024 * 1024
+
+    messages = dict(
+        noFile=_('Please upload a file'),
+        tooLarge=_('The file is too large (at most %(max_size)i bytes '
+                   'are allowed)'),
+        badType=_('This type of file is not allowed'),
+    )
+
+    def _convert_to_python(self, value, state):
+        src = getattr(value, 'file', None)
+        if src is None:
+            raise Invalid(self.message('noFile', state), value, state)
+
+        if hasattr(src, 'seek'):
+            src.seek(0)
+
+        hasher = hashlib.new(self.hash_name) if self.hash_name else None
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        size = 0
+        head = b''
+        content_type = None
+        try:
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+
+                if len(head) < SNIFF_LENGTH:
+                    head += chunk[:SNIFF_LENGTH - len(head)]
+                    if len(head) >= SNIFF_LENGTH:
+                        content_type = self._check_type(head, value, state)
+
+                size += len(chunk)
+                if self.max_size is not None and size > self.max_size:
+                    raise Invalid(self.message('tooLarge', state,
+                                               max_size=self.max_size),
+                                  value, state)
+                if hasher is not None:
+                    hasher.update(chunk)
+                spool.write(chunk)
+
+            if len(head) < SNIFF_LENGTH:
+                content_type = self._check_type(head, value, state)
+        except Invalid:
+            spool.close()
+            raise
+
+        spool.seek(0)
+        return UploadedFile(
+            getattr(value, 'filename', None),
+            content_type or getattr(value, 'type', None),
+            size,
+            hasher.hexdigest() if hasher is not None else None,
+            spool)
+
+    def _check_type(self, head, value, state):
+        content_type = sniff_type(head)
+        if self.allowed_types is not None and \
+                content_type not in self.allowed_types:
+            raise Invalid(self.message('badType', state), value, state)
+        return content_type
+
+
+class Memoized(Validator):
+    """
+    Wraps an expensive validator whose result only depends on the value,
+    such as a DNS lookup or a check against a slowly changing table, and
+    remembers its results and errors by value::
+
+        class SignupSchema(Schema):
+            email = Memoized(validators.Email(resolve_domain=True), ttl=300)
+
+    Values which can't be hashed (lists and dicts) are always validated.
+    Results are kept per locale and per ``cache_key`` of the state, as with
+    the form result cache.
+
+    `validator` : the wrapped validator
+
+    `maxsize` : number of values remembered
+
+    `ttl` : seconds for which a result is remembered, or **None**
+
+    `per_request` : remember results for the current request only, for
+    validators which must see changes made by other requests. Needs the
+    request on the state, as set by :class:`pyramid_simpleform.Form`.
+
+    The number of ``hits`` and ``misses`` is counted; see :meth:`stats`.
+    """
+
+    __unpackargs__ = ('validator',)
+
+    validator = None
+    maxsize = 1024
+    ttl = None
+    per_request = False
+
+    def __initargs__(self, new_attrs):
+        self.cache = LRUCache(self.maxsize, ttl=self.ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def if_missing(self):
+        return getattr(self.validator, 'if_missing', NoDefault)
+
+    @property
+    def accept_iterator(self):
+        return getattr(self.validator, 'accept_iterator', False)
+
+    def subvalidators(self):
+        return [self.validator]
+
+    def message(self, msgName, state, **kw):
+        return self.validator.message(msgName, state, **kw)
+
+    def from_python(self, value, state=None):
+        return self.validator.from_python(value, state)
+
+    def to_python(self, value, state=None):
+        cache = self._get_cache(state)
+        request = getattr(state, 'request', None)
+        key = (value, getattr(request, 'locale_name', None),
+               getattr(state, 'cache_key', None))
+        try:
+            result = cache.get(key)
+        except TypeError:
+            # unhashable value
+            return self.validator.to_python(value, state)
+
+        if result is not None:
+            self._count(hit=True)
+            result, error = result
+            if error is not None:
+                # a new exception, as raising the cached one again would
+                # keep adding to its traceback
+                raise detach_state(error, state)
+            return result
+
+        self._count(hit=False)
+        try:
+            result = self.validator.to_python(value, state)
+        except Invalid as e:
+            # without the state, which refers to the form and request
+            cache[key] = (None, detach_state(e))
+            raise
+        cache[key] = (result, None)
+        return result
+
+    def _get_cache(self, state):
+        if not self.per_request:
+            return self.cache
+        request = getattr(state, 'request', None)
+        environ = getattr(request, 'environ', None)
+        if environ is None:
+            return {}
+        caches = environ.setdefault(MEMO_ENVIRON_KEY, {})
+        try:
+            return caches[id(self)]
+        except KeyError:
+            cache = caches[id(self)] = {}
+            return cache
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """
+        Returns a dict of the number of ``hits`` and ``misses`` and the
+        number of values in the (shared) cache, its ``size``.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.cache)}
+
+    def clear(self):
+        """
+        Forgets all remembered results and resets the stats.
+        """
+        self.cache.clear()
+        with self._lock:
+            self.hits = self.misses = 0
@@ -20,6 +20,7 @@ testing_extras = [
     'pyramid_mako',
     'pytest',
     'pytest-cov',
+    'SQLAlchemy',
 ]
 
 docs_extras = [
@@ -64,4 +65,8 @@ setup(
         'docs': docs_extras,
     },
     test_suite="pyramid_simpleform",
+    entry_points="""\
+    [console_scripts]
+    simpleform-compile = pyramid_simpleform.codecache:main
+    """,
 )